@@ -1,19 +1,33 @@
-from fastapi import APIRouter, HTTPException, Depends
-from typing import List, Dict, Any
+from fastapi import APIRouter, HTTPException, Depends, Header, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse
+from pydantic import ValidationError
+from typing import AsyncIterator, List, Dict, Any, Optional
+import json
+import secrets
+from app.core.config import settings
 from app.models.schemas import (
     ChatMessage, ChatResponse, MenuItem, SearchRequest, 
     SearchResponse, RecommendationRequest, RecommendationResponse, SessionInfo,
-    UserFeedback, ConversationMetrics, IntentAnalysis, EmotionAnalysis, EntityExtraction
+    UserFeedback, ConversationMetrics, IntentAnalysis, EmotionAnalysis, EntityExtraction,
+    MenuReloadRequest, MenuReloadResponse
 )
 from app.services.ai_service import AIService
+from app.services.menu_registry import get_menu_registry, get_menu_service, resolve_menu_path
+from app.services.menu_responses import EncodedResponse, accepts_gzip, etag_matches
 from app.services.menu_service import MenuService
 
 # 创建路由器
 api_router = APIRouter()
 
-# 初始化服务
+# 初始化服务（菜单由进程内共享的菜单注册表提供，AI服务与菜单接口使用同一份菜单）
 ai_service = AIService()
-menu_service = MenuService()
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """校验管理接口令牌（任何模式下都必须配置 ADMIN_TOKEN）"""
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="未配置管理令牌")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="管理令牌无效")
 
 @api_router.post("/chat", response_model=ChatResponse)
 async def chat_with_ai(request: ChatMessage):
@@ -22,17 +36,61 @@ async def chat_with_ai(request: ChatMessage):
         result = await ai_service.chat(
             message=request.message,
             session_id=request.session_id,
-            user_id=request.user_id
+            user_id=request.user_id,
+            use_cache=request.use_cache
         )
         return ChatResponse(**result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"聊天服务错误: {str(e)}")
 
+def _sse_event(event: Dict[str, Any]) -> str:
+    """把对话事件编码为一条 Server-Sent Events 消息"""
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+async def _sse_stream(request: ChatMessage) -> AsyncIterator[str]:
+    async for event in ai_service.chat_stream(
+        message=request.message,
+        session_id=request.session_id,
+        user_id=request.user_id,
+        use_cache=request.use_cache
+    ):
+        yield _sse_event(event)
+
+@api_router.post("/chat/stream")
+async def chat_stream(request: ChatMessage):
+    """流式对话（SSE）：先发送 analysis 事件，再逐段发送 token 事件，最后以 done（或 error）事件结束"""
+    return StreamingResponse(
+        _sse_stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket):
+    """流式对话（WebSocket）：每收到一条 ChatMessage JSON，依次推送与SSE相同的事件 {"event": ..., "data": ...}"""
+    await websocket.accept()
+    try:
+        while True:
+            try:
+                request = ChatMessage(**await websocket.receive_json())
+            except (ValueError, ValidationError) as e:
+                await websocket.send_json({"event": "error", "data": {"response": f"请求格式错误: {str(e)}"}})
+                continue
+            async for event in ai_service.chat_stream(
+                message=request.message,
+                session_id=request.session_id,
+                user_id=request.user_id,
+                use_cache=request.use_cache
+            ):
+                await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+
 @api_router.get("/session/{session_id}", response_model=SessionInfo)
 async def get_session_info(session_id: str):
     """获取会话信息（增强版）"""
     try:
-        session_info = ai_service.get_session_info(session_id)
+        session_info = await ai_service.get_session_info(session_id)
         if not session_info:
             raise HTTPException(status_code=404, detail="会话不存在")
         return SessionInfo(**session_info)
@@ -45,7 +103,7 @@ async def get_session_info(session_id: str):
 async def clear_session(session_id: str):
     """清除会话"""
     try:
-        success = ai_service.clear_session(session_id)
+        success = await ai_service.clear_session(session_id)
         if not success:
             raise HTTPException(status_code=404, detail="会话不存在")
         return {"message": "会话已清除", "session_id": session_id}
@@ -58,7 +116,7 @@ async def clear_session(session_id: str):
 async def cleanup_old_sessions(max_age_hours: int = 24):
     """清理过期会话"""
     try:
-        cleaned_count = ai_service.cleanup_old_sessions(max_age_hours)
+        cleaned_count = await ai_service.cleanup_old_sessions(max_age_hours)
         return {
             "message": f"已清理 {cleaned_count} 个过期会话",
             "max_age_hours": max_age_hours
@@ -123,7 +181,7 @@ async def submit_feedback(feedback: UserFeedback):
 async def get_conversation_metrics(session_id: str):
     """获取对话指标"""
     try:
-        session_info = ai_service.get_session_info(session_id)
+        session_info = await ai_service.get_session_info(session_id)
         if not session_info:
             raise HTTPException(status_code=404, detail="会话不存在")
         
@@ -145,16 +203,35 @@ async def get_conversation_metrics(session_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取对话指标失败: {str(e)}")
 
+def _encoded_menu_response(encoded: EncodedResponse, if_none_match: Optional[str],
+                           accept_encoding: Optional[str]) -> Response:
+    """返回预先序列化的菜单响应：客户端缓存仍有效时返回304，接受gzip时返回预先压缩的版本"""
+    use_gzip = encoded.gzip_body is not None and accepts_gzip(accept_encoding)
+    etag = encoded.gzip_etag if use_gzip else encoded.etag
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.MENU_CACHE_MAX_AGE_SECONDS}, must-revalidate",
+        "Vary": "Accept-Encoding"
+    }
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(content=encoded.gzip_body, media_type="application/json", headers=headers)
+    return Response(content=encoded.body, media_type="application/json", headers=headers)
+
 @api_router.get("/menu", response_model=List[MenuItem])
-async def get_menu():
+async def get_menu(menu_service: MenuService = Depends(get_menu_service),
+                   if_none_match: Optional[str] = Header(None), accept_encoding: Optional[str] = Header(None)):
     """获取完整菜单"""
     try:
-        return menu_service.get_all_menu_items()
+        encoded = menu_service.get_menu_response()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取菜单失败: {str(e)}")
+    return _encoded_menu_response(encoded, if_none_match, accept_encoding)
 
 @api_router.get("/menu/{item_id}", response_model=MenuItem)
-async def get_menu_item(item_id: str):
+async def get_menu_item(item_id: str, menu_service: MenuService = Depends(get_menu_service)):
     """根据ID获取菜品详情"""
     try:
         item = menu_service.get_menu_item_by_id(item_id)
@@ -167,7 +244,7 @@ async def get_menu_item(item_id: str):
         raise HTTPException(status_code=500, detail=f"获取菜品详情失败: {str(e)}")
 
 @api_router.post("/search", response_model=SearchResponse)
-async def search_menu(request: SearchRequest):
+async def search_menu(request: SearchRequest, menu_service: MenuService = Depends(get_menu_service)):
     """搜索菜品"""
     try:
         return menu_service.search_menu_items(request)
@@ -175,36 +252,87 @@ async def search_menu(request: SearchRequest):
         raise HTTPException(status_code=500, detail=f"搜索失败: {str(e)}")
 
 @api_router.get("/categories")
-async def get_categories():
+async def get_categories(menu_service: MenuService = Depends(get_menu_service),
+                         if_none_match: Optional[str] = Header(None), accept_encoding: Optional[str] = Header(None)):
     """获取所有菜品类别"""
     try:
-        return {"categories": menu_service.get_categories()}
+        encoded = menu_service.get_categories_response()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取类别失败: {str(e)}")
+    return _encoded_menu_response(encoded, if_none_match, accept_encoding)
 
 @api_router.get("/seasonal")
-async def get_seasonal_items():
+async def get_seasonal_items(menu_service: MenuService = Depends(get_menu_service),
+                             if_none_match: Optional[str] = Header(None), accept_encoding: Optional[str] = Header(None)):
     """获取季节性菜品"""
     try:
-        return {"items": menu_service.get_seasonal_items()}
-    except HTTPException:
-        raise
+        encoded = menu_service.get_seasonal_response()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取季节性菜品失败: {str(e)}")
+    return _encoded_menu_response(encoded, if_none_match, accept_encoding)
 
 @api_router.get("/popular")
-async def get_popular_items(limit: int = 5):
+async def get_popular_items(limit: int = 5, menu_service: MenuService = Depends(get_menu_service),
+                            if_none_match: Optional[str] = Header(None), accept_encoding: Optional[str] = Header(None)):
     """获取热门菜品"""
     try:
-        return {"items": menu_service.get_popular_items(limit)}
+        encoded = menu_service.get_popular_response(limit)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取热门菜品失败: {str(e)}")
+    return _encoded_menu_response(encoded, if_none_match, accept_encoding)
+
+@api_router.post("/admin/menu/reload", response_model=MenuReloadResponse, dependencies=[Depends(require_admin)])
+async def reload_menu(request: MenuReloadRequest):
+    """重新加载菜单（只接受菜单目录内的路径）：后台构建新菜单的索引，完成后原子替换，无需重启"""
+    try:
+        path = resolve_menu_path(request.path, settings.MENU_DIR)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    registry = get_menu_registry()
+    previous_version = registry.current.version
+    # 错误详情（可能包含菜单文件内容）只写入日志，不返回给客户端
+    try:
+        menu_service = await registry.reload(path)
+    except (OSError, ValueError) as e:
+        print(f"加载菜单 {path} 失败: {e}")
+        raise HTTPException(status_code=400, detail="加载菜单失败")
+    except Exception as e:
+        print(f"重新加载菜单 {path} 失败: {e}")
+        raise HTTPException(status_code=500, detail="重新加载菜单失败")
+    return MenuReloadResponse(
+        message="菜单已更新",
+        version=menu_service.version,
+        previous_version=previous_version,
+        item_count=menu_service.get_item_count()
+    )
+
+@api_router.get("/admin/llm-cache", dependencies=[Depends(require_admin)])
+async def get_llm_cache_stats():
+    """大模型回复缓存（精确匹配和语义缓存）的命中统计及相同调用的合并统计"""
+    return {
+        "exact": {"enabled": False} if ai_service.llm_cache is None
+        else {"enabled": True, **ai_service.llm_cache.stats()},
+        "semantic": {"enabled": False} if ai_service.semantic_cache is None
+        else {"enabled": True, **ai_service.semantic_cache.stats()},
+        "single_flight": {"enabled": False} if ai_service.llm_single_flight is None
+        else {"enabled": True, **ai_service.llm_single_flight.stats()}
+    }
+
+@api_router.get("/admin/session-reaper", dependencies=[Depends(require_admin)])
+async def get_session_reaper_stats():
+    """后台过期会话清理的运行统计"""
+    return ai_service.session_reaper.stats()
+
+@api_router.get("/admin/session-commit", dependencies=[Depends(require_admin)])
+async def get_session_commit_stats():
+    """会话批量保存的统计（待保存会话数、批次大小、版本冲突次数等）"""
+    return ai_service.session_committer.stats()
 
 @api_router.post("/recommendations", response_model=RecommendationResponse)
 async def get_recommendations(request: RecommendationRequest):
     """获取个性化推荐（增强版）"""
     try:
-        result = await ai_service.get_recommendations(request.user_preferences)
+        result = await ai_service.get_recommendations(request.user_preferences, use_cache=request.use_cache)
         return RecommendationResponse(**result)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取推荐失败: {str(e)}")
@@ -11,14 +11,84 @@ class Settings(BaseSettings):
     # OpenAI配置
     OPENAI_API_KEY: str = ""
     
+    # 大模型调用配置（LLM_PROVIDER=fake 时使用本地假模型，不访问网络）
+    LLM_PROVIDER: str = "openai"
+    LLM_MAX_CONCURRENCY: int = 256
+    LLM_TIMEOUT_SECONDS: float = 30.0
+    FAKE_LLM_LATENCY_SECONDS: float = 1.0
+    
+    # 大模型回复缓存（精确匹配；LLM_CACHE_DB_PATH 非空时同时持久化到SQLite）
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_MAX_ENTRIES: int = 1024
+    LLM_CACHE_TTL_SECONDS: float = 3600.0
+    LLM_CACHE_DB_PATH: str = ""
+    # 语义缓存（对话消息相近且上下文相同时复用回复，默认关闭）
+    SEMANTIC_CACHE_ENABLED: bool = False
+    SEMANTIC_CACHE_THRESHOLD: float = 0.8
+    SEMANTIC_CACHE_CAPACITY: int = 2048
+    # 合并同时进行的相同大模型调用（single-flight）
+    LLM_SINGLE_FLIGHT_ENABLED: bool = True
+    
+    # 对话上下文的token预算（系统提示词+历史摘要+最近消息+当前消息）；单条历史消息和滚动摘要的上限
+    CONTEXT_MAX_TOKENS: int = 2000
+    CONTEXT_MESSAGE_MAX_TOKENS: int = 300
+    CONTEXT_SUMMARY_MAX_TOKENS: int = 200
+    # 调试用：每轮额外按不裁剪的完整上下文计算一遍token数，报告预算节省了多少（会使组装提示词的开销翻倍）
+    CONTEXT_REPORT_BASELINE: bool = False
+    
     # Pinecone配置
     PINECONE_API_KEY: str = ""
     PINECONE_ENVIRONMENT: str = "us-east-1"
     PINECONE_INDEX_NAME: str = "foodaiagent"
     
+    # 本地向量索引（语义检索，默认关闭；VECTOR_INDEX_TYPE: flat / int8 / ivf）
+    SEMANTIC_SEARCH_ENABLED: bool = False
+    EMBEDDING_DIM: int = 256
+    VECTOR_INDEX_TYPE: str = "flat"
+    VECTOR_IVF_LISTS: int = 0
+    VECTOR_IVF_PROBES: int = 8
+    SEMANTIC_MIN_SIMILARITY: float = 0.1
+    SEMANTIC_CANDIDATES: int = 50
+    SEMANTIC_WEIGHT: float = 3.0
+    
+    # 只读菜单接口（/menu、/categories、/seasonal、/popular）的 Cache-Control max-age（秒，0 表示每次都用ETag重新验证），
+    # 以及响应体达到该字节数时提供预先压缩的gzip版本（不大于0时不压缩）
+    MENU_CACHE_MAX_AGE_SECONDS: int = 0
+    MENU_RESPONSE_GZIP_MIN_BYTES: int = 1024
+    
+    # 菜单目录：重新加载菜单接口只接受该目录内的菜单文件或制品目录（为空时不能通过接口重新加载）
+    MENU_DIR: str = ""
+    
+    # 预构建的菜单制品目录（python -m app.services.menu_artifact 生成；为空时使用示例菜单）
+    MENU_ARTIFACT_PATH: str = ""
+    
+    # 关键词词表（修改后由后台任务按间隔检查并热加载，不大于0时不检查）
+    LEXICON_PATH: str = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "lexicon.json")
+    LEXICON_RELOAD_INTERVAL_SECONDS: float = 2.0
+    
     # 数据库配置
     DATABASE_URL: str = "sqlite:///./foodaiagent.db"
     
+    # 会话存储配置（sqlite：使用DATABASE_URL；log：追加写日志文件）
+    SESSION_BACKEND: str = "sqlite"
+    # 内存中每个会话保留的最近消息数（更早的消息只在会话存储中）和最近的意图/情感/实体记录数
+    SESSION_HISTORY_WINDOW: int = 20
+    SESSION_SIGNAL_WINDOW: int = 5
+    SESSION_LEGACY_PICKLE_PATH: str = "user_sessions.pkl"
+    SESSION_LOG_PATH: str = "user_sessions.log"
+    # 追加写日志每次保存（批量保存时每批）刷盘一次；关闭后写入更快，但断电可能丢失最近已确认的对话
+    SESSION_LOG_FSYNC: bool = True
+    SESSION_LOG_COMPACT_MIN_BYTES: int = 1024 * 1024
+    # 会话修改批量保存的间隔（秒，不大于0时每轮对话结束立即保存）
+    SESSION_FLUSH_INTERVAL_SECONDS: float = 0.2
+    # 会话过期时间，以及后台清理的间隔（秒，不大于0时不启动后台清理）和每批删除的会话数
+    SESSION_TTL_HOURS: float = 24.0
+    SESSION_REAPER_INTERVAL_SECONDS: float = 60.0
+    SESSION_REAPER_BATCH_SIZE: int = 500
+    
+    # 管理接口令牌（请求头 X-Admin-Token）；未设置时管理接口不可用
+    ADMIN_TOKEN: str = ""
+    
     # API配置
     API_V1_STR: str = "/api"
     
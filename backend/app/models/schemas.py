@@ -6,6 +6,7 @@ class ChatMessage(BaseModel):
     message: str
     user_id: Optional[str] = None
     session_id: Optional[str] = None
+    use_cache: bool = True  # 为 False 时不使用大模型回复缓存
 
 class ChatResponse(BaseModel):
     response: str
@@ -17,6 +18,8 @@ class ChatResponse(BaseModel):
     intent_scores: Optional[Dict[str, float]] = None
     emotion_scores: Optional[Dict[str, float]] = None
     entities: Optional[Dict[str, Any]] = None
+    # 本轮提示词token数：prompt 实际发送，baseline 不做预算裁剪时的用量，saved 二者之差
+    prompt_tokens: Optional[Dict[str, int]] = None
 
 class SessionInfo(BaseModel):
     session_id: str
@@ -83,12 +86,22 @@ class SearchRequest(BaseModel):
     query: str
     filters: Optional[Dict[str, Any]] = None
     limit: int = 10
+    semantic: Optional[bool] = None
 
 class SearchResponse(BaseModel):
     results: List[MenuItem]
     total_count: int
     query: str
 
+class MenuReloadRequest(BaseModel):
+    path: str  # 菜单目录（MENU_DIR）内的 JSON/CSV 菜单文件或预构建的菜单制品目录，相对路径按菜单目录解析
+
+class MenuReloadResponse(BaseModel):
+    message: str
+    version: int
+    previous_version: int
+    item_count: int
+
 class RecommendationRequest(BaseModel):
     user_preferences: Dict[str, Any]
     dietary_restrictions: Optional[List[str]] = None
@@ -97,6 +110,7 @@ class RecommendationRequest(BaseModel):
     meal_time: Optional[str] = None
     group_size: Optional[int] = None
     occasion: Optional[str] = None
+    use_cache: bool = True
 
 class RecommendationResponse(BaseModel):
     recommendations: List[MenuItem]
@@ -5,20 +5,41 @@ from langchain.schema import HumanMessage, SystemMessage, AIMessage
 from langchain.prompts import PromptTemplate
 from langchain.memory import ConversationBufferMemory
 from langchain.chains import ConversationChain
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional, Tuple
+import asyncio
 import json
+import numpy as np
 import uuid
 import re
-import os
-import pickle
+import time
 from datetime import datetime, timedelta
 from app.core.config import settings
+from app.services.menu_scorer import MenuScorer
+from app.services.menu_registry import MenuRegistry, get_menu_registry
 from app.services.menu_service import MenuService
+from app.services.context_builder import ContextBuilder
+from app.services.fake_llm import FakeChatModel
+from app.services.lexicon import LexiconManager
+from app.services.llm_cache import LLMResponseCache, SemanticResponseCache, message_key, scope_digest
+from app.services.vector_index import HashingEmbedder
+from app.services.session_commit import SessionCommitter, SessionLocks
+from app.services.session_reaper import ExpiryIndex, SessionReaper
+from app.services.session_records import MessageWindow, RingBuffer, compact_session, plain_messages
+from app.services.session_store import create_session_store
+from app.services.single_flight import SingleFlight
 
 class AIService:
-    def __init__(self):
+    # 保存会话遇到版本冲突时的最大尝试次数，以及重试前随机等待的最长秒数
+    SAVE_CONFLICT_RETRIES = 10
+    SAVE_CONFLICT_BACKOFF_SECONDS = 0.02
+
+    def __init__(self, menu_registry: Optional[MenuRegistry] = None):
         # 检查API密钥是否设置
-        if not settings.OPENAI_API_KEY or settings.OPENAI_API_KEY == "YOUR_OPENAI_API_KEY_HERE":
+        if settings.LLM_PROVIDER == "fake":
+            self.client = None
+            self.chat_model = FakeChatModel(latency=settings.FAKE_LLM_LATENCY_SECONDS)
+            print("Using local fake chat model.")
+        elif not settings.OPENAI_API_KEY or settings.OPENAI_API_KEY == "YOUR_OPENAI_API_KEY_HERE":
             self.client = None
             self.chat_model = None
             print("Warning: OpenAI API key not set. Using fallback AI responses.")
@@ -27,38 +48,75 @@ class AIService:
             self.chat_model = ChatOpenAI(
                 model_name="gpt-3.5-turbo",
                 temperature=0.7,
-                openai_api_key=settings.OPENAI_API_KEY
+                openai_api_key=settings.OPENAI_API_KEY,
+                request_timeout=settings.LLM_TIMEOUT_SECONDS
             )
         
-        # 初始化菜单服务
-        self.menu_service = MenuService()
-        
-        # 会话存储文件路径
-        self.sessions_file = "user_sessions.pkl"
-        
-        # 加载持久化的用户会话
-        self.user_sessions: Dict[str, Dict[str, Any]] = self._load_sessions()
-        
-        # 意图识别关键词
-        self.intent_keywords = {
-            "recommendation": ["推荐", "建议", "吃什么", "选择", "点菜"],
-            "information": ["介绍", "说明", "详情", "特点", "营养"],
-            "comparison": ["比较", "对比", "哪个好", "区别"],
-            "preference": ["喜欢", "偏好", "口味", "习惯"],
-            "health": ["健康", "营养", "卡路里", "减肥", "养生"],
-            "allergy": ["过敏", "忌口", "不能吃", "安全"],
-            "seasonal": ["当季", "季节", "新鲜", "时令"],
-            "budget": ["价格", "便宜", "贵", "预算", "经济"]
-        }
-        
-        # 情感分析关键词
-        self.emotion_keywords = {
-            "positive": ["喜欢", "好吃", "满意", "推荐", "棒", "赞"],
-            "negative": ["难吃", "失望", "不好", "差", "讨厌"],
-            "neutral": ["一般", "还行", "普通", "正常"],
-            "excited": ["兴奋", "期待", "激动", "迫不及待"],
-            "worried": ["担心", "忧虑", "害怕", "紧张"]
-        }
+        # 限制同时进行的大模型调用数量（信号量在事件循环中首次调用时创建）
+        self.llm_max_concurrency = settings.LLM_MAX_CONCURRENCY
+        self.llm_semaphore: Optional[asyncio.Semaphore] = None
+        
+        # 大模型回复的精确匹配缓存（相同模型参数、菜单和完整消息列表直接复用回复）
+        self.llm_cache: Optional[LLMResponseCache] = None
+        if settings.LLM_CACHE_ENABLED:
+            self.llm_cache = LLMResponseCache(
+                max_entries=settings.LLM_CACHE_MAX_ENTRIES,
+                ttl=settings.LLM_CACHE_TTL_SECONDS,
+                db_path=settings.LLM_CACHE_DB_PATH or None
+            )
+        # 语义缓存：上下文相同、用户消息足够相近时复用对话回复（默认关闭）
+        self.semantic_cache: Optional[SemanticResponseCache] = None
+        if settings.SEMANTIC_CACHE_ENABLED:
+            self.semantic_cache = SemanticResponseCache(
+                capacity=settings.SEMANTIC_CACHE_CAPACITY,
+                threshold=settings.SEMANTIC_CACHE_THRESHOLD,
+                ttl=settings.LLM_CACHE_TTL_SECONDS,
+                embedder=HashingEmbedder(settings.EMBEDDING_DIM)
+            )
+        # 按token预算组装对话历史，较早的消息并入滚动摘要
+        self.context_builder = ContextBuilder(
+            max_tokens=settings.CONTEXT_MAX_TOKENS,
+            message_max_tokens=settings.CONTEXT_MESSAGE_MAX_TOKENS,
+            summary_max_tokens=settings.CONTEXT_SUMMARY_MAX_TOKENS
+        )
+        self.context_report_baseline = settings.CONTEXT_REPORT_BASELINE
+        # 相同提示词同时到达时只调用一次大模型，其余请求等待同一个结果
+        self.llm_single_flight: Optional[SingleFlight] = SingleFlight() if settings.LLM_SINGLE_FLIGHT_ENABLED else None
+        
+        # 菜单来自进程内共享的菜单注册表，重新加载菜单后自动使用新菜单
+        self.menu_registry = menu_registry if menu_registry is not None else get_menu_registry()
+        # 菜单版本 -> 系统提示词+菜单概要 / 推荐打分引擎，保留当前菜单和即将换上的新菜单两个版本
+        self._menu_context_cache: Dict[int, str] = {}
+        self._menu_scorer_cache: Dict[int, MenuScorer] = {}
+        self.menu_registry.add_warmer(self._warm_menu)
+        
+        # 可替换的会话存储（默认使用DATABASE_URL指向的SQLite），会话按需加载
+        self.session_store = create_session_store(settings)
+        
+        # 已加载会话的内存缓存，以及按最后活动时间排序的过期索引
+        self.user_sessions: Dict[str, Dict[str, Any]] = {}
+        self.session_expiry = ExpiryIndex()
+        # 同一会话的对话轮次串行执行；会话修改由后台定期批量保存
+        self.session_locks = SessionLocks()
+        self.session_committer = SessionCommitter(
+            self.session_store, self.user_sessions, self.session_locks, self._reload_session,
+            interval_seconds=settings.SESSION_FLUSH_INTERVAL_SECONDS,
+            max_retries=self.SAVE_CONFLICT_RETRIES,
+            backoff_seconds=self.SAVE_CONFLICT_BACKOFF_SECONDS
+        )
+        # 后台定期清理过期会话（由应用启动时 start）
+        self.session_reaper = SessionReaper(
+            self,
+            ttl_seconds=settings.SESSION_TTL_HOURS * 3600,
+            interval_seconds=settings.SESSION_REAPER_INTERVAL_SECONDS,
+            batch_size=settings.SESSION_REAPER_BATCH_SIZE
+        )
+        
+        # 意图、情感、实体等关键词表来自可热加载的词表文件
+        self.lexicon_manager = LexiconManager(
+            settings.LEXICON_PATH,
+            check_interval=settings.LEXICON_RELOAD_INTERVAL_SECONDS
+        )
         
         # 系统提示词
         self.system_prompt = """你是一个专业的PalonaAI菜品推荐助手。你的任务是：
@@ -86,142 +144,111 @@ class AIService:
 - 考虑用户的健康需求和饮食限制
 - 适时询问更多信息以提供更精准的推荐"""
 
-    def _load_sessions(self) -> Dict[str, Dict[str, Any]]:
-        """从文件加载会话数据"""
-        try:
-            if os.path.exists(self.sessions_file):
-                with open(self.sessions_file, 'rb') as f:
-                    sessions = pickle.load(f)
-                print(f"已加载 {len(sessions)} 个会话")
-                return sessions
-        except Exception as e:
-            print(f"加载会话数据失败: {e}")
-        return {}
+    async def _get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """获取会话（优先内存，未命中时从会话存储按需加载）
 
-    def _save_sessions(self):
-        """保存会话数据到文件"""
-        try:
-            with open(self.sessions_file, 'wb') as f:
-                pickle.dump(self.user_sessions, f)
-            print(f"已保存 {len(self.user_sessions)} 个会话")
-        except Exception as e:
-            print(f"保存会话数据失败: {e}")
+        会话存储被多个 worker 共用时，内存中的会话先与存储中的版本核对，已被其他进程修改或删除则重新加载。
+        """
+        session = self.user_sessions.get(session_id)
+        # 有待保存修改的会话保持不变：保存时若发现版本冲突，会在最新版本上重放这些修改
+        if session is not None and self.session_store.shared and not self.session_committer.is_dirty(session_id):
+            if await self.session_store.current_version(session_id) != session.get("version"):
+                del self.user_sessions[session_id]
+                session = None
+        if session is None:
+            session = await self._load_session(session_id)
+        return session
+
+    async def _load_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """从会话存储加载会话并放入内存（替换内存中已有的版本）"""
+        session = await self.session_store.load(session_id)
+        if session is not None:
+            session = self.user_sessions[session_id] = compact_session(
+                session, settings.SESSION_HISTORY_WINDOW, settings.SESSION_SIGNAL_WINDOW
+            )
+            self.session_expiry.touch(session_id, session["last_activity"].timestamp())
+        return session
+
+    def _analyze_message(self, message: str) -> Dict[str, Any]:
+        """一次扫描消息，得到意图、情感、实体和偏好信号"""
+        results = self.lexicon_manager.current.analyzer.analyze(message)
+        entities = {
+            "cuisine_types": results["cuisine_types"],
+            "taste_preferences": results["taste_preferences"],
+            "dietary_restrictions": results["dietary_restrictions"],
+            "budget_range": results["budget_range"],
+            "meal_type": None,
+            "cooking_method": None
+        }
+        return {
+            "intent_scores": results["intent"],
+            "emotion_scores": results["emotion"],
+            "entities": entities,
+            "preference_signals": {
+                "meal_time": results["meal_time"],
+                "occasion": results["occasion"]
+            }
+        }
 
     def _detect_intent(self, message: str) -> Dict[str, float]:
         """检测用户意图"""
-        message_lower = message.lower()
-        intent_scores = {}
-        
-        for intent, keywords in self.intent_keywords.items():
-            score = sum(1 for keyword in keywords if keyword in message_lower)
-            if score > 0:
-                intent_scores[intent] = score / len(keywords)
-        
-        return intent_scores
+        return self._analyze_message(message)["intent_scores"]
 
     def _analyze_emotion(self, message: str) -> Dict[str, float]:
         """分析用户情感"""
-        message_lower = message.lower()
-        emotion_scores = {}
-        
-        for emotion, keywords in self.emotion_keywords.items():
-            score = sum(1 for keyword in keywords if keyword in message_lower)
-            if score > 0:
-                emotion_scores[emotion] = score / len(keywords)
-        
-        return emotion_scores
+        return self._analyze_message(message)["emotion_scores"]
 
     def _extract_entities(self, message: str) -> Dict[str, Any]:
         """提取实体信息"""
-        entities = {
-            "cuisine_types": [],
-            "taste_preferences": [],
-            "dietary_restrictions": [],
-            "budget_range": None,
-            "meal_type": None,
-            "cooking_method": None
-        }
-        
-        # 菜系类型
-        cuisine_patterns = {
-            "chinese": ["中餐", "中国菜", "川菜", "粤菜", "湘菜", "鲁菜"],
-            "western": ["西餐", "意大利", "法国", "美式", "pizza", "pasta"],
-            "japanese": ["日料", "日本", "寿司", "刺身", "拉面"],
-            "korean": ["韩料", "韩国", "烤肉", "泡菜"],
-            "thai": ["泰餐", "泰国", "冬阴功", "咖喱"],
-            "indian": ["印度", "咖喱", "香料"]
-        }
-        
-        for cuisine, patterns in cuisine_patterns.items():
-            if any(pattern in message for pattern in patterns):
-                entities["cuisine_types"].append(cuisine)
-        
-        # 口味偏好
-        taste_patterns = {
-            "spicy": ["辣", "麻辣", "重口味", "香辣"],
-            "mild": ["清淡", "不辣", "原味", "养生"],
-            "sweet": ["甜", "糖醋", "蜜汁"],
-            "sour": ["酸", "醋", "柠檬"],
-            "bitter": ["苦", "苦瓜", "咖啡"]
-        }
-        
-        for taste, patterns in taste_patterns.items():
-            if any(pattern in message for pattern in patterns):
-                entities["taste_preferences"].append(taste)
-        
-        # 饮食限制
-        restriction_patterns = {
-            "vegetarian": ["素食", "不吃肉", "蔬菜"],
-            "vegan": ["纯素", "不吃蛋奶"],
-            "gluten_free": ["无麸质", "麸质过敏"],
-            "dairy_free": ["无乳糖", "乳糖不耐"],
-            "nut_free": ["坚果过敏", "不吃坚果"],
-            "seafood_free": ["海鲜过敏", "不吃海鲜", "对海鲜过敏", "海鲜过敏", "不能吃海鲜"]
-        }
-        
-        for restriction, patterns in restriction_patterns.items():
-            if any(pattern in message for pattern in patterns):
-                entities["dietary_restrictions"].append(restriction)
-        
-        # 预算范围
-        budget_patterns = {
-            "low": ["便宜", "经济", "实惠", "平价"],
-            "medium": ["中等", "适中", "一般"],
-            "high": ["高档", "豪华", "精致", "贵"]
-        }
-        
-        for budget, patterns in budget_patterns.items():
-            if any(pattern in message for pattern in patterns):
-                entities["budget_range"] = budget
-                break
-        
-        return entities
+        return self._analyze_message(message)["entities"]
+
+    def _append_message(self, session: Dict[str, Any], message: Dict[str, Any]):
+        """追加一条对话消息并更新消息总数"""
+        session["conversation_history"].append(message)
+        session["conversation_length"] = self._conversation_length(session) + 1
+
+    def _conversation_length(self, session: Dict[str, Any]) -> int:
+        """对话消息总数（内存中的历史可能只是最近的窗口）"""
+        return session.get("conversation_length", len(session.get("conversation_history", [])))
 
-    def _get_or_create_session(self, session_id: str, user_id: str = None) -> Dict[str, Any]:
+    async def _get_or_create_session(self, session_id: str, user_id: str = None) -> Dict[str, Any]:
         """获取或创建用户会话"""
-        if session_id not in self.user_sessions:
-            self.user_sessions[session_id] = {
-                "session_id": session_id,
-                "user_id": user_id,
-                "created_at": datetime.now(),
-                "last_activity": datetime.now(),
-                "conversation_history": [],
-                "user_preferences": {},
-                "interaction_count": 0,
-                "intent_history": [],
-                "emotion_history": [],
-                "entity_history": []
-            }
-            # 保存新会话
-            self._save_sessions()
+        session = await self._get_session(session_id)
+        if session is None:
+            session = self._new_session(session_id, user_id)
         else:
-            # 更新最后活动时间
-            self.user_sessions[session_id]["last_activity"] = datetime.now()
-            self.user_sessions[session_id]["interaction_count"] += 1
+            self._touch_session(session)
+        self.session_expiry.touch(session_id, session["last_activity"].timestamp())
         
-        return self.user_sessions[session_id]
+        return session
+
+    def _new_session(self, session_id: str, user_id: Optional[str]) -> Dict[str, Any]:
+        """新建会话并放入内存（新会话在本轮对话结束时随其他修改一起保存）"""
+        session = {
+            "session_id": session_id,
+            "user_id": user_id,
+            "created_at": datetime.now(),
+            "last_activity": datetime.now(),
+            # 定长的热历史：更早的消息在保存时写入会话存储
+            "conversation_history": MessageWindow(maxlen=settings.SESSION_HISTORY_WINDOW),
+            "conversation_length": 0,
+            "user_preferences": {},
+            "interaction_count": 0,
+            "intent_history": RingBuffer(maxlen=settings.SESSION_SIGNAL_WINDOW),
+            "emotion_history": RingBuffer(maxlen=settings.SESSION_SIGNAL_WINDOW),
+            "entity_history": RingBuffer(maxlen=settings.SESSION_SIGNAL_WINDOW)
+        }
+        self.user_sessions[session_id] = session
+        return session
+
+    @staticmethod
+    def _touch_session(session: Dict[str, Any]):
+        """已有会话开始新一轮对话：更新最后活动时间，交互次数加1"""
+        session["last_activity"] = datetime.now()
+        session["interaction_count"] += 1
 
-    def _update_user_preferences(self, session_id: str, message: str, ai_response: str, entities: Dict[str, Any]):
+    def _update_user_preferences(self, session_id: str, message: str, ai_response: str, entities: Dict[str, Any],
+                                 preference_signals: Optional[Dict[str, Any]] = None):
         """更新用户偏好（增强版）"""
         session = self.user_sessions[session_id]
         preferences = session.get("user_preferences", {})
@@ -245,16 +272,13 @@ class AIService:
         if entities.get("budget_range"):
             preferences["budget_preference"] = entities["budget_range"]
         
-        # 检测其他偏好
-        message_lower = message.lower()
+        # 检测其他偏好（用餐时间、场合在分析消息时已一并识别）
+        if preference_signals is None:
+            preference_signals = self._analyze_message(message)["preference_signals"]
         
         # 检测用餐时间
-        if any(word in message_lower for word in ['早餐', '早上', '早饭']):
-            preferences["meal_time"] = "breakfast"
-        elif any(word in message_lower for word in ['午餐', '中午', '午饭']):
-            preferences["meal_time"] = "lunch"
-        elif any(word in message_lower for word in ['晚餐', '晚上', '晚饭']):
-            preferences["meal_time"] = "dinner"
+        if preference_signals.get("meal_time"):
+            preferences["meal_time"] = preference_signals["meal_time"]
         
         # 检测用餐人数
         people_match = re.search(r'(\d+)个人?', message)
@@ -262,161 +286,480 @@ class AIService:
             preferences["group_size"] = int(people_match.group(1))
         
         # 检测特殊场合
-        if any(word in message_lower for word in ['约会', '情侣', '浪漫']):
-            preferences["occasion"] = "romantic"
-        elif any(word in message_lower for word in ['聚会', '朋友', '庆祝']):
-            preferences["occasion"] = "party"
-        elif any(word in message_lower for word in ['商务', '工作', '会议']):
-            preferences["occasion"] = "business"
+        if preference_signals.get("occasion"):
+            preferences["occasion"] = preference_signals["occasion"]
         
         session["user_preferences"] = preferences
-        # 保存更新的会话数据
-        self._save_sessions()
+
+    @property
+    def menu_service(self) -> MenuService:
+        """当前生效的菜单"""
+        return self.menu_registry.current
+
+    @staticmethod
+    def _versioned(cache: Dict[int, Any], version: int, build) -> Any:
+        """按菜单版本缓存派生数据，只保留最近的两个版本"""
+        value = cache.get(version)
+        if value is None:
+            value = cache[version] = build()
+            while len(cache) > 2:
+                cache.pop(next(iter(cache)), None)
+        return value
+
+    def _warm_menu(self, menu_service: MenuService) -> Callable[[], None]:
+        """在线程池中预先生成新菜单的菜单概要和推荐打分引擎，返回在事件循环中写入缓存的函数"""
+        version = menu_service.version
+        context = self._build_menu_context(menu_service)
+        scorer = self._build_menu_scorer(menu_service)
+
+        def install():
+            self._versioned(self._menu_context_cache, version, lambda: context)
+            self._versioned(self._menu_scorer_cache, version, lambda: scorer)
+        return install
+
+    def _get_menu_context(self, menu_service: Optional[MenuService] = None) -> str:
+        """系统提示词加菜单概要，按菜单版本缓存，菜单变更后才重新生成"""
+        menu_service = menu_service or self.menu_service
+        return self._versioned(
+            self._menu_context_cache, menu_service.version, lambda: self._build_menu_context(menu_service)
+        )
+
+    def _build_menu_context(self, menu_service: MenuService) -> str:
+        return self.system_prompt + self._render_menu_summary(menu_service)
+
+    def _render_menu_summary(self, menu_service: Optional[MenuService] = None) -> str:
+        """生成菜单概要文本（每个类别只取前3道菜，不需要解析整份菜单）"""
+        menu_service = menu_service or self.menu_service
+        counts = menu_service.get_category_counts()
+        
+        parts = [f"\n\n菜单信息：我们共有{menu_service.get_item_count()}道菜品，包括：\n"]
+        for category, count in counts.items():
+            items = menu_service.get_items_by_category(category, limit=3)
+            parts.append(f"- {category}：{', '.join([f'{item.name}(¥{item.price})' for item in items])}")
+            if count > 3:
+                parts.append(f"等{count}道菜")
+            parts.append("\n")
+        return "".join(parts)
 
     def _build_conversation_context(self, session_id: str) -> str:
-        """构建对话上下文（增强版）"""
+        """构建完整的对话上下文（偏好JSON和原始意图、情感得分全部拼入，作为提示词用量的对比基准）"""
         session = self.user_sessions[session_id]
-        context = self.system_prompt
-        
-        # 添加菜单信息
-        menu_items = self.menu_service.get_all_menu_items()
-        context += f"\n\n菜单信息：我们共有{len(menu_items)}道菜品，包括：\n"
-        
-        # 按类别组织菜单
-        categories = {}
-        for item in menu_items:
-            if item.category not in categories:
-                categories[item.category] = []
-            categories[item.category].append(item)
-        
-        for category, items in categories.items():
-            context += f"- {category}：{', '.join([f'{item.name}(¥{item.price})' for item in items[:3]])}"
-            if len(items) > 3:
-                context += f"等{len(items)}道菜"
-            context += "\n"
+        # 菜单部分取缓存，只拼接会话相关的部分
+        parts = [self._get_menu_context()]
         
         # 添加用户偏好信息
         preferences = session.get("user_preferences", {})
         if preferences:
-            context += f"\n\n用户偏好信息：{json.dumps(preferences, ensure_ascii=False)}"
+            parts.append(f"\n\n用户偏好信息：{json.dumps(preferences, ensure_ascii=False)}")
         
         # 添加意图历史
         intent_history = session.get("intent_history", [])
         if intent_history:
             recent_intents = intent_history[-5:]  # 最近5个意图
-            context += f"\n\n最近的用户意图：{recent_intents}"
+            parts.append(f"\n\n最近的用户意图：{recent_intents}")
         
         # 添加情感历史
         emotion_history = session.get("emotion_history", [])
         if emotion_history:
             recent_emotions = emotion_history[-5:]  # 最近5个情感
-            context += f"\n\n最近的情感状态：{recent_emotions}"
+            parts.append(f"\n\n最近的情感状态：{recent_emotions}")
         
-        return context
+        return "".join(parts)
 
-    async def chat(self, message: str, session_id: str = None, user_id: str = None, user_preferences: Dict[str, Any] = None) -> Dict[str, Any]:
-        """处理用户对话（增强版）"""
-        if not session_id:
-            session_id = str(uuid.uuid4())
+    def _build_session_context(self, session: Dict[str, Any]) -> str:
+        """构建精简的对话上下文：只保留非空的偏好，意图和情感只保留每轮得分最高的一项"""
+        parts = [self._get_menu_context()]
+        
+        preferences = {key: value for key, value in session.get("user_preferences", {}).items() if value}
+        if preferences:
+            parts.append(f"\n\n用户偏好信息：{json.dumps(preferences, ensure_ascii=False, separators=(',', ':'))}")
+        
+        recent_intents = self._top_labels(session.get("intent_history", [])[-5:])
+        if recent_intents:
+            parts.append(f"\n\n最近的用户意图：{'、'.join(recent_intents)}")
         
-        # 获取或创建会话
-        session = self._get_or_create_session(session_id, user_id)
+        recent_emotions = self._top_labels(session.get("emotion_history", [])[-5:])
+        if recent_emotions:
+            parts.append(f"\n\n最近的情感状态：{'、'.join(recent_emotions)}")
         
-        # 分析用户输入
-        intent_scores = self._detect_intent(message)
-        emotion_scores = self._analyze_emotion(message)
-        entities = self._extract_entities(message)
+        return "".join(parts)
+
+    @staticmethod
+    def _top_labels(history: List[Dict[str, float]]) -> List[str]:
+        """每轮得分最高且大于0的标签（按时间顺序）"""
+        labels = []
+        for scores in history:
+            if scores:
+                label, score = max(scores.items(), key=lambda x: x[1])
+                if score > 0:
+                    labels.append(label)
+        return labels
+
+    def _llm_params(self) -> Dict[str, Any]:
+        """影响回复内容的模型参数（缓存键的一部分）"""
+        return {
+            "provider": settings.LLM_PROVIDER,
+            "model": getattr(self.chat_model, "model_name", type(self.chat_model).__name__),
+            "temperature": getattr(self.chat_model, "temperature", None)
+        }
+
+    async def _invoke_llm(self, messages: List[Any], use_cache: bool = True) -> Any:
+        """异步调用大模型：先查回复缓存；未命中时合并相同的进行中调用，受并发上限约束，并对单次调用设置超时"""
+        cache_key, content = await self._cached_reply(messages, use_cache)
+        if content is not None:
+            return AIMessage(content=content)
+        
+        # 要求不使用缓存的请求总是单独调用，拿到新生成的回复
+        if cache_key is not None and self.llm_single_flight is not None:
+            return await self.llm_single_flight.do(cache_key, lambda: self._call_llm(messages, cache_key))
+        return await self._call_llm(messages, cache_key)
+    
+    async def _cached_reply(self, messages: List[Any], use_cache: bool) -> Tuple[Optional[str], Optional[str]]:
+        """计算提示词键并查精确缓存，返回 (键, 缓存的回复)；不使用缓存时键为 None"""
+        if not use_cache or (self.llm_cache is None and self.llm_single_flight is None):
+            return None, None
+        menu_fingerprint = self.menu_service.fingerprint
+        cache_key = message_key(self._llm_params(), messages, menu_fingerprint)
+        if self.llm_cache is None:
+            return cache_key, None
+        await self.llm_cache.bind_menu(menu_fingerprint)
+        return cache_key, await self.llm_cache.get(cache_key)
+    
+    async def _stream_llm(self, messages: List[Any], use_cache: bool = True) -> AsyncIterator[str]:
+        """流式调用大模型，逐段产出回复文本
+
+        命中精确缓存时一次产出整段回复；否则占用一个并发名额直到流结束，
+        整个流受同一超时约束，完整生成后写入回复缓存。流式调用不与其他请求合并。
+        """
+        cache_key, content = await self._cached_reply(messages, use_cache)
+        if content is not None:
+            yield content
+            return
+        
+        if self.llm_semaphore is None:
+            self.llm_semaphore = asyncio.Semaphore(self.llm_max_concurrency)
+        async with self.llm_semaphore:
+            deadline = time.monotonic() + settings.LLM_TIMEOUT_SECONDS
+            chunks = self.chat_model.astream(messages).__aiter__()
+            parts = []
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=max(deadline - time.monotonic(), 0))
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        raise TimeoutError(f"AI服务响应超时（{settings.LLM_TIMEOUT_SECONDS}秒）")
+                    if chunk.content:
+                        parts.append(chunk.content)
+                        yield chunk.content
+            finally:
+                if hasattr(chunks, "aclose"):
+                    await chunks.aclose()
+        if cache_key is not None and self.llm_cache is not None:
+            await self.llm_cache.put(cache_key, "".join(parts))
+    
+    async def _call_llm(self, messages: List[Any], cache_key: Optional[str] = None) -> Any:
+        """实际调用大模型，成功后写入回复缓存"""
+        if self.llm_semaphore is None:
+            self.llm_semaphore = asyncio.Semaphore(self.llm_max_concurrency)
+        async with self.llm_semaphore:
+            try:
+                response = await asyncio.wait_for(
+                    self.chat_model.ainvoke(messages),
+                    timeout=settings.LLM_TIMEOUT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"AI服务响应超时（{settings.LLM_TIMEOUT_SECONDS}秒）")
+        if cache_key is not None and self.llm_cache is not None:
+            await self.llm_cache.put(cache_key, response.content)
+        return response
+
+    def _semantic_scope(self, session: Dict[str, Any], history: List[Dict[str, Any]], intent_scores: Dict[str, float],
+                        entities: Dict[str, Any]) -> str:
+        """语义缓存的上下文摘要：模型参数、菜单、会话偏好、近期历史及更早对话的摘要，以及本条消息识别出的意图和实体"""
+        menu_fingerprint = self.menu_service.fingerprint
+        self.semantic_cache.bind_menu(menu_fingerprint)
+        primary_intent = max(intent_scores.items(), key=lambda x: x[1])[0] if intent_scores else None
+        return scope_digest(
+            self._llm_params(),
+            menu_fingerprint,
+            session.get("user_preferences", {}),
+            [(msg["role"], msg["content"]) for msg in history],
+            session.get(ContextBuilder.SUMMARY_FIELD, {}).get("lines"),
+            primary_intent,
+            entities
+        )
+
+    async def chat(self, message: str, session_id: str = None, user_id: str = None, user_preferences: Dict[str, Any] = None,
+                   use_cache: bool = True) -> Dict[str, Any]:
+        """处理用户对话（增强版）；use_cache=False 时不使用回复缓存"""
+        if not session_id:
+            session_id = str(uuid.uuid4())
         
-        # 更新会话历史
-        session["intent_history"].append(intent_scores)
-        session["emotion_history"].append(emotion_scores)
-        session["entity_history"].append(entities)
+        # 同一会话的对话轮次依次进行
+        async with self.session_locks.hold(session_id):
+            return await self._chat_turn(message, session_id, user_id, use_cache)
+
+    async def _chat_turn(self, message: str, session_id: str, user_id: Optional[str], use_cache: bool) -> Dict[str, Any]:
+        # 获取或创建会话并分析用户输入（一次扫描）
+        session, analysis = await self._begin_turn(session_id, user_id, message)
         
         # 检查AI服务是否可用
         if not self.chat_model:
             # 使用智能fallback回复
-            fallback_response = self._get_enhanced_fallback_response(message, session, intent_scores, emotion_scores, entities)
-            return {
-                "response": fallback_response,
-                "recommendations": [],
-                "session_id": session_id,
-                "user_preferences": session.get("user_preferences", {}),
-                "conversation_length": len(session.get("conversation_history", [])),
-                "intent_scores": intent_scores,
-                "emotion_scores": emotion_scores,
-                "entities": entities
-            }
+            return await self._finish_fallback_turn(session_id, session, message, analysis)
         
-        # 构建对话上下文
-        context = self._build_conversation_context(session_id)
+        # 构建对话上下文和消息列表
+        messages, history, usage = self._build_chat_messages(session_id, session, message)
         
-        # 创建消息列表
-        messages = [SystemMessage(content=context)]
+        try:
+            # 获取AI回复：语义缓存中有上下文相同、消息相近的回复时直接复用
+            semantic_scope = self._semantic_scope_for(session, history, analysis, use_cache)
+            content = self._semantic_lookup(message, semantic_scope)
+            if content is None:
+                start = time.perf_counter()
+                response = await self._invoke_llm(messages, use_cache=use_cache)
+                content = response.content
+                self._semantic_add(message, semantic_scope, content, time.perf_counter() - start)
+            
+            return await self._finish_turn(session_id, session, message, content, analysis, usage)
+        except Exception as e:
+            return self._error_result(session_id, session, analysis, e)
+
+    async def chat_stream(self, message: str, session_id: str = None, user_id: str = None,
+                          use_cache: bool = True) -> AsyncIterator[Dict[str, Any]]:
+        """流式处理用户对话，依次产出事件：
+
+        analysis（意图、情感、实体，调用大模型之前即可得到）-> 若干 token（回复片段）-> done（与 chat() 的返回相同，
+        含推荐和更新后的偏好）；出错时以 error 事件结束。会话只在回复完整生成后保存一次，中途断开不写入对话历史。
+        """
+        if not session_id:
+            session_id = str(uuid.uuid4())
+        async with self.session_locks.hold(session_id):
+            stream = self._chat_stream_turn(message, session_id, user_id, use_cache)
+            try:
+                async for event in stream:
+                    yield event
+            finally:
+                await stream.aclose()
+
+    async def _chat_stream_turn(self, message: str, session_id: str, user_id: Optional[str],
+                                use_cache: bool) -> AsyncIterator[Dict[str, Any]]:
+        try:
+            session, analysis = await self._begin_turn(session_id, user_id, message)
+        except Exception as e:
+            # 会话加载失败（存储出错、数据损坏等）：响应已经开始，同样以 error 事件结束
+            yield {"event": "error", "data": {
+                "response": f"抱歉，处理您的请求时出现了错误: {str(e)}",
+                "session_id": session_id
+            }}
+            return
+        yield {"event": "analysis", "data": {
+            "session_id": session_id,
+            "intent_scores": analysis["intent_scores"],
+            "emotion_scores": analysis["emotion_scores"],
+            "entities": analysis["entities"]
+        }}
         
-        # 添加历史对话（最多10轮）
-        history = session.get("conversation_history", [])
-        for msg in history[-20:]:  # 最多20条历史消息
+        try:
+            if not self.chat_model:
+                result = await self._finish_fallback_turn(session_id, session, message, analysis)
+                yield {"event": "token", "data": {"text": result["response"]}}
+                yield {"event": "done", "data": result}
+                return
+            
+            messages, history, usage = self._build_chat_messages(session_id, session, message)
+            semantic_scope = self._semantic_scope_for(session, history, analysis, use_cache)
+            content = self._semantic_lookup(message, semantic_scope)
+            if content is not None:
+                yield {"event": "token", "data": {"text": content}}
+            else:
+                start = time.perf_counter()
+                parts = []
+                stream = self._stream_llm(messages, use_cache=use_cache)
+                try:
+                    async for text in stream:
+                        parts.append(text)
+                        yield {"event": "token", "data": {"text": text}}
+                finally:
+                    # 客户端中途断开时立即结束模型调用，释放并发名额
+                    await stream.aclose()
+                content = "".join(parts)
+                self._semantic_add(message, semantic_scope, content, time.perf_counter() - start)
+            result = await self._finish_turn(session_id, session, message, content, analysis, usage)
+        except Exception as e:
+            result = self._error_result(session_id, session, analysis, e)
+            yield {"event": "error", "data": result}
+            return
+        yield {"event": "done", "data": result}
+
+    async def _begin_turn(self, session_id: str, user_id: Optional[str], message: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """取得会话、分析本轮消息并记录分析结果（调用方持有会话锁）"""
+        session = await self._get_or_create_session(session_id, user_id)
+        analysis = self._analyze_message(message)
+        self._record_analysis(session, analysis)
+        return session, analysis
+
+    def _replay_begin(self, session: Dict[str, Any], analysis: Dict[str, Any]):
+        """在另一个会话对象上重做 _begin_turn 的修改（已有对话的会话才计入交互次数，与 _get_or_create_session 相同）"""
+        if session.get("intent_history"):
+            self._touch_session(session)
+        self._record_analysis(session, analysis)
+
+    @staticmethod
+    def _record_analysis(session: Dict[str, Any], analysis: Dict[str, Any]):
+        session["intent_history"].append(analysis["intent_scores"])
+        session["emotion_history"].append(analysis["emotion_scores"])
+        session["entity_history"].append(analysis["entities"])
+
+    async def _persist_turn(self, session_id: str, session: Dict[str, Any],
+                            replay: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+        """登记本轮修改后的会话待保存（调用方持有会话锁），返回最新的会话
+
+        replay 在另一个会话对象上重放本轮的修改，保存时发生版本冲突时用于在最新的会话上重做。
+        延迟保存时由后台批量写入，否则立即保存。
+        """
+        self.session_committer.mark_dirty(session_id, replay)
+        if not self.session_committer.deferred:
+            await self.session_committer.flush_locked([session_id])
+        return self.user_sessions.get(session_id, session)
+
+    async def _reload_session(self, session_id: str, user_id: Optional[str]) -> Dict[str, Any]:
+        """用存储中的最新版本替换内存中的会话（不存在时新建）；不计入交互次数，由重放的各轮修改分别计入
+
+        加载完成之前内存中的会话保持不变：加载被取消（如关闭时）时，未保存的修改仍可在下次保存时重放。
+        """
+        session = await self._load_session(session_id)
+        if session is None:
+            session = self._new_session(session_id, user_id)
+            self.session_expiry.touch(session_id, session["last_activity"].timestamp())
+        return session
+
+    def _build_chat_messages(self, session_id: str, session: Dict[str, Any],
+                             message: str) -> Tuple[List[Any], List[Dict[str, Any]], Dict[str, int]]:
+        """构建发给大模型的消息列表：精简的系统提示词（含较早对话的摘要）+ 预算内最近的历史 + 当前消息
+
+        同时返回本轮提示词的token用量；开启 CONTEXT_REPORT_BASELINE 时还与不做预算裁剪时（完整上下文 + 最近20条历史）对比。
+        """
+        system, history, prompt_tokens = self.context_builder.build(
+            session, self._build_session_context(session), message
+        )
+        messages = [SystemMessage(content=system)]
+        for msg in history:
             if msg["role"] == "user":
                 messages.append(HumanMessage(content=msg["content"]))
             elif msg["role"] == "assistant":
                 messages.append(AIMessage(content=msg["content"]))
-        
-        # 添加当前用户消息
         messages.append(HumanMessage(content=message))
         
-        try:
-            # 获取AI回复
-            response = self.chat_model.invoke(messages)
-            
-            # 更新对话历史 - 先添加用户消息
-            session["conversation_history"].append({
-                "role": "user",
-                "content": message,
-                "timestamp": datetime.now().isoformat(),
-                "intent_scores": intent_scores,
-                "emotion_scores": emotion_scores,
-                "entities": entities
-            })
-            
-            # 再添加AI回复
-            session["conversation_history"].append({
-                "role": "assistant",
-                "content": response.content,
-                "timestamp": datetime.now().isoformat()
-            })
-            
-            # 更新用户偏好
-            self._update_user_preferences(session_id, message, response.content, entities)
-            
-            # 保存会话数据
-            self._save_sessions()
-            
-            # 解析回复，提取推荐信息
-            recommendations = self._extract_recommendations(response.content)
-            
-            return {
-                "response": response.content,
-                "recommendations": recommendations,
-                "session_id": session_id,
-                "user_preferences": session.get("user_preferences", {}),
-                "conversation_length": len(session.get("conversation_history", [])),
-                "interaction_count": session.get("interaction_count", 0),
-                "intent_scores": intent_scores,
-                "emotion_scores": emotion_scores,
-                "entities": entities
-            }
-        except Exception as e:
-            return {
-                "response": f"抱歉，处理您的请求时出现了错误: {str(e)}",
-                "recommendations": [],
-                "session_id": session_id,
-                "user_preferences": session.get("user_preferences", {}),
-                "conversation_length": len(session.get("conversation_history", [])),
-                "interaction_count": session.get("interaction_count", 0),
-                "intent_scores": intent_scores,
-                "emotion_scores": emotion_scores,
-                "entities": entities
-            }
+        usage = {"prompt": prompt_tokens}
+        if self.context_report_baseline:
+            count = self.context_builder.count
+            baseline = count(self._build_conversation_context(session_id)) + count(message) + sum(
+                count(msg["content"]) for msg in session.get("conversation_history", [])[-20:]
+            )
+            usage.update(baseline=baseline, saved=max(baseline - prompt_tokens, 0))
+        return messages, history, usage
+
+    def _semantic_scope_for(self, session: Dict[str, Any], history: List[Dict[str, Any]], analysis: Dict[str, Any],
+                            use_cache: bool) -> Optional[str]:
+        if not use_cache or self.semantic_cache is None:
+            return None
+        return self._semantic_scope(session, history, analysis["intent_scores"], analysis["entities"])
+
+    def _semantic_lookup(self, message: str, semantic_scope: Optional[str]) -> Optional[str]:
+        if semantic_scope is None:
+            return None
+        return self.semantic_cache.lookup(message, semantic_scope)
+
+    def _semantic_add(self, message: str, semantic_scope: Optional[str], content: str, latency: float):
+        if semantic_scope is not None:
+            self.semantic_cache.add(message, semantic_scope, content, latency)
+
+    async def _finish_turn(self, session_id: str, session: Dict[str, Any], message: str, content: str,
+                           analysis: Dict[str, Any], prompt_tokens: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """记录本轮对话、更新偏好并保存会话，返回对话结果"""
+        self._record_turn(session_id, session, message, content, analysis)
+        
+        # 保存会话数据（只追加本会话的记录）
+        def replay(fresh: Dict[str, Any]):
+            self._replay_begin(fresh, analysis)
+            self._record_turn(session_id, fresh, message, content, analysis)
+        session = await self._persist_turn(session_id, session, replay)
+        
+        # 解析回复，提取推荐信息
+        recommendations = self._extract_recommendations(content)
+        
+        return {
+            "response": content,
+            "recommendations": recommendations,
+            "session_id": session_id,
+            "user_preferences": session.get("user_preferences", {}),
+            "conversation_length": self._conversation_length(session),
+            "interaction_count": session.get("interaction_count", 0),
+            "intent_scores": analysis["intent_scores"],
+            "emotion_scores": analysis["emotion_scores"],
+            "entities": analysis["entities"],
+            "prompt_tokens": prompt_tokens
+        }
+
+    def _record_turn(self, session_id: str, session: Dict[str, Any], message: str, content: str,
+                     analysis: Dict[str, Any]):
+        """把本轮的用户消息和AI回复写入会话历史，并更新用户偏好"""
+        # 更新对话历史 - 先添加用户消息
+        self._append_message(session, {
+            "role": "user",
+            "content": message,
+            "timestamp": datetime.now().isoformat(),
+            "intent_scores": analysis["intent_scores"],
+            "emotion_scores": analysis["emotion_scores"],
+            "entities": analysis["entities"]
+        })
+        
+        # 再添加AI回复
+        self._append_message(session, {
+            "role": "assistant",
+            "content": content,
+            "timestamp": datetime.now().isoformat()
+        })
+        
+        # 更新用户偏好
+        self._update_user_preferences(session_id, message, content, analysis["entities"],
+                                      analysis["preference_signals"])
+
+    async def _finish_fallback_turn(self, session_id: str, session: Dict[str, Any], message: str,
+                                    analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """大模型不可用时使用规则回复"""
+        intent_scores = analysis["intent_scores"]
+        emotion_scores = analysis["emotion_scores"]
+        entities = analysis["entities"]
+        fallback_response = self._get_enhanced_fallback_response(message, session, intent_scores, emotion_scores, entities)
+        session = await self._persist_turn(session_id, session, lambda fresh: self._replay_begin(fresh, analysis))
+        return {
+            "response": fallback_response,
+            "recommendations": [],
+            "session_id": session_id,
+            "user_preferences": session.get("user_preferences", {}),
+            "conversation_length": self._conversation_length(session),
+            "intent_scores": intent_scores,
+            "emotion_scores": emotion_scores,
+            "entities": entities
+        }
+
+    def _error_result(self, session_id: str, session: Dict[str, Any], analysis: Dict[str, Any],
+                      error: Exception) -> Dict[str, Any]:
+        return {
+            "response": f"抱歉，处理您的请求时出现了错误: {str(error)}",
+            "recommendations": [],
+            "session_id": session_id,
+            "user_preferences": session.get("user_preferences", {}),
+            "conversation_length": self._conversation_length(session),
+            "interaction_count": session.get("interaction_count", 0),
+            "intent_scores": analysis["intent_scores"],
+            "emotion_scores": analysis["emotion_scores"],
+            "entities": analysis["entities"]
+        }
 
     def _get_enhanced_fallback_response(self, message: str, session: Dict[str, Any], intent_scores: Dict[str, float], emotion_scores: Dict[str, float], entities: Dict[str, Any]) -> str:
         """增强的fallback回复"""
@@ -427,7 +770,7 @@ class AIService:
         
         # 根据意图提供回复
         if intent_scores.get("recommendation", 0) > 0.3:
-            return self._get_recommendation_response(preferences, entities, emotion_scores)
+            return self._get_recommendation_response(preferences, entities, emotion_scores, message)
         elif intent_scores.get("information", 0) > 0.3:
             return self._get_information_response(message, preferences)
         elif intent_scores.get("comparison", 0) > 0.3:
@@ -448,7 +791,7 @@ class AIService:
         # 基础关键词匹配
         return self._get_fallback_response(message, session)
 
-    def _get_recommendation_response(self, preferences: Dict[str, Any], entities: Dict[str, Any], emotion_scores: Dict[str, float]) -> str:
+    def _get_recommendation_response(self, preferences: Dict[str, Any], entities: Dict[str, Any], emotion_scores: Dict[str, float], message: Optional[str] = None) -> str:
         """获取推荐回复"""
         response = "根据您的偏好，我为您推荐以下菜单中的菜品：\n\n"
         
@@ -480,7 +823,7 @@ class AIService:
         response += "我推荐：\n"
         
         # 从菜单中筛选推荐菜品
-        recommended_items = self._get_menu_recommendations(preferences, entities)
+        recommended_items = self._get_menu_recommendations(preferences, entities, query_text=message)
         
         for i, item in enumerate(recommended_items, 1):
             response += f"{i}. {item.name} - ¥{item.price}\n"
@@ -496,11 +839,8 @@ class AIService:
         
         return response
     
-    def _get_menu_recommendations(self, preferences: Dict[str, Any], entities: Dict[str, Any], limit: int = 5) -> List[Any]:
-        """根据用户偏好从菜单中筛选推荐菜品"""
-        all_items = self.menu_service.get_all_menu_items()
-        recommended_items = []
-        
+    def _get_menu_recommendations(self, preferences: Dict[str, Any], entities: Dict[str, Any], limit: int = 5, query_text: Optional[str] = None) -> List[Any]:
+        """根据用户偏好从菜单中筛选推荐菜品（对整份菜单的特征矩阵一次打分，可选语义相似度加成）"""
         # 提取用户偏好
         taste_preferences = preferences.get("taste_preferences", [])
         cuisine_preferences = preferences.get("cuisine_preferences", [])
@@ -518,51 +858,37 @@ class AIService:
         all_cuisines = cuisine_preferences + extracted_cuisine
         all_budget = budget_preference or extracted_budget
         
-        for item in all_items:
-            score = 0
-            
-            # 口味匹配
-            if all_tastes:
-                for taste in all_tastes:
-                    if taste in item.description.lower() or taste in item.name.lower():
-                        score += 2
-            
-            # 菜系匹配
-            if all_cuisines:
-                for cuisine in all_cuisines:
-                    if cuisine in item.category or cuisine in item.description.lower():
-                        score += 3
-            
-            # 预算匹配
-            if all_budget:
-                if "便宜" in all_budget and item.price <= 30:
-                    score += 2
-                elif "中等" in all_budget and 30 < item.price <= 60:
-                    score += 2
-                elif "高档" in all_budget and item.price > 60:
-                    score += 2
-            
-            # 健康需求匹配
-            if health_concerns:
-                if "清淡" in health_concerns and "清蒸" in item.description:
-                    score += 2
-                elif "营养" in health_concerns and "蔬菜" in item.description:
-                    score += 2
-            
-            # 过敏原过滤
-            if dietary_restrictions:
-                if any(allergen in item.allergens for allergen in dietary_restrictions):
-                    continue  # 跳过过敏菜品
-            
-            # 评分加成
-            score += item.rating * 0.5
-            
-            if score > 0:
-                recommended_items.append((item, score))
-        
-        # 按评分排序并返回前N个
-        recommended_items.sort(key=lambda x: x[1], reverse=True)
-        return [item for item, score in recommended_items[:limit]]
+        # 整个推荐过程使用同一份菜单，期间菜单被替换也不受影响
+        menu_service = self.menu_service
+        
+        # 语义检索阶段：与用户原话最相近的菜品获得加成（按最相近菜品的相似度归一，最多加 SEMANTIC_WEIGHT 分）
+        extra_scores = None
+        if settings.SEMANTIC_SEARCH_ENABLED and query_text:
+            positions, similarities = menu_service.semantic_search(query_text, settings.SEMANTIC_CANDIDATES)
+            extra_scores = np.zeros(menu_service.get_item_count(), dtype=np.float64)
+            if len(positions):
+                extra_scores[positions] = settings.SEMANTIC_WEIGHT * similarities / similarities.max()
+        
+        positions = self._get_menu_scorer(menu_service).recommend(
+            all_tastes, all_cuisines, all_budget, health_concerns,
+            excluded_allergens=list(dietary_restrictions) if dietary_restrictions else None,
+            limit=limit,
+            extra_scores=extra_scores
+        )
+        # 只有入选的菜品才取回对象
+        return menu_service.get_items_at(positions)
+
+    def _get_menu_scorer(self, menu_service: Optional[MenuService] = None) -> MenuScorer:
+        """获取推荐打分引擎，菜单版本变化后重建"""
+        menu_service = menu_service or self.menu_service
+        return self._versioned(
+            self._menu_scorer_cache, menu_service.version, lambda: self._build_menu_scorer(menu_service)
+        )
+
+    def _build_menu_scorer(self, menu_service: MenuService) -> MenuScorer:
+        tables = self.lexicon_manager.current.tables
+        vocabulary = list(tables["taste_preferences"].labels) + list(tables["cuisine_types"].labels)
+        return MenuScorer(menu_service.get_menu_columns(), vocabulary)
 
     def _get_information_response(self, message: str, preferences: Dict[str, Any]) -> str:
         """获取信息回复"""
@@ -624,8 +950,8 @@ class AIService:
         # 目前返回空列表，可以在后续版本中完善
         return []
 
-    async def get_recommendations(self, user_preferences: Dict[str, Any]) -> Dict[str, Any]:
-        """获取个性化推荐"""
+    async def get_recommendations(self, user_preferences: Dict[str, Any], use_cache: bool = True) -> Dict[str, Any]:
+        """获取个性化推荐；use_cache=False 时不使用回复缓存"""
         prompt = f"""
         基于以下用户偏好，推荐3-5道最适合的菜品：
         
@@ -638,7 +964,7 @@ class AIService:
         """
         
         try:
-            response = self.chat_model.invoke([HumanMessage(content=prompt)])
+            response = await self._invoke_llm([HumanMessage(content=prompt)], use_cache=use_cache)
             return {
                 "recommendations": self._parse_recommendations(response.content),
                 "reasoning": response.content,
@@ -705,31 +1031,34 @@ class AIService:
         else:
             return "感谢您的咨询！我是PalonaAI菜品推荐助手，可以为您推荐最适合的菜品。请告诉我您的口味偏好、饮食限制或者想要尝试的菜系，我会为您提供个性化推荐！"
 
-    def get_session_info(self, session_id: str) -> Dict[str, Any]:
-        """获取会话信息"""
-        if session_id in self.user_sessions:
-            session = self.user_sessions[session_id]
+    async def get_session_info(self, session_id: str) -> Dict[str, Any]:
+        """获取会话信息（完整对话历史从会话存储读取，内存中只有最近的消息）"""
+        session = await self._get_session(session_id)
+        if session is not None:
+            await self.session_committer.flush([session_id])
+            history = await self.session_store.load_history(session_id) or session.get("conversation_history", [])
             return {
                 "session_id": session_id,
                 "user_id": session.get("user_id"),
                 "created_at": session.get("created_at").isoformat(),
                 "last_activity": session.get("last_activity").isoformat(),
-                "conversation_length": len(session.get("conversation_history", [])),
+                "conversation_length": self._conversation_length(session),
                 "interaction_count": session.get("interaction_count", 0),
                 "user_preferences": session.get("user_preferences", {}),
-                "conversation_history": session.get("conversation_history", []),
-                "intent_history": session.get("intent_history", []),
-                "emotion_history": session.get("emotion_history", [])
+                "conversation_history": plain_messages(history),
+                "intent_history": list(session.get("intent_history", [])),
+                "emotion_history": list(session.get("emotion_history", []))
             }
         return {}
 
-    def debug_session(self, session_id: str) -> str:
+    async def debug_session(self, session_id: str) -> str:
         """调试会话状态"""
-        if session_id not in self.user_sessions:
+        session = await self._get_session(session_id)
+        if session is None:
             return f"会话 {session_id} 不存在"
         
-        session = self.user_sessions[session_id]
-        history = session.get("conversation_history", [])
+        await self.session_committer.flush([session_id])
+        history = await self.session_store.load_history(session_id) or session.get("conversation_history", [])
         
         debug_info = f"""
 === 会话调试信息 ===
@@ -760,20 +1089,15 @@ class AIService:
         
         return debug_info
 
-    def clear_session(self, session_id: str) -> bool:
-        """清除会话"""
-        if session_id in self.user_sessions:
-            del self.user_sessions[session_id]
-            return True
-        return False
-
-    def cleanup_old_sessions(self, max_age_hours: int = 24):
-        """清理过期会话"""
-        cutoff_time = datetime.now() - timedelta(hours=max_age_hours)
-        expired_sessions = [
-            session_id for session_id, session in self.user_sessions.items()
-            if session["last_activity"] < cutoff_time
-        ]
-        for session_id in expired_sessions:
-            del self.user_sessions[session_id]
-        return len(expired_sessions) 
\ No newline at end of file
+    async def clear_session(self, session_id: str) -> bool:
+        """清除会话（等待进行中的对话轮次和保存结束，放弃尚未保存的修改后再删除，删除后不会被重新写入）"""
+        async with self.session_locks.hold(session_id):
+            in_memory = self.user_sessions.pop(session_id, None) is not None
+            self.session_expiry.discard(session_id)
+            self.session_committer.discard(session_id)
+            persisted = await self.session_store.delete(session_id)
+        return in_memory or persisted
+
+    async def cleanup_old_sessions(self, max_age_hours: int = 24):
+        """清理过期会话（与后台定期清理相同：存储层分批删除，内存中按过期索引剔除）"""
+        return await self.session_reaper.reap(timedelta(hours=max_age_hours))
@@ -0,0 +1,124 @@
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 中日韩字符按每字一个token计；连续的字母数字约每4个字符一个token；其余可见符号各算一个
+_TOKEN_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uac00-\ud7af]|[A-Za-z0-9_]+|\S")
+_SENTENCE_END = re.compile(r"[。！？!?\n]")
+
+
+def count_tokens(text: str) -> int:
+    """离线估算文本的token数（与常见BPE分词器在中英文混合文本上的计数接近，不需要下载词表）"""
+    count = 0
+    for piece in _TOKEN_PATTERN.findall(text):
+        count += (len(piece) + 3) // 4 if len(piece) > 1 else 1
+    return count
+
+
+def clip_tokens(text: str, max_tokens: int, count: Callable[[str], int] = count_tokens) -> str:
+    """把文本截断到不超过 max_tokens 个token，被截断时以“…”结尾"""
+    if count(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count(text[:middle]) + 1 <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + "…"
+
+
+class ContextBuilder:
+    """按token预算组装发给大模型的对话历史
+
+    最近的消息从新到旧放入预算（单条过长的消息先截断），放不下的较早消息并入会话中的滚动摘要。
+    摘要保存在会话的 context_summary 字段（{"covered": 已并入的消息数, "lines": [...], "omitted": 被挤出摘要的行数}），
+    每轮只把新滑出窗口的消息追加进去，不重新处理整段历史；摘要本身也有token上限，超出时丢弃最早的行。
+    """
+
+    SUMMARY_FIELD = "context_summary"
+
+    def __init__(self, max_tokens: int = 2000, message_max_tokens: int = 300, summary_max_tokens: int = 200,
+                 count: Callable[[str], int] = count_tokens):
+        self.max_tokens = max_tokens
+        self.message_max_tokens = message_max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.count = count
+        # 摘要中每行的长度上限
+        self.line_max_tokens = max(summary_max_tokens // 4, 8)
+
+    def build(self, session: Dict[str, Any], system_context: str, message: str) -> Tuple[str, List[Dict[str, Any]], int]:
+        """返回 (带摘要的系统提示词, 放入预算的历史消息, 提示词token数)
+
+        历史消息的 content 可能已被截断；会话的滚动摘要在此过程中按需更新。
+        """
+        history = session.get("conversation_history", [])
+        total = session.get("conversation_length", len(history))
+        # 内存中的历史可能只是最近的窗口：history[0] 是第 base 条消息
+        base = total - len(history)
+        summary = session.get(self.SUMMARY_FIELD) or {"covered": 0, "lines": [], "omitted": 0}
+        start = max(summary["covered"] - base, 0)
+        pending = [self._clip_message(msg) for msg in history[start:]]
+        pending_tokens = [self.count(msg["content"]) for msg in pending]
+        available = self.max_tokens - self.count(system_context) - self.count(message)
+
+        while True:
+            summary_text = self.render_summary(summary)
+            budget = available - self.count(summary_text)
+            first = len(pending)
+            while first > 0 and pending_tokens[first - 1] <= budget:
+                first -= 1
+                budget -= pending_tokens[first]
+            # 不以孤立的助手回复开头
+            while first < len(pending) and pending[first]["role"] != "user":
+                first += 1
+            if first == 0:
+                break
+            summary = self._fold(summary, pending[:first], base + start)
+            start += first
+            pending, pending_tokens = pending[first:], pending_tokens[first:]
+
+        if summary["covered"] or summary["lines"]:
+            session[self.SUMMARY_FIELD] = summary
+        system = system_context + summary_text
+        prompt_tokens = self.count(system) + sum(pending_tokens) + self.count(message)
+        return system, pending, prompt_tokens
+
+    def _clip_message(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        content = msg.get("content", "")
+        clipped = clip_tokens(content, self.message_max_tokens, self.count)
+        if clipped is content:
+            return msg
+        return {**msg, "content": clipped}
+
+    def _fold(self, summary: Dict[str, Any], messages: List[Dict[str, Any]], first_index: int) -> Dict[str, Any]:
+        """把滑出窗口的消息追加到摘要（返回新的摘要，不修改原摘要）"""
+        lines = list(summary["lines"])
+        for msg in messages:
+            line = self._summarize_message(msg)
+            if line:
+                lines.append(line)
+        omitted = summary.get("omitted", 0)
+        while lines and sum(self.count(line) for line in lines) > self.summary_max_tokens:
+            lines.pop(0)
+            omitted += 1
+        return {"covered": first_index + len(messages), "lines": lines, "omitted": omitted}
+
+    def _summarize_message(self, msg: Dict[str, Any]) -> Optional[str]:
+        content = msg.get("content", "").strip()
+        if not content:
+            return None
+        if msg.get("role") == "user":
+            return "用户：" + clip_tokens(content, self.line_max_tokens, self.count)
+        # 助手回复只保留第一句
+        first_sentence = _SENTENCE_END.split(content, 1)[0] or content
+        return "助手：" + clip_tokens(first_sentence, self.line_max_tokens, self.count)
+
+    @staticmethod
+    def render_summary(summary: Dict[str, Any]) -> str:
+        if not summary["lines"]:
+            return ""
+        header = "\n\n更早的对话摘要"
+        if summary.get("omitted"):
+            header += f"（另有{summary['omitted']}条更早的内容已省略）"
+        return header + "：\n" + "\n".join(f"- {line}" for line in summary["lines"])
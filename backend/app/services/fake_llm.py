@@ -0,0 +1,42 @@
+import asyncio
+import time
+from typing import AsyncIterator, List, Optional
+from langchain.schema import AIMessage, BaseMessage
+from langchain_core.messages import AIMessageChunk
+
+
+class FakeChatModel:
+    """本地假聊天模型：按固定延迟返回回复，用于离线开发和并发压测
+
+    接口与 ChatOpenAI 的 invoke/ainvoke/astream 保持一致，不发起任何网络请求。
+    """
+
+    def __init__(self, latency: float = 1.0, reply: Optional[str] = None):
+        self.latency = latency
+        self.reply = reply
+        self.call_count = 0
+
+    def _build_reply(self, messages: List[BaseMessage]) -> AIMessage:
+        self.call_count += 1
+        if self.reply is not None:
+            return AIMessage(content=self.reply)
+        last_message = messages[-1].content if messages else ""
+        return AIMessage(content=f"（本地模拟回复）您说的是：{last_message}")
+
+    def invoke(self, messages: List[BaseMessage]) -> AIMessage:
+        """同步调用（会阻塞当前线程）"""
+        time.sleep(self.latency)
+        return self._build_reply(messages)
+
+    async def ainvoke(self, messages: List[BaseMessage]) -> AIMessage:
+        """异步调用，等待期间不阻塞事件循环"""
+        await asyncio.sleep(self.latency)
+        return self._build_reply(messages)
+
+    async def astream(self, messages: List[BaseMessage], chunk_size: int = 4) -> AsyncIterator[AIMessageChunk]:
+        """流式调用：把回复切成小段逐段返回，总延迟与 ainvoke 相同"""
+        content = self._build_reply(messages).content
+        chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)] or [""]
+        for chunk in chunks:
+            await asyncio.sleep(self.latency / len(chunks))
+            yield AIMessageChunk(content=chunk)
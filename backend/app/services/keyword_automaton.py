@@ -0,0 +1,168 @@
+import re
+from types import MappingProxyType
+from typing import Dict, Any, List, Iterable, Mapping, Set, Tuple
+
+# 现代汉语中出现频率最高的字（另加点餐对话里的常用字）。正则扫描在文本中每个可能是关键词首字的位置
+# 都要尝试一次匹配，以这些字开头的关键词在长文本里会带来大量失败的尝试，改为直接做子串查找更快
+FREQUENT_CHARS = frozenset(
+    "的一是不了在人有我他这个们中来上大为和国地到以说时要就出会可也你对生能而子那得于着下自之年过发后作里"
+    "好吃喝想点"
+)
+
+
+class KeywordAutomaton:
+    """多模式关键词自动机
+
+    关键词先合并成一棵前缀树，再编译成一个正则表达式（每个节点一个分支组），
+    由正则引擎在C层对文本做一次从左到右的扫描，每个位置取最长的关键词。
+    被最长匹配“遮住”的关键词通过预先计算的包含关系和重叠关系补齐，
+    因此结果与逐个关键词做子串判断完全一致。
+    以高频字（frequent_chars）开头的关键词不放进正则，单独做子串查找。
+    """
+
+    _END = ""
+
+    def __init__(self, keywords: Iterable[str], frequent_chars: Iterable[str] = FREQUENT_CHARS):
+        self.keywords: List[str] = sorted(set(keyword for keyword in keywords if keyword))
+        frequent = frozenset(frequent_chars)
+        # 直接做子串查找的关键词；其余关键词由正则扫描
+        self._direct: Tuple[str, ...] = tuple(keyword for keyword in self.keywords if keyword[0] in frequent)
+        direct = frozenset(self._direct)
+        self._scanned: List[str] = [keyword for keyword in self.keywords if keyword not in direct]
+        # 关键词 -> 它包含的所有关键词（包括自身）
+        self._contained: Dict[str, Tuple[str, ...]] = {
+            keyword: tuple(other for other in self.keywords if other in keyword)
+            for keyword in self.keywords
+        }
+        # 关键词 -> 可能从它内部开始、越过它结尾的关键词
+        self._overlapping: Dict[str, Tuple[str, ...]] = {}
+        # （直接查找的关键词无论如何都会被查找，不需要补齐）
+        for keyword in self._scanned:
+            suffixes = [keyword[i:] for i in range(1, len(keyword))]
+            candidates = tuple(
+                other for other in self._scanned
+                if any(len(other) > len(suffix) and other.startswith(suffix) for suffix in suffixes)
+            )
+            if candidates:
+                self._overlapping[keyword] = candidates
+        self._pattern = re.compile(self._build_pattern()) if self._scanned else None
+
+    def _build_pattern(self) -> str:
+        """把正则扫描的关键词的前缀树转换成正则表达式"""
+        root: Dict[str, Any] = {}
+        for keyword in self._scanned:
+            node = root
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[self._END] = True
+        return self._node_pattern(root)
+
+    def _node_pattern(self, node: Dict[str, Any]) -> str:
+        branches = [
+            re.escape(char) + self._node_pattern(child)
+            for char, child in sorted(node.items()) if char != self._END
+        ]
+        if not branches:
+            return ""
+        # 关键词在此结束时分支可选；贪婪匹配保证优先取最长的关键词
+        optional = self._END in node
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        return "(?:" + "|".join(branches) + ")" + ("?" if optional else "")
+
+    def find(self, text: str) -> Set[str]:
+        """返回文本中出现过的所有关键词"""
+        found: Set[str] = set(keyword for keyword in self._direct if keyword in text)
+        if self._pattern is None:
+            return found
+        for keyword in set(self._pattern.findall(text)):
+            found.update(self._contained[keyword])
+            for candidate in self._overlapping.get(keyword, ()):
+                if candidate not in found and candidate in text:
+                    found.add(candidate)
+        return found
+
+
+class KeywordTable:
+    """一组带标签的关键词及其计算方式
+
+    mode:
+      - "score": 每个标签的得分 = 命中的关键词数 / 关键词总数（只返回得分大于0的标签）
+      - "all": 返回所有有关键词命中的标签列表
+      - "first": 按定义顺序返回第一个有关键词命中的标签
+    case_sensitive 为 False 时在小写化后的文本上匹配。
+    """
+
+    def __init__(self, name: str, groups: Mapping[str, Iterable[str]], mode: str = "score",
+                 case_sensitive: bool = False):
+        if mode not in ("score", "all", "first"):
+            raise ValueError(f"未知的关键词表模式: {mode}")
+        self.name = name
+        self.mode = mode
+        self.case_sensitive = case_sensitive
+        # 编译后的结构都是只读的，可以被多个请求安全共享
+        self.groups: Mapping[str, Tuple[str, ...]] = MappingProxyType(
+            {label: tuple(keywords) for label, keywords in groups.items()}
+        )
+        self.labels: Tuple[str, ...] = tuple(self.groups.keys())
+        self.sizes: Mapping[str, int] = MappingProxyType(
+            {label: len(keywords) for label, keywords in self.groups.items()}
+        )
+        # 关键词 -> ((标签, 在该标签列表中出现的次数), ...)
+        postings: Dict[str, List[Tuple[str, int]]] = {}
+        for label, keywords in self.groups.items():
+            counts: Dict[str, int] = {}
+            for keyword in keywords:
+                counts[keyword] = counts.get(keyword, 0) + 1
+            for keyword, count in counts.items():
+                postings.setdefault(keyword, []).append((label, count))
+        self.postings: Mapping[str, Tuple[Tuple[str, int], ...]] = MappingProxyType(
+            {keyword: tuple(entries) for keyword, entries in postings.items()}
+        )
+
+    def evaluate(self, found: Set[str]) -> Any:
+        """根据命中的关键词计算结果"""
+        hits: Dict[str, int] = {}
+        for keyword in found:
+            for label, count in self.postings.get(keyword, ()):
+                hits[label] = hits.get(label, 0) + count
+
+        if self.mode == "score":
+            return {label: hits[label] / self.sizes[label] for label in self.labels if label in hits}
+        if self.mode == "all":
+            return [label for label in self.labels if label in hits]
+        for label in self.labels:
+            if label in hits:
+                return label
+        return None
+
+
+class KeywordAnalyzer:
+    """把多张关键词表编译进同一个自动机，一次扫描得到所有表的结果"""
+
+    def __init__(self, tables: List[KeywordTable]):
+        self.tables = tuple(tables)
+        self.automaton = KeywordAutomaton(
+            keyword for table in tables for keyword in table.postings
+        )
+        case_sensitive_keywords = set(
+            keyword for table in tables if table.case_sensitive for keyword in table.postings
+        )
+        # 区分大小写的关键词：全小写的可以从小写文本的结果中校验得到，含大写的只能在原文中查找
+        self._case_sensitive_lower = frozenset(k for k in case_sensitive_keywords if k == k.lower())
+        self._case_sensitive_mixed = tuple(k for k in case_sensitive_keywords if k != k.lower())
+
+    def analyze(self, text: str) -> Dict[str, Any]:
+        """返回 {表名: 结果}"""
+        lowered = text.lower()
+        found_lower = self.automaton.find(lowered)
+        found_raw = found_lower
+        if lowered != text:
+            # 文本含大写字母时，用原文逐个校验命中的区分大小写关键词，无需再扫描一遍
+            found_raw = set(k for k in found_lower if k in self._case_sensitive_lower and k in text)
+            found_raw.update(k for k in self._case_sensitive_mixed if k in text)
+
+        return {
+            table.name: table.evaluate(found_raw if table.case_sensitive else found_lower)
+            for table in self.tables
+        }
@@ -0,0 +1,127 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from types import MappingProxyType
+from typing import Dict, Any, Mapping, Optional, Tuple
+from app.services.keyword_automaton import KeywordAnalyzer, KeywordTable
+
+
+class Lexicon:
+    """编译后的只读词表：各关键词表及共享的关键词自动机"""
+
+    # AIService 分析消息时依赖的表
+    REQUIRED_TABLES = (
+        "intent", "emotion", "cuisine_types", "taste_preferences",
+        "dietary_restrictions", "budget_range", "meal_time", "occasion"
+    )
+
+    def __init__(self, data: Dict[str, Any], fingerprint: str = ""):
+        self.version = data.get("version")
+        self.fingerprint = fingerprint
+        table_specs = data.get("tables", {})
+        missing = [name for name in self.REQUIRED_TABLES if name not in table_specs]
+        if missing:
+            raise ValueError(f"词表缺少必需的关键词表: {', '.join(missing)}")
+
+        tables = [
+            KeywordTable(
+                name,
+                spec["groups"],
+                mode=spec.get("mode", "score"),
+                case_sensitive=spec.get("case_sensitive", False)
+            )
+            for name, spec in table_specs.items()
+        ]
+        self.tables: Mapping[str, KeywordTable] = MappingProxyType({table.name: table for table in tables})
+        self.analyzer = KeywordAnalyzer(tables)
+
+    @classmethod
+    def from_file(cls, path: str) -> "Lexicon":
+        """从JSON文件加载并编译词表"""
+        with open(path, "rb") as f:
+            raw = f.read()
+        return cls(json.loads(raw.decode("utf-8")), fingerprint=hashlib.sha1(raw).hexdigest()[:12])
+
+
+class LexiconManager:
+    """词表热加载
+
+    请求通过 current 取得当前词表，读取时不做任何检查。后台任务每隔 check_interval 秒查看文件是否变化，
+    变化时在线程池中完整编译新词表，再一次引用赋值换上；进行中的请求继续使用它已拿到的旧词表。
+    新文件有误时保留旧词表。
+    """
+
+    def __init__(self, path: str, check_interval: float = 2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._stamp = self._file_stamp()
+        self._lexicon = Lexicon.from_file(path)
+        self._task: Optional["asyncio.Task[None]"] = None
+        print(f"已加载词表 版本{self._lexicon.version}（{self._lexicon.fingerprint}）")
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @property
+    def current(self) -> Lexicon:
+        """当前生效的词表"""
+        return self._lexicon
+
+    def start(self):
+        """在当前事件循环中启动后台检查任务（check_interval 不大于0时不启动）"""
+        if self.check_interval > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await asyncio.to_thread(self.check)
+            except Exception as e:
+                print(f"检查词表文件失败: {e}")
+
+    def check(self) -> bool:
+        """文件有变化时重新加载（编译耗时，在线程池中调用），返回是否换上了新词表"""
+        with self._lock:
+            stamp = self._file_stamp()
+            if stamp is None or stamp == self._stamp:
+                return False
+            self._stamp = stamp
+            return self._swap()
+
+    async def reload(self) -> Lexicon:
+        """立即重新加载词表（在线程池中编译）"""
+        await asyncio.to_thread(self._reload)
+        return self._lexicon
+
+    def _reload(self):
+        with self._lock:
+            self._stamp = self._file_stamp()
+            self._swap()
+
+    def _swap(self) -> bool:
+        try:
+            lexicon = Lexicon.from_file(self.path)
+        except Exception as e:
+            print(f"词表重新加载失败，继续使用版本{self._lexicon.version}: {e}")
+            return False
+        self._lexicon = lexicon
+        print(f"词表已更新到 版本{lexicon.version}（{lexicon.fingerprint}）")
+        return True
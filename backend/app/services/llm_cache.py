@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import aiosqlite
+import numpy as np
+
+from app.services.vector_index import HashingEmbedder
+
+
+def message_key(params: Dict[str, Any], messages: List[Any], menu_fingerprint: str = "") -> str:
+    """由模型参数、菜单指纹和完整消息列表（角色+内容）计算缓存键"""
+    payload = json.dumps(
+        {
+            "params": params,
+            "menu": menu_fingerprint,
+            "messages": [[getattr(message, "type", type(message).__name__), message.content] for message in messages]
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """大模型回复的精确匹配缓存
+
+    内存中按 LRU 淘汰，条目超过 ttl 秒即视为过期。配置了 db_path 时同时写入 SQLite，
+    内存未命中时再查磁盘，进程重启或多个 worker 之间也能命中。
+    回复依赖菜单（系统提示词中带有价格），磁盘上的条目记录所属菜单，只命中当前菜单的条目；
+    多个 worker 共用缓存文件时可能正处在不同的菜单上（滚动重载），因此切换菜单时只清空本进程的内存，
+    旧菜单的磁盘条目由过期清理删除。
+    """
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY,
+        menu TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_llm_cache_created_at ON llm_cache(created_at);
+    """
+
+    # 每写入这么多条目清理一次磁盘上的过期条目
+    PRUNE_EVERY = 256
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        # key -> (回复内容, 写入时间戳)
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._menu: Optional[str] = None
+        self._db: Optional[aiosqlite.Connection] = None
+        self._init_lock: Optional[asyncio.Lock] = None
+        self._puts_since_prune = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    async def _connection(self) -> Optional[aiosqlite.Connection]:
+        """首次使用时建立连接并初始化表结构（未配置 db_path 时只用内存）"""
+        if not self.db_path or self._db is not None:
+            return self._db
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if self._db is None:
+                db = await aiosqlite.connect(self.db_path, timeout=5.0)
+                # 多个 worker 共用同一个缓存文件
+                await db.execute("PRAGMA journal_mode = WAL")
+                await db.executescript(self._SCHEMA)
+                await db.commit()
+                self._db = db
+        return self._db
+
+    async def bind_menu(self, menu_fingerprint: str):
+        """菜单变化后不再命中旧菜单下缓存的回复"""
+        if menu_fingerprint == self._menu:
+            return
+        if self._menu is not None:
+            self._entries.clear()
+            self.invalidations += 1
+        self._menu = menu_fingerprint
+
+    async def get(self, key: str) -> Optional[str]:
+        """取缓存的回复，未命中或已过期时返回 None"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if now - entry[1] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            del self._entries[key]
+            self.expirations += 1
+
+        db = await self._connection()
+        if db is not None:
+            async with db.execute(
+                "SELECT content, created_at FROM llm_cache WHERE key = ? AND menu = ?", (key, self._menu or "")
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is not None and now - row[1] <= self.ttl:
+                self._remember(key, row[0], row[1])
+                self.hits += 1
+                self.disk_hits += 1
+                return row[0]
+        self.misses += 1
+        return None
+
+    def _remember(self, key: str, content: str, created_at: float):
+        self._entries[key] = (content, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def put(self, key: str, content: str):
+        """写入回复"""
+        now = time.time()
+        self._remember(key, content, now)
+        db = await self._connection()
+        if db is not None:
+            await db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, menu, content, created_at) VALUES (?, ?, ?, ?)",
+                (key, self._menu or "", content, now)
+            )
+            self._puts_since_prune += 1
+            if self._puts_since_prune >= self.PRUNE_EVERY:
+                self._puts_since_prune = 0
+                await db.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl,))
+            await db.commit()
+
+    async def clear(self):
+        """清空全部缓存"""
+        self._entries.clear()
+        db = await self._connection()
+        if db is not None:
+            await db.execute("DELETE FROM llm_cache")
+            await db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "disk": bool(self.db_path),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+def scope_digest(*parts: Any) -> str:
+    """把决定回复内容的上下文（模型参数、菜单、偏好、历史等）压缩成一个摘要"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class SemanticResponseCache:
+    """按语义相似度复用大模型回复
+
+    每条记录保存用户消息的向量、上下文摘要（scope）、回复内容和当初生成回复的耗时。
+    查询时只在 scope 完全相同的记录中找与新消息最相近的一条，相似度不低于 threshold 即复用其回复，
+    因此偏好、菜单或识别出的实体不同的请求永远不会互相复用。
+    向量存放在预先分配的 (capacity, dim) 矩阵中，一次矩阵乘法完成检索；
+    记录满时淘汰最久未被使用的一条，超过 ttl 秒的记录不再命中。
+    """
+
+    def __init__(self, capacity: int = 2048, threshold: float = 0.8, ttl: float = 3600.0,
+                 embedder: Optional[HashingEmbedder] = None):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.embedder = embedder or HashingEmbedder()
+        self._vectors = np.zeros((capacity, self.embedder.dim), dtype=np.float32)
+        self._latencies = np.zeros(capacity, dtype=np.float64)
+        self._created_at = np.zeros(capacity, dtype=np.float64)
+        self._menu: Optional[str] = None
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+        self.clear()
+
+    def bind_menu(self, menu_fingerprint: str):
+        """菜单变化后清空全部记录"""
+        if menu_fingerprint == self._menu:
+            return
+        if self._menu is not None:
+            self.clear()
+            self.invalidations += 1
+        self._menu = menu_fingerprint
+
+    def clear(self):
+        # 槽位 -> (scope, 回复内容)，按最近使用排序；scope -> 槽位列表；空闲槽位
+        self._slots: "OrderedDict[int, Tuple[str, str]]" = OrderedDict()
+        self._by_scope: Dict[str, List[int]] = {}
+        self._free: List[int] = list(range(self.capacity - 1, -1, -1))
+
+    def _release(self, position: int):
+        scope, _ = self._slots.pop(position)
+        positions = self._by_scope[scope]
+        positions.remove(position)
+        if not positions:
+            del self._by_scope[scope]
+        self._free.append(position)
+
+    def lookup(self, text: str, scope: str) -> Optional[str]:
+        """返回同一 scope 下与 text 最相近且足够相似的回复"""
+        self.lookups += 1
+        now = time.time()
+        for position in [p for p in self._by_scope.get(scope, ()) if now - self._created_at[p] > self.ttl]:
+            self._release(position)
+        candidates = self._by_scope.get(scope)
+        if not candidates:
+            return None
+        similarities = self._vectors[candidates] @ self.embedder.embed(text)
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        position = candidates[best]
+        self._slots.move_to_end(position)
+        self.hits += 1
+        self.saved_seconds += self._latencies[position]
+        return self._slots[position][1]
+
+    def add(self, text: str, scope: str, content: str, latency: float = 0.0):
+        """记录一次大模型回复及其生成耗时"""
+        if not self._free:
+            # 淘汰最久未被使用的记录
+            self._release(next(iter(self._slots)))
+            self.evictions += 1
+        position = self._free.pop()
+        self._vectors[position] = self.embedder.embed(text)
+        self._latencies[position] = latency
+        self._created_at[position] = time.time()
+        self._slots[position] = (scope, content)
+        self._by_scope.setdefault(scope, []).append(position)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._slots),
+            "capacity": self.capacity,
+            "threshold": self.threshold,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "saved_seconds": self.saved_seconds,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
@@ -0,0 +1,248 @@
+"""预构建的菜单制品
+
+离线把菜单的列式数据、全文检索倒排索引和向量矩阵写成一个带版本号的目录，
+工作进程用只读 mmap 打开，数据页在多个 gunicorn worker 之间共享，启动耗时与菜单大小无关。
+
+目录结构：
+  <root>/CURRENT                当前版本目录名（原子替换）
+  <root>/<version>/manifest.json
+  <root>/<version>/*.npy        数值数组（np.load mmap_mode="r"）
+  <root>/<version>/*.bin        字符串序列（UTF-8 拼接）及对应的 *.offsets.npy
+
+用法（在 backend 目录下）：
+  python -m app.services.menu_artifact --output artifacts/menu [--source menu.json]
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+
+from app.models.schemas import MenuItem
+from app.services.menu_columns import MenuColumns
+from app.services.search_index import MenuSearchIndex
+from app.services.vector_index import HashingEmbedder, embedding_text
+
+ARTIFACT_FORMAT_VERSION = 1
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+
+class PackedStrings(Sequence[str]):
+    """紧凑存放的一组字符串：UTF-8 字节拼接在一起（通常是 mmap），按下标解码
+
+    完整遍历一次后会缓存解码结果，后续遍历不再重复解码。
+    """
+
+    def __init__(self, data: Union[bytes, mmap.mmap], offsets: np.ndarray):
+        self._data = data
+        self._offsets = offsets
+        self._decoded: Optional[List[str]] = None
+
+    @staticmethod
+    def write(prefix: str, strings: Sequence[str]):
+        encoded = [text.encode("utf-8") for text in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        with open(prefix + ".bin", "wb") as f:
+            f.write(b"".join(encoded))
+        np.save(prefix + ".offsets.npy", offsets)
+
+    @classmethod
+    def open(cls, prefix: str) -> "PackedStrings":
+        return cls(_map_file(prefix + ".bin"), np.load(prefix + ".offsets.npy", mmap_mode="r"))
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if self._decoded is not None:
+            return self._decoded[index]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        return bytes(self._data[start:end]).decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        if self._decoded is None:
+            self._decoded = [self[i] for i in range(len(self))]
+        return iter(self._decoded)
+
+    def join_bytes(self, separator: bytes) -> bytes:
+        """不解码，直接用 separator 连接各字符串的UTF-8字节"""
+        offsets = self._offsets.tolist()
+        return separator.join(self._data[start:end] for start, end in zip(offsets, offsets[1:]))
+
+
+class ArtifactMenuItems(Sequence[MenuItem]):
+    """按需从制品中解析的菜品序列：只有被访问到的菜品才会构造成 MenuItem"""
+
+    def __init__(self, records: PackedStrings):
+        self._records = records
+        self._items: List[Optional[MenuItem]] = [None] * len(records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        item = self._items[index]
+        if item is None:
+            item = self._items[index] = MenuItem.model_validate_json(self._records[index])
+        return item
+
+    def __iter__(self) -> Iterator[MenuItem]:
+        for index in range(len(self)):
+            yield self[index]
+
+    def json_array(self) -> bytes:
+        """全部菜品的JSON数组（记录本身就是 MenuItem.model_dump_json 的结果，无需解析）"""
+        return b"[" + self._records.join_bytes(b",") + b"]"
+
+
+def _map_file(path: str) -> Union[bytes, mmap.mmap]:
+    """只读映射整个文件（空文件无法 mmap，直接返回空字节串）"""
+    if os.path.getsize(path) == 0:
+        return b""
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _write_arrays(directory: str, prefix: str, data: Dict[str, Any]) -> List[str]:
+    """把数组写成 .npy、字符串序列写成 .bin，返回写入的字段名"""
+    names = []
+    for name, value in data.items():
+        if isinstance(value, np.ndarray):
+            np.save(os.path.join(directory, f"{prefix}.{name}.npy"), np.ascontiguousarray(value))
+        elif isinstance(value, (list, PackedStrings)) and all(isinstance(text, str) for text in value):
+            PackedStrings.write(os.path.join(directory, f"{prefix}.{name}"), value)
+        else:
+            continue
+        names.append(name)
+    return names
+
+
+def _read_arrays(directory: str, prefix: str, names: Sequence[str]) -> Dict[str, Any]:
+    data: Dict[str, Any] = {}
+    for name in names:
+        path = os.path.join(directory, f"{prefix}.{name}")
+        if os.path.exists(path + ".npy"):
+            data[name] = np.load(path + ".npy", mmap_mode="r")
+        else:
+            data[name] = PackedStrings.open(path)
+    return data
+
+
+def build_menu_artifact(items: Sequence[MenuItem], root: str, embedder: Optional[HashingEmbedder] = None) -> str:
+    """构建菜单制品并把它设为当前版本，返回版本目录"""
+    embedder = embedder or HashingEmbedder()
+    records = [item.model_dump_json() for item in items]
+    fingerprint = hashlib.sha1("\n".join(records).encode("utf-8")).hexdigest()
+    version = f"{fingerprint[:12]}-d{embedder.dim}"
+    os.makedirs(root, exist_ok=True)
+    target = os.path.join(root, version)
+
+    if not os.path.exists(os.path.join(target, MANIFEST_FILE)):
+        # 先写到临时目录，完整写好后再改名，进程读不到写了一半的制品
+        staging = tempfile.mkdtemp(prefix=".building-", dir=root)
+        try:
+            columns = MenuColumns(items).to_arrays()
+            search = MenuSearchIndex(items).to_arrays()
+            PackedStrings.write(os.path.join(staging, "items"), records)
+            np.save(os.path.join(staging, "embeddings.npy"),
+                    embedder.embed_many([embedding_text(item) for item in items]))
+            manifest = {
+                "format_version": ARTIFACT_FORMAT_VERSION,
+                "version": version,
+                "fingerprint": fingerprint,
+                "item_count": len(records),
+                "embedding_dim": embedder.dim,
+                "created_at": datetime.now().isoformat(),
+                "categories": columns["categories"],
+                "allergens": columns["allergens"],
+                "columns": _write_arrays(staging, "columns", {
+                    name: value for name, value in columns.items() if name not in ("categories", "allergens")
+                }),
+                "search": _write_arrays(staging, "search", search)
+            }
+            with open(os.path.join(staging, MANIFEST_FILE), "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            os.replace(staging, target)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    pointer = os.path.join(root, f".{CURRENT_FILE}.tmp")
+    with open(pointer, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(root, CURRENT_FILE))
+    return target
+
+
+class MenuArtifact:
+    """以只读 mmap 方式打开的菜单制品"""
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as f:
+            self.manifest: Dict[str, Any] = json.load(f)
+        if self.manifest.get("format_version") != ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f"不支持的菜单制品格式版本: {self.manifest.get('format_version')}")
+        self.directory = directory
+        self.version: str = self.manifest["version"]
+        self.embedding_dim: int = self.manifest["embedding_dim"]
+        self.items = ArtifactMenuItems(PackedStrings.open(os.path.join(directory, "items")))
+
+    @classmethod
+    def load(cls, root: str) -> "MenuArtifact":
+        """打开 root 下的当前版本（root 本身是版本目录时直接打开）"""
+        if os.path.exists(os.path.join(root, MANIFEST_FILE)):
+            return cls(root)
+        with open(os.path.join(root, CURRENT_FILE), encoding="utf-8") as f:
+            version = f.read().strip()
+        return cls(os.path.join(root, version))
+
+    def columns(self) -> MenuColumns:
+        data = _read_arrays(self.directory, "columns", self.manifest["columns"])
+        data["categories"] = self.manifest["categories"]
+        data["allergens"] = self.manifest["allergens"]
+        return MenuColumns.from_arrays(data)
+
+    def search_index(self) -> MenuSearchIndex:
+        return MenuSearchIndex.from_arrays(_read_arrays(self.directory, "search", self.manifest["search"]))
+
+    def embeddings(self) -> np.ndarray:
+        return np.load(os.path.join(self.directory, "embeddings.npy"), mmap_mode="r")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建预构建的菜单制品")
+    parser.add_argument("--output", required=True, help="制品根目录")
+    parser.add_argument("--source", help="菜单JSON文件（MenuItem 列表），不指定时使用示例菜单")
+    parser.add_argument("--embedding-dim", type=int, default=None, help="向量维度，默认取配置 EMBEDDING_DIM")
+    args = parser.parse_args()
+
+    from app.core.config import settings
+    from app.services.menu_service import MenuService
+
+    if args.source:
+        with open(args.source, encoding="utf-8") as f:
+            items = [MenuItem(**record) for record in json.load(f)]
+    else:
+        items = MenuService(artifact_path="").get_all_menu_items()
+    directory = build_menu_artifact(items, args.output, HashingEmbedder(args.embedding_dim or settings.EMBEDDING_DIM))
+    print(f"已构建菜单制品：{directory}（{len(items)}道菜品）")
+
+
+if __name__ == "__main__":
+    main()
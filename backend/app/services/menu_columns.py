@@ -0,0 +1,90 @@
+from typing import Any, Dict, Iterable, List, Sequence
+
+import numpy as np
+
+from app.models.schemas import MenuItem
+
+
+class MenuColumns:
+    """菜单的列式副本
+
+    把 MenuItem 的数值/类别字段拆成按菜单位置对齐的 NumPy 数组，
+    过滤和打分可以对整份菜单一次性做向量运算，只有最终入选的菜品才需要回到 pydantic 对象。
+    可为空的整数字段（spice_level、preparation_time）用 -1 表示缺失。
+    """
+
+    MISSING = -1
+    ARRAY_FIELDS = ("price", "rating", "is_seasonal", "spice_level", "preparation_time", "category_codes",
+                    "allergen_masks")
+    TEXT_FIELDS = ("ids", "names_lower", "descriptions", "descriptions_lower")
+
+    def __init__(self, items: Sequence[MenuItem]):
+        self.size = len(items)
+        self.price = np.array([item.price for item in items], dtype=np.float64)
+        self.rating = np.array([item.rating for item in items], dtype=np.float64)
+        self.is_seasonal = np.array([item.is_seasonal for item in items], dtype=bool)
+        self.spice_level = np.array(
+            [self.MISSING if item.spice_level is None else item.spice_level for item in items], dtype=np.int32
+        )
+        self.preparation_time = np.array(
+            [self.MISSING if item.preparation_time is None else item.preparation_time for item in items],
+            dtype=np.int32
+        )
+
+        # 类别编码：category_codes[i] 是 categories 中的下标
+        self.category_index: Dict[str, int] = {}
+        self.category_codes = np.array(
+            [self.category_index.setdefault(item.category, len(self.category_index)) for item in items],
+            dtype=np.int32
+        )
+        self.categories: List[str] = list(self.category_index)
+
+        # 过敏原位图：每64种过敏原占一个 uint64 字
+        self.allergen_index: Dict[str, int] = {}
+        for item in items:
+            for allergen in item.allergens:
+                self.allergen_index.setdefault(allergen, len(self.allergen_index))
+        words = max(1, (len(self.allergen_index) + 63) // 64)
+        masks = [sum(1 << self.allergen_index[allergen] for allergen in set(item.allergens)) for item in items]
+        self.allergen_masks = np.zeros((self.size, words), dtype=np.uint64)
+        for word in range(words):
+            self.allergen_masks[:, word] = [(mask >> (64 * word)) & 0xFFFFFFFFFFFFFFFF for mask in masks]
+
+        # 菜品ID，以及打分时需要做子串判断的文本列
+        self.ids: Sequence[str] = [item.id for item in items]
+        self.names_lower: Sequence[str] = [item.name.lower() for item in items]
+        self.descriptions: Sequence[str] = [item.description for item in items]
+        self.descriptions_lower: Sequence[str] = [description.lower() for description in self.descriptions]
+
+    def to_arrays(self) -> Dict[str, Any]:
+        """导出所有列（数组、字符串序列及类别/过敏原表），用于写入预构建的菜单制品"""
+        data: Dict[str, Any] = {name: getattr(self, name) for name in self.ARRAY_FIELDS + self.TEXT_FIELDS}
+        data["categories"] = list(self.categories)
+        data["allergens"] = list(self.allergen_index)
+        return data
+
+    @classmethod
+    def from_arrays(cls, data: Dict[str, Any]) -> "MenuColumns":
+        """由 to_arrays 导出的数据（可以是只读 mmap 数组）直接恢复列式数据"""
+        columns = cls.__new__(cls)
+        for name in cls.ARRAY_FIELDS + cls.TEXT_FIELDS:
+            setattr(columns, name, data[name])
+        columns.size = len(columns.price)
+        columns.categories = list(data["categories"])
+        columns.category_index = {category: code for code, category in enumerate(columns.categories)}
+        columns.allergen_index = {allergen: bit for bit, allergen in enumerate(data["allergens"])}
+        return columns
+
+    def allergen_query(self, allergens: Iterable[str]) -> np.ndarray:
+        """把一组过敏原转换成位图（菜单中没有出现过的过敏原不影响结果）"""
+        query = np.zeros(self.allergen_masks.shape[1], dtype=np.uint64)
+        for allergen in allergens:
+            bit = self.allergen_index.get(allergen)
+            if bit is not None:
+                query[bit // 64] |= np.uint64(1 << (bit % 64))
+        return query
+
+    def free_of(self, allergens: Iterable[str]) -> np.ndarray:
+        """不含任何指定过敏原的菜品"""
+        query = self.allergen_query(allergens)
+        return ~(self.allergen_masks & query).any(axis=1)
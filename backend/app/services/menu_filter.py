@@ -0,0 +1,111 @@
+import numbers
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.models.schemas import MenuItem
+from app.services.menu_columns import MenuColumns
+
+
+class MenuFilter:
+    """把过滤条件字典编译成一组判断函数，对候选菜品只扫描一遍
+
+    支持的条件与原 _apply_filters 相同：max_price、min_price、category、
+    exclude_allergens、seasonal_only、min_rating，未知的键会被忽略。
+    每个条件对应一个小的判断函数，菜品满足全部判断函数才保留。
+    条件值都是普通数值/字符串/列表时，还可以在 MenuColumns 上整体求出布尔掩码。
+    """
+
+    def __init__(self, filters: Dict[str, Any]):
+        checks: List[Callable[[MenuItem], bool]] = []
+        # (条件名, 条件值)，用于列式求值
+        self._conditions: List[Tuple[str, Any]] = []
+        self.vectorizable = True
+
+        # 价格过滤
+        if "max_price" in filters:
+            max_price = filters["max_price"]
+            checks.append(lambda item: item.price <= max_price)
+            self._add_condition("max_price", max_price, numbers.Real)
+        if "min_price" in filters:
+            min_price = filters["min_price"]
+            checks.append(lambda item: item.price >= min_price)
+            self._add_condition("min_price", min_price, numbers.Real)
+
+        # 类别过滤
+        if "category" in filters:
+            category = filters["category"]
+            checks.append(lambda item: item.category == category)
+            self._add_condition("category", category, str)
+
+        # 过敏原过滤：列表类的条件转成集合做不相交判断；字符串保持原来的子串语义
+        if "exclude_allergens" in filters:
+            exclude_allergens = filters["exclude_allergens"]
+            if isinstance(exclude_allergens, str):
+                checks.append(lambda item: not any(allergen in exclude_allergens for allergen in item.allergens))
+                self.vectorizable = False
+            else:
+                excluded = frozenset(exclude_allergens)
+                checks.append(lambda item: excluded.isdisjoint(item.allergens))
+                self._add_condition("exclude_allergens", excluded, frozenset)
+
+        # 季节性过滤
+        if filters.get("seasonal_only"):
+            checks.append(lambda item: item.is_seasonal)
+            self._add_condition("seasonal_only", True, bool)
+
+        # 评分过滤
+        if "min_rating" in filters:
+            min_rating = filters["min_rating"]
+            checks.append(lambda item: item.rating >= min_rating)
+            self._add_condition("min_rating", min_rating, numbers.Real)
+
+        self.filters = filters
+        self.is_empty = not checks
+        self._checks = tuple(checks)
+
+    def _add_condition(self, name: str, value: Any, expected_type: type):
+        if not isinstance(value, expected_type):
+            # 其它类型的值保持逐个菜品比较的语义
+            self.vectorizable = False
+        self._conditions.append((name, value))
+
+    def mask(self, columns: MenuColumns, positions: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """在列式数据上一次求出所有条件的布尔掩码；条件无法向量化时返回 None
+
+        positions 为 None 时针对整份菜单，否则只针对这些位置的菜品。
+        """
+        if not self.vectorizable:
+            return None
+
+        def column(values: np.ndarray) -> np.ndarray:
+            return values if positions is None else values[positions]
+
+        size = columns.size if positions is None else len(positions)
+        result = np.ones(size, dtype=bool)
+        for name, value in self._conditions:
+            if name == "max_price":
+                result &= column(columns.price) <= value
+            elif name == "min_price":
+                result &= column(columns.price) >= value
+            elif name == "category":
+                code = columns.category_index.get(value, -1)
+                result &= column(columns.category_codes) == code
+            elif name == "exclude_allergens":
+                query = columns.allergen_query(value)
+                result &= ~(column(columns.allergen_masks) & query).any(axis=1)
+            elif name == "seasonal_only":
+                result &= column(columns.is_seasonal)
+            elif name == "min_rating":
+                result &= column(columns.rating) >= value
+        return result
+
+    def __call__(self, item: MenuItem) -> bool:
+        return all(check(item) for check in self._checks)
+
+    def apply(self, items: Iterable[MenuItem]) -> List[MenuItem]:
+        """返回满足所有条件的菜品（保持原顺序）"""
+        if self.is_empty:
+            return list(items)
+        checks = self._checks
+        return [item for item in items if all(check(item) for check in checks)]
@@ -0,0 +1,138 @@
+import asyncio
+import csv
+import json
+import os
+import threading
+import weakref
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.models.schemas import MenuItem
+from app.services.menu_service import MenuService
+
+# CSV 中列表字段（配料、过敏原）的分隔符
+CSV_LIST_SEPARATOR = "|"
+CSV_LIST_FIELDS = ("ingredients", "allergens")
+
+
+def _read_csv_items(path: str) -> List[Dict[str, Any]]:
+    records = []
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            # 空单元格按未填写处理，使用 MenuItem 的默认值
+            record: Dict[str, Any] = {key: value for key, value in row.items() if key and value not in (None, "")}
+            for field in CSV_LIST_FIELDS:
+                values = record.get(field, "")
+                record[field] = [value.strip() for value in values.split(CSV_LIST_SEPARATOR) if value.strip()]
+            if "nutrition_info" in record:
+                record["nutrition_info"] = json.loads(record["nutrition_info"])
+            records.append(record)
+    return records
+
+
+def load_menu_file(path: str) -> List[MenuItem]:
+    """从JSON（MenuItem 列表或 {"items": [...]}）或CSV（列名即字段名，列表字段用 | 分隔）文件读取菜品"""
+    if path.lower().endswith(".csv"):
+        records = _read_csv_items(path)
+    else:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        records = data.get("items", []) if isinstance(data, dict) else data
+    return [MenuItem(**record) for record in records]
+
+
+def resolve_menu_path(path: str, menu_dir: str) -> str:
+    """把重新加载请求中的路径解析为菜单目录内的绝对路径（相对路径按菜单目录解析），不在目录内时抛出 ValueError"""
+    if not menu_dir:
+        raise ValueError("未配置菜单目录")
+    root = os.path.realpath(menu_dir)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if resolved == root or os.path.commonpath([root, resolved]) != root:
+        raise ValueError("菜单路径不在菜单目录内")
+    return resolved
+
+
+class MenuRegistry:
+    """进程内共享的当前菜单（读-复制-更新）
+
+    请求通过 current 取得当前菜单；重新加载时在线程池中读取新菜单并建好全部索引，
+    预热回调（如推荐打分引擎）也在线程池中完成，其结果回到事件循环后再写入各自的缓存，
+    最后一次引用赋值换上新菜单，进行中的请求继续使用它已拿到的旧菜单。加载失败时保留旧菜单。
+    """
+
+    def __init__(self, menu_service: Optional[MenuService] = None):
+        self._current = menu_service if menu_service is not None else MenuService()
+        # 菜单换上前需要预热的回调（弱引用，不阻止其所属对象被回收）
+        self._warmers: List[weakref.WeakMethod] = []
+        # 同一时间只进行一次重新加载（锁在事件循环中首次使用时创建）
+        self._reload_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def current(self) -> MenuService:
+        """当前生效的菜单"""
+        return self._current
+
+    def add_warmer(self, warmer: Callable[[MenuService], Optional[Callable[[], None]]]):
+        """注册预热回调：在线程池中以新菜单为参数调用，可返回一个安装函数，在事件循环中、新菜单换上之前调用
+
+        预热回调只做计算，不修改事件循环同时在使用的数据；写入缓存放在安装函数中。
+        """
+        self._warmers.append(weakref.WeakMethod(warmer))
+
+    def build(self, path: str) -> Tuple[MenuService, List[Callable[[], None]]]:
+        """加载新菜单、构建索引并调用预热回调（耗时操作，不影响当前菜单），返回新菜单与预热回调返回的安装函数
+
+        path 为目录时按预构建的菜单制品加载，否则按JSON/CSV菜单文件加载。
+        """
+        if os.path.isdir(path):
+            menu_service = MenuService(artifact_path=path)
+            if menu_service.artifact is None:
+                raise ValueError(f"无法加载菜单制品: {path}")
+        else:
+            menu_service = MenuService(artifact_path="")
+            menu_service.replace_menu_items(load_menu_file(path))
+        menu_service.build_indexes()
+        self._warmers = [ref for ref in self._warmers if ref() is not None]
+        installers = []
+        for ref in list(self._warmers):
+            warmer = ref()
+            if warmer is not None:
+                install = warmer(menu_service)
+                if install is not None:
+                    installers.append(install)
+        return menu_service, installers
+
+    def swap(self, menu_service: MenuService) -> MenuService:
+        """换上新菜单，返回被替换的旧菜单"""
+        previous, self._current = self._current, menu_service
+        return previous
+
+    async def reload(self, path: str) -> MenuService:
+        """从文件重新加载菜单：在线程池中构建，构建完成后原子替换"""
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+        async with self._reload_lock:
+            menu_service, installers = await asyncio.to_thread(self.build, path)
+            for install in installers:
+                install()
+            previous = self.swap(menu_service)
+        print(f"菜单已更新：版本{previous.version} -> {menu_service.version}（{menu_service.get_item_count()}道菜品）")
+        return menu_service
+
+
+_registry: Optional[MenuRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_menu_registry() -> MenuRegistry:
+    """进程内唯一的菜单注册表（第一次调用时加载菜单）"""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = MenuRegistry()
+    return _registry
+
+
+def get_menu_service() -> MenuService:
+    """FastAPI 依赖：当前生效的菜单"""
+    return get_menu_registry().current
@@ -0,0 +1,73 @@
+import gzip
+import hashlib
+import json
+from typing import Any, Optional
+
+
+class EncodedResponse:
+    """预先序列化的只读接口响应：JSON字节、强ETag，以及可选的gzip压缩版本
+
+    序列化方式与 FastAPI 的 JSONResponse 相同；ETag 取响应体的哈希，同一份菜单在各个 worker、各次重启中都相同。
+    gzip 使用固定的 mtime，压缩结果同样是确定的。
+    """
+
+    __slots__ = ("body", "etag", "gzip_body", "gzip_etag")
+
+    def __init__(self, content: Any, gzip_min_bytes: int = 0):
+        self._encode(json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                                separators=(",", ":")).encode("utf-8"), gzip_min_bytes)
+
+    @classmethod
+    def from_body(cls, body: bytes, gzip_min_bytes: int = 0) -> "EncodedResponse":
+        """由已经序列化好的JSON字节构造（如菜单制品中的菜品记录）"""
+        response = cls.__new__(cls)
+        response._encode(body, gzip_min_bytes)
+        return response
+
+    def _encode(self, body: bytes, gzip_min_bytes: int):
+        self.body = body
+        digest = hashlib.sha256(self.body).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.gzip_body: Optional[bytes] = None
+        self.gzip_etag: Optional[str] = None
+        if 0 < gzip_min_bytes <= len(self.body):
+            compressed = gzip.compress(self.body, compresslevel=9, mtime=0)
+            if len(compressed) < len(self.body):
+                self.gzip_body = compressed
+                # 压缩后是另一种表示，强ETag必须不同
+                self.gzip_etag = f'"{digest}-gzip"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 是否命中（弱比较：忽略 W/ 前缀；* 匹配任意表示）"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Accept-Encoding 是否接受gzip（q=0 表示不接受）"""
+    if not accept_encoding:
+        return False
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    quality = accepted.get("gzip", accepted.get("x-gzip", accepted.get("*", 0.0)))
+    return quality > 0
@@ -0,0 +1,118 @@
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.services.menu_columns import MenuColumns
+from app.services.search_index import top_k
+
+
+class MenuScorer:
+    """推荐打分引擎
+
+    为每道菜预先计算特征列：口味词命中（名称或描述包含该词）、菜系词命中（类别或描述包含该词）、
+    价格档位（独热）、健康标签（描述中的“清蒸”“蔬菜”）以及过敏原位图。
+    一份偏好被转换成权重向量，得分 = 特征矩阵 × 权重向量 + 评分加成，与逐个菜品打分的结果完全一致。
+    口味/菜系词表是开放的：词表中的词建好即常驻，其余的词第一次出现时计算并放进有上限的缓存。
+    """
+
+    TASTE_WEIGHT = 2
+    CUISINE_WEIGHT = 3
+    BUDGET_WEIGHT = 2
+    HEALTH_WEIGHT = 2
+    RATING_WEIGHT = 0.5
+    # 预算关键词 -> 价格档位（与价格独热列的顺序一致）
+    BUDGET_BUCKETS = ("便宜", "中等", "高档")
+    # 健康需求 -> 描述中需要出现的词
+    HEALTH_TAGS = (("清淡", "清蒸"), ("营养", "蔬菜"))
+    MAX_CACHED_TERMS = 128
+
+    def __init__(self, columns: MenuColumns, vocabulary: Iterable[str] = ()):
+        self.columns = columns
+        price = columns.price
+        self._budget_features = np.column_stack(
+            [price <= 30, (price > 30) & (price <= 60), price > 60]
+        ).astype(np.float32)
+        self._health_features = np.column_stack(
+            [self._contains(word, columns.descriptions) for _, word in self.HEALTH_TAGS]
+        ).astype(np.float32)
+        self._rating_bonus = columns.rating * self.RATING_WEIGHT
+
+        # (特征种类, 词) -> 布尔列
+        self._pinned: Dict[Any, np.ndarray] = {}
+        self._cached: "OrderedDict[Any, np.ndarray]" = OrderedDict()
+        for term in vocabulary:
+            self._pinned[("taste", term)] = self._taste_column(term)
+            self._pinned[("cuisine", term)] = self._cuisine_column(term)
+
+    def _contains(self, term: str, *texts: List[str]) -> np.ndarray:
+        mask = np.zeros(self.columns.size, dtype=bool)
+        for values in texts:
+            mask |= np.fromiter((term in value for value in values), dtype=bool, count=self.columns.size)
+        return mask
+
+    def _taste_column(self, term: str) -> np.ndarray:
+        return self._contains(term, self.columns.descriptions_lower, self.columns.names_lower)
+
+    def _cuisine_column(self, term: str) -> np.ndarray:
+        # 类别只需对每个不同的类别判断一次
+        in_category = np.array([term in category for category in self.columns.categories], dtype=bool)
+        return in_category[self.columns.category_codes] | self._contains(term, self.columns.descriptions_lower)
+
+    def _feature(self, kind: str, term: str) -> np.ndarray:
+        key = (kind, term)
+        column = self._pinned.get(key)
+        if column is not None:
+            return column
+        column = self._cached.get(key)
+        if column is not None:
+            self._cached.move_to_end(key)
+            return column
+        column = self._taste_column(term) if kind == "taste" else self._cuisine_column(term)
+        self._cached[key] = column
+        if len(self._cached) > self.MAX_CACHED_TERMS:
+            self._cached.popitem(last=False)
+        return column
+
+    def score(self, tastes: List[str], cuisines: List[str], budget: Any = None,
+              health_concerns: Any = None) -> np.ndarray:
+        """返回每道菜的得分"""
+        features: List[np.ndarray] = []
+        weights: List[float] = []
+        for term, count in Counter(tastes).items():
+            features.append(self._feature("taste", term))
+            weights.append(self.TASTE_WEIGHT * count)
+        for term, count in Counter(cuisines).items():
+            features.append(self._feature("cuisine", term))
+            weights.append(self.CUISINE_WEIGHT * count)
+        if budget:
+            # 价格档位互斥，独热矩阵乘以档位选择向量即得0/1
+            selected = np.array([word in budget for word in self.BUDGET_BUCKETS], dtype=np.float32)
+            features.append(self._budget_features @ selected)
+            weights.append(self.BUDGET_WEIGHT)
+        if health_concerns:
+            selected = np.array([need in health_concerns for need, _ in self.HEALTH_TAGS], dtype=np.float32)
+            features.append((self._health_features @ selected) > 0)
+            weights.append(self.HEALTH_WEIGHT)
+
+        if not features:
+            return self._rating_bonus.copy()
+        matrix = np.column_stack(features).astype(np.float32)
+        # 各项都是小整数，float32 矩阵乘法结果精确；再加评分加成，与逐项累加的浮点结果一致
+        return (matrix @ np.array(weights, dtype=np.float32)).astype(np.float64) + self._rating_bonus
+
+    def recommend(self, tastes: List[str], cuisines: List[str], budget: Any = None, health_concerns: Any = None,
+                  excluded_allergens: Optional[Iterable[str]] = None, limit: int = 5,
+                  extra_scores: Optional[np.ndarray] = None) -> List[int]:
+        """返回得分大于0、不含排除过敏原的前 limit 道菜的位置（同分时按菜单顺序）
+
+        extra_scores 为按菜单位置对齐的附加得分（如语义相似度加成）。
+        """
+        scores = self.score(tastes, cuisines, budget, health_concerns)
+        if extra_scores is not None:
+            scores += extra_scores
+        candidates = scores > 0
+        if excluded_allergens:
+            candidates &= self.columns.free_of(excluded_allergens)
+        positions = np.flatnonzero(candidates)
+        return top_k(positions, scores[positions], limit)
@@ -1,11 +1,40 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Sequence, Callable
+from app.core.config import settings
 from app.models.schemas import MenuItem, SearchRequest, SearchResponse
+from app.services.menu_artifact import MenuArtifact
+from app.services.menu_columns import MenuColumns
+from app.services.menu_filter import MenuFilter
+from app.services.menu_responses import EncodedResponse
+from app.services.search_index import MenuSearchIndex, top_k
+from app.services.vector_index import HashingEmbedder, VectorIndex, create_vector_index, embedding_text
+import hashlib
+import itertools
 import json
+import numpy as np
+
+# 全进程共用的菜单版本号：每个菜单对象创建及每次变更都取一个新值，替换成另一份菜单后版本号也不会重复
+_menu_versions = itertools.count(1)
 
 class MenuService:
-    def __init__(self):
-        # 初始化示例菜品数据
-        self.menu_items = self._load_sample_data()
+    def __init__(self, artifact_path: Optional[str] = None):
+        # 本地文本向量化，用于语义检索
+        self.embedder = HashingEmbedder(settings.EMBEDDING_DIM)
+        # 菜单版本号：菜单每次变更时递增，依赖菜单内容的缓存以此判断是否失效
+        self.version = next(_menu_versions)
+        # 配置了预构建的菜单制品时直接 mmap 打开，否则加载示例菜品数据
+        self.artifact: Optional[MenuArtifact] = None
+        self.menu_items: Sequence[MenuItem] = []
+        self._rebuild_indexes()
+        path = settings.MENU_ARTIFACT_PATH if artifact_path is None else artifact_path
+        if path:
+            try:
+                self.artifact = MenuArtifact.load(path)
+                self.menu_items = self.artifact.items
+                print(f"已加载菜单制品 {self.artifact.version}（{len(self.menu_items)}道菜品）")
+            except (OSError, ValueError, KeyError) as e:
+                print(f"加载菜单制品失败，使用示例菜单: {e}")
+        if self.artifact is None:
+            self.menu_items = self._load_sample_data()
     
     def _load_sample_data(self) -> List[MenuItem]:
         """加载示例菜品数据"""
@@ -307,84 +336,257 @@ class MenuService:
         
         return [MenuItem(**item) for item in sample_data]
     
+    def _rebuild_indexes(self):
+        """菜单变更后清空所有派生数据，下次使用时再按 menu_items 重新构建"""
+        # 列式副本、全文检索索引和向量索引在第一次使用时构建（有制品时直接从制品读取）
+        self._columns: Optional[MenuColumns] = None
+        self._search_index: Optional[MenuSearchIndex] = None
+        self._vector_index: Optional[VectorIndex] = None
+        # ID -> 菜单位置（同一ID保留第一个），以及按评分从高到低的位置顺序，均由列式数据导出
+        self._position_by_id: Optional[Dict[str, int]] = None
+        self._rating_order: Optional[np.ndarray] = None
+        self._fingerprint: Optional[str] = None
+        # 只读菜单接口预先序列化的响应（接口键 -> 响应）
+        self._responses: Dict[str, EncodedResponse] = {}
+
+    @property
+    def fingerprint(self) -> str:
+        """菜单内容指纹（与菜单制品的指纹算法相同，进程重启后不变）"""
+        if self._fingerprint is None:
+            if self.artifact is not None:
+                self._fingerprint = self.artifact.manifest["fingerprint"]
+            else:
+                records = [item.model_dump_json() for item in self.menu_items]
+                self._fingerprint = hashlib.sha1("\n".join(records).encode("utf-8")).hexdigest()
+        return self._fingerprint
+
+    def _mutable_items(self) -> List[MenuItem]:
+        """变更菜单前把菜品转成普通列表，此后不再使用制品"""
+        if not isinstance(self.menu_items, list):
+            self.menu_items = list(self.menu_items)
+        self.artifact = None
+        return self.menu_items
+
+    def replace_menu_items(self, items: List[MenuItem]):
+        """替换整个菜单"""
+        self.menu_items = list(items)
+        self.artifact = None
+        self._rebuild_indexes()
+        self.version = next(_menu_versions)
+
+    def add_menu_item(self, item: MenuItem):
+        """新增菜品"""
+        self._mutable_items().append(item)
+        self._rebuild_indexes()
+        self.version = next(_menu_versions)
+
+    def update_menu_item(self, item: MenuItem) -> bool:
+        """按ID更新菜品"""
+        position = self._get_position_by_id().get(item.id)
+        if position is None:
+            return False
+        self._mutable_items()[position] = item
+        self._rebuild_indexes()
+        self.version = next(_menu_versions)
+        return True
+
+    def remove_menu_item(self, item_id: str) -> bool:
+        """按ID删除菜品"""
+        if item_id not in self._get_position_by_id():
+            return False
+        self.menu_items = [item for item in self.menu_items if item.id != item_id]
+        self.artifact = None
+        self._rebuild_indexes()
+        self.version = next(_menu_versions)
+        return True
+
+    def build_indexes(self):
+        """预先构建所有派生数据（在替换上线前调用，避免第一个请求承担构建耗时）"""
+        self._get_position_by_id()
+        self._get_search_index()
+        self.get_popular_items(0)
+        self.fingerprint
+        if self.artifact is None:
+            # 制品的菜品不在这里解析；GET /menu 的响应在第一次请求时直接由制品中的记录拼接
+            self.get_menu_response()
+        self.get_categories_response()
+        self.get_seasonal_response()
+        self.get_popular_response()
+        if settings.SEMANTIC_SEARCH_ENABLED:
+            self.get_vector_index()
+
     def get_all_menu_items(self) -> List[MenuItem]:
         """获取所有菜品"""
+        if not isinstance(self.menu_items, list):
+            # 制品中的菜品按需解析，需要整份菜单时一次性解析并留存
+            self.menu_items = list(self.menu_items)
         return self.menu_items
     
+    def get_item_count(self) -> int:
+        """菜品总数"""
+        return len(self.menu_items)
+    
+    def get_items_at(self, positions: Iterable[int]) -> List[MenuItem]:
+        """按菜单位置取回菜品（只解析这些菜品）"""
+        return [self.menu_items[position] for position in positions]
+    
+    def _get_position_by_id(self) -> Dict[str, int]:
+        if self._position_by_id is None:
+            positions: Dict[str, int] = {}
+            for position, item_id in enumerate(self.get_menu_columns().ids):
+                positions.setdefault(item_id, position)
+            self._position_by_id = positions
+        return self._position_by_id
+    
     def get_menu_item_by_id(self, item_id: str) -> Optional[MenuItem]:
         """根据ID获取菜品"""
-        for item in self.menu_items:
-            if item.id == item_id:
-                return item
-        return None
+        position = self._get_position_by_id().get(item_id)
+        return None if position is None else self.menu_items[position]
+    
+    def get_items_by_category(self, category: str, limit: Optional[int] = None) -> List[MenuItem]:
+        """获取某个类别下的菜品（按菜单顺序，可只取前 limit 道）"""
+        columns = self.get_menu_columns()
+        code = columns.category_index.get(category)
+        if code is None:
+            return []
+        positions = np.flatnonzero(columns.category_codes == code)[:limit]
+        return self.get_items_at(positions.tolist())
+    
+    def get_category_counts(self) -> Dict[str, int]:
+        """各类别的菜品数（按类别首次出现的顺序）"""
+        columns = self.get_menu_columns()
+        counts = np.bincount(columns.category_codes, minlength=len(columns.categories))
+        return {category: int(count) for category, count in zip(columns.categories, counts)}
     
+    def get_menu_columns(self) -> MenuColumns:
+        """获取与 menu_items 按位置对齐的列式数据"""
+        if self._columns is None:
+            self._columns = self.artifact.columns() if self.artifact is not None else MenuColumns(self.menu_items)
+        return self._columns
+
+    def get_vector_index(self) -> VectorIndex:
+        """获取菜品向量索引（由名称、描述和配料生成向量）"""
+        if self._vector_index is None:
+            if self.artifact is not None and self.artifact.embedding_dim == self.embedder.dim:
+                # 制品中的向量矩阵是只读 mmap，flat 索引直接在其上检索，不复制
+                vectors = self.artifact.embeddings()
+            else:
+                vectors = self.embedder.embed_many([embedding_text(item) for item in self.menu_items])
+            self._vector_index = create_vector_index(
+                vectors,
+                kind=settings.VECTOR_INDEX_TYPE,
+                ivf_lists=settings.VECTOR_IVF_LISTS,
+                ivf_probes=settings.VECTOR_IVF_PROBES
+            )
+        return self._vector_index
+
+    def semantic_search(self, text: str, k: int, allowed: Optional[np.ndarray] = None):
+        """语义检索：返回与文本最相近、相似度不低于阈值的菜品位置及相似度"""
+        if k <= 0 or not self.menu_items:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        positions, similarities = self.get_vector_index().search(self.embedder.embed(text), k, allowed)
+        keep = similarities >= settings.SEMANTIC_MIN_SIMILARITY
+        return positions[keep], similarities[keep]
+
+    def _get_search_index(self) -> MenuSearchIndex:
+        if self._search_index is None:
+            self._search_index = self.artifact.search_index() if self.artifact is not None \
+                else MenuSearchIndex(self.menu_items)
+        return self._search_index
+
     def search_menu_items(self, request: SearchRequest) -> SearchResponse:
-        """搜索菜品"""
-        query = request.query.lower()
-        results = []
-        
-        for item in self.menu_items:
-            # 搜索名称、描述、类别、配料
-            if (query in item.name.lower() or 
-                query in item.description.lower() or 
-                query in item.category.lower() or
-                any(query in ingredient.lower() for ingredient in item.ingredients)):
-                results.append(item)
+        """搜索菜品（名称、描述、类别、配料中包含查询串的菜品，按相关度排序；可选语义检索补足结果）"""
+        positions, scores = self._get_search_index().search(request.query)
         
         # 应用过滤器
-        if request.filters:
-            results = self._apply_filters(results, request.filters)
+        predicate = self.compile_filters(request.filters) if request.filters else None
+        if predicate is not None and len(positions):
+            keep = self._filter_mask(predicate, positions)
+            positions, scores = positions[keep], scores[keep]
+        
+        # 只对前 limit 个结果排序，total_count 为全部命中数
+        results = self.get_items_at(top_k(positions, scores, request.limit))
         
-        # 限制结果数量
-        results = results[:request.limit]
+        # 语义检索阶段：关键词命中不足 limit 时，用语义最相近的其它菜品补足（不计入 total_count）
+        semantic = settings.SEMANTIC_SEARCH_ENABLED if request.semantic is None else request.semantic
+        if semantic and request.query and len(results) < request.limit:
+            allowed = np.ones(len(self.menu_items), dtype=bool)
+            if predicate is not None:
+                allowed = self._filter_mask(predicate)
+            allowed[positions] = False
+            extra, _ = self.semantic_search(request.query, request.limit - len(results), allowed)
+            results += self.get_items_at(extra.tolist())
         
         return SearchResponse(
             results=results,
-            total_count=len(results),
+            total_count=len(positions),
             query=request.query
         )
     
+    def _filter_mask(self, predicate: MenuFilter, positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """过滤条件在整份菜单（或指定位置）上的布尔掩码"""
+        keep = predicate.mask(self.get_menu_columns(), positions)
+        if keep is None:
+            menu_items = self.menu_items
+            selected = range(len(menu_items)) if positions is None else positions.tolist()
+            keep = np.array([predicate(menu_items[position]) for position in selected], dtype=bool)
+        return keep
+    
+    def compile_filters(self, filters: Dict[str, Any]) -> MenuFilter:
+        """把过滤条件编译成可复用的判断函数"""
+        return MenuFilter(filters)
+    
     def _apply_filters(self, items: List[MenuItem], filters: Dict[str, Any]) -> List[MenuItem]:
         """应用过滤器"""
-        filtered_items = items
-        
-        # 价格过滤
-        if "max_price" in filters:
-            filtered_items = [item for item in filtered_items if item.price <= filters["max_price"]]
-        
-        if "min_price" in filters:
-            filtered_items = [item for item in filtered_items if item.price >= filters["min_price"]]
-        
-        # 类别过滤
-        if "category" in filters:
-            filtered_items = [item for item in filtered_items if item.category == filters["category"]]
-        
-        # 过敏原过滤
-        if "exclude_allergens" in filters:
-            exclude_allergens = filters["exclude_allergens"]
-            filtered_items = [item for item in filtered_items 
-                           if not any(allergen in exclude_allergens for allergen in item.allergens)]
-        
-        # 季节性过滤
-        if "seasonal_only" in filters and filters["seasonal_only"]:
-            filtered_items = [item for item in filtered_items if item.is_seasonal]
-        
-        # 评分过滤
-        if "min_rating" in filters:
-            filtered_items = [item for item in filtered_items if item.rating >= filters["min_rating"]]
-        
-        return filtered_items
+        return MenuFilter(filters).apply(items)
     
     def get_categories(self) -> List[str]:
         """获取所有菜品类别"""
-        categories = set(item.category for item in self.menu_items)
-        return list(categories)
+        return list(self.get_menu_columns().categories)
     
     def get_seasonal_items(self) -> List[MenuItem]:
         """获取季节性菜品"""
-        return [item for item in self.menu_items if item.is_seasonal]
+        return self.get_items_at(np.flatnonzero(self.get_menu_columns().is_seasonal).tolist())
     
     def get_popular_items(self, limit: int = 5) -> List[MenuItem]:
-        """获取热门菜品（按评分排序）"""
-        sorted_items = sorted(self.menu_items, key=lambda x: x.rating, reverse=True)
-        return sorted_items[:limit] 
\ No newline at end of file
+        """获取热门菜品（按评分排序，同分保持菜单顺序）"""
+        if self._rating_order is None:
+            self._rating_order = np.argsort(-self.get_menu_columns().rating, kind="stable")
+        return self.get_items_at(self._rating_order[:limit].tolist())
+
+    def _encoded_response(self, key: str, build: Callable[[], Any]) -> EncodedResponse:
+        """只读接口的预序列化响应：每个菜单版本只序列化一次，菜单变更时随其他派生数据一起清空"""
+        return self._cached_response(key, lambda: EncodedResponse(build(), settings.MENU_RESPONSE_GZIP_MIN_BYTES))
+
+    def _cached_response(self, key: str, encode: Callable[[], EncodedResponse]) -> EncodedResponse:
+        response = self._responses.get(key)
+        if response is None:
+            response = self._responses[key] = encode()
+        return response
+
+    @staticmethod
+    def _dump_items(items: List[MenuItem]) -> List[Dict[str, Any]]:
+        return [item.model_dump(mode="json") for item in items]
+
+    def get_menu_response(self) -> EncodedResponse:
+        """GET /menu 的响应（使用制品时直接拼接制品中已序列化的菜品记录，不解析菜品）"""
+        if self.artifact is not None:
+            items = self.artifact.items
+            return self._cached_response("menu", lambda: EncodedResponse.from_body(
+                items.json_array(), settings.MENU_RESPONSE_GZIP_MIN_BYTES
+            ))
+        return self._encoded_response("menu", lambda: self._dump_items(self.get_all_menu_items()))
+
+    def get_categories_response(self) -> EncodedResponse:
+        """GET /categories 的响应"""
+        return self._encoded_response("categories", lambda: {"categories": self.get_categories()})
+
+    def get_seasonal_response(self) -> EncodedResponse:
+        """GET /seasonal 的响应"""
+        return self._encoded_response("seasonal", lambda: {"items": self._dump_items(self.get_seasonal_items())})
+
+    def get_popular_response(self, limit: int = 5) -> EncodedResponse:
+        """GET /popular 的响应（超出菜品数的 limit 与菜品数等价，缓存的响应数不超过菜品数的两倍）"""
+        count = self.get_item_count()
+        limit = max(-count, min(limit, count))
+        return self._encoded_response(f"popular:{limit}", lambda: {"items": self._dump_items(self.get_popular_items(limit))})
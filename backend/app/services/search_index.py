@@ -0,0 +1,166 @@
+import math
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.models.schemas import MenuItem
+
+
+class MenuSearchIndex:
+    """菜品全文检索倒排索引
+
+    菜单以中文为主，无法按空格分词，因此对名称、描述、类别和每个配料分别切出
+    1~3 个字的 n-gram 建立倒排表（n-gram 不跨字段），查询时：
+      - 查询不超过 3 个字：查询本身就是一个 n-gram，倒排表即为精确的命中集合；
+      - 查询更长：对查询的所有三元组求倒排表交集得到候选，再逐个校验子串，
+        命中规则与原来的“任一字段包含查询串”完全一致。
+    命中的菜品按 BM25 打分（查询的 n-gram 作为词项，文档长度为各字段总字数）。
+    """
+
+    MAX_GRAM = 3
+    SEPARATOR = "\x00"
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, items: Sequence[MenuItem]):
+        self.size = len(items)
+        # 每个菜品小写化后的字段（以\x00连接），用于长查询的子串校验
+        self._texts: Sequence[str] = []
+        doc_lengths = np.zeros(self.size, dtype=np.float32)
+        grams: List[str] = []
+        positions: List[int] = []
+        tfs: List[int] = []
+
+        for position, item in enumerate(items):
+            fields = [text.lower() for text in [item.name, item.description, item.category, *item.ingredients]]
+            self._texts.append(self.SEPARATOR.join(fields))
+            doc_lengths[position] = sum(len(text) for text in fields)
+            counts = Counter([gram for text in fields for gram in self._grams(text)])
+            grams.extend(counts.keys())
+            tfs.extend(counts.values())
+            positions.extend([position] * len(counts))
+
+        # 倒排表按 CSR 方式存放：所有 n-gram 的菜品位置/词频拼在一起，按排好序的 n-gram 分段
+        vocabulary: Dict[str, int] = {}
+        gram_ids = np.array([vocabulary.setdefault(gram, len(vocabulary)) for gram in grams], dtype=np.int64)
+        names = np.array(list(vocabulary), dtype=f"<U{self.MAX_GRAM}")
+        name_order = np.argsort(names, kind="stable")
+        ranks = np.empty(len(names), dtype=np.int64)
+        ranks[name_order] = np.arange(len(names))
+        gram_ranks = ranks[gram_ids]
+        order = np.argsort(gram_ranks, kind="stable")
+        self._positions = np.array(positions, dtype=np.int32)[order]
+        self._tfs = np.array(tfs, dtype=np.float32)[order]
+        # 升序的 n-gram 表及其在倒排数组中的起止偏移（第i个 n-gram 占 offsets[i]:offsets[i+1]）
+        self._vocabulary = names[name_order]
+        self._offsets = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(gram_ranks, minlength=len(names)), out=self._offsets[1:])
+
+        average = float(doc_lengths.mean()) if self.size else 0.0
+        # BM25 长度归一化部分只与文档有关，建索引时预先算好
+        self._length_norm = self.K1 * (1 - self.B + self.B * doc_lengths / max(average, 1e-9))
+
+    def to_arrays(self) -> Dict[str, Any]:
+        """导出索引数据（数组及字符串序列），用于写入预构建的菜单制品"""
+        return {
+            "positions": self._positions,
+            "tfs": self._tfs,
+            "vocabulary": self._vocabulary,
+            "offsets": self._offsets,
+            "length_norm": self._length_norm,
+            "texts": self._texts
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, Any]) -> "MenuSearchIndex":
+        """由 to_arrays 导出的数据（可以是只读 mmap 数组）直接恢复索引，不需要重新切分文本"""
+        index = cls.__new__(cls)
+        index._positions = arrays["positions"]
+        index._tfs = arrays["tfs"]
+        index._vocabulary = arrays["vocabulary"]
+        index._offsets = arrays["offsets"]
+        index._length_norm = arrays["length_norm"]
+        index._texts = arrays["texts"]
+        index.size = len(index._length_norm)
+        return index
+
+    def _span(self, gram: str) -> Optional[Tuple[int, int]]:
+        """n-gram 在倒排数组中的 (起始偏移, 结束偏移)，不存在时返回 None"""
+        i = int(np.searchsorted(self._vocabulary, gram))
+        if i == len(self._vocabulary) or self._vocabulary[i] != gram:
+            return None
+        return int(self._offsets[i]), int(self._offsets[i + 1])
+
+    def _posting(self, span: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 n-gram 的 (升序的菜品位置, 对应词频)"""
+        start, end = span
+        return self._positions[start:end], self._tfs[start:end]
+
+    @classmethod
+    def _grams(cls, text: str) -> List[str]:
+        return [text[start:start + n] for n in range(1, cls.MAX_GRAM + 1) for start in range(len(text) - n + 1)]
+
+    def _idf(self, document_frequency: int) -> float:
+        return math.log(1 + (self.size - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def search(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """返回所有命中菜品的位置（升序）及其得分"""
+        query = query.lower()
+        if not query:
+            # 空串包含于任何字段，全部命中
+            return np.arange(self.size, dtype=np.int32), np.zeros(self.size, dtype=np.float32)
+
+        n = min(len(query), self.MAX_GRAM)
+        spans = [self._span(term) for term in set(query[i:i + n] for i in range(len(query) - n + 1))]
+        if any(span is None for span in spans):
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+        spans.sort(key=lambda span: span[1] - span[0])
+
+        # 从最短的倒排表开始求交集
+        candidates = self._posting(spans[0])[0]
+        for span in spans[1:]:
+            if not len(candidates):
+                break
+            positions = self._posting(span)[0]
+            # 两个倒排表都是升序的，用二分查找求交集，代价只与较短的候选集有关
+            found = np.searchsorted(positions, candidates)
+            found[found == len(positions)] = 0
+            candidates = candidates[positions[found] == candidates]
+
+        if len(query) > self.MAX_GRAM and len(candidates):
+            if self.SEPARATOR in query:
+                verified = [
+                    position for position in candidates.tolist()
+                    if any(query in text for text in self._texts[position].split(self.SEPARATOR))
+                ]
+            else:
+                texts = self._texts
+                verified = [position for position in candidates.tolist() if query in texts[position]]
+            candidates = np.array(verified, dtype=np.int32)
+
+        scores = np.zeros(len(candidates), dtype=np.float32)
+        norm = self._length_norm[candidates]
+        for span in spans:
+            positions, tfs = self._posting(span)
+            tf = tfs[np.searchsorted(positions, candidates)]
+            scores += self._idf(len(positions)) * tf * (self.K1 + 1) / (tf + norm)
+        return candidates, scores
+
+
+def top_k_indices(scores: np.ndarray, positions: np.ndarray, k: int) -> np.ndarray:
+    """按得分从高到低取前k个元素的下标，同分时按 positions（菜单顺序）"""
+    if k <= 0 or not len(positions):
+        return np.zeros(0, dtype=np.int64)
+    candidates = np.arange(len(positions))
+    if k < len(positions):
+        # 先用 partition 找到第k高的分数，只对可能进入前k的元素排序
+        threshold = -np.partition(-scores, k - 1)[k - 1]
+        candidates = np.flatnonzero(scores >= threshold)
+    order = np.lexsort((positions[candidates], -scores[candidates]))[:k]
+    return candidates[order]
+
+
+def top_k(positions: np.ndarray, scores: np.ndarray, k: int) -> List[int]:
+    """按得分从高到低取前k个位置，同分时按菜单顺序"""
+    return positions[top_k_indices(scores, positions, k)].tolist()
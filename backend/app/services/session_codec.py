@@ -0,0 +1,246 @@
+import json
+import sys
+from datetime import datetime, timedelta
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+from app.services.session_records import ChatMessage, intern_keys
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时使用标准库 json（格式相同，速度较慢）
+    orjson = None
+
+# 会话编码的格式版本：字段含义变化时递增，解码时拒绝更新版本写入的数据
+SCHEMA_VERSION = 1
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# 会话字段 -> 编码后的短键（conversation_history 与时间字段单独处理）
+_FIELDS = {
+    "user_id": "u",
+    "interaction_count": "n",
+    "conversation_length": "l",
+    "user_preferences": "p",
+    "intent_history": "ih",
+    "emotion_history": "eh",
+    "entity_history": "nh",
+    "context_summary": "s",
+    "version": "ver"
+}
+_TIME_FIELDS = {"created_at": "c", "last_activity": "a"}
+_SPECIAL = {"session_id", "conversation_history"}
+_SEQUENCE_FIELDS = {"intent_history", "emotion_history", "entity_history"}
+
+
+def _default(value: Any) -> Any:
+    """序列化 RingBuffer 等可迭代对象与映射（ChatMessage）"""
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, tuple, set, frozenset)) or hasattr(value, "__iter__"):
+        return list(value)
+    raise TypeError(f"无法编码的类型: {type(value).__name__}")
+
+
+if orjson is not None:
+    def _dumps(value: Any) -> bytes:
+        return orjson.dumps(value, default=_default)
+
+    _loads = orjson.loads
+else:
+    def _dumps(value: Any) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+    def _loads(data: bytes) -> Any:
+        return json.loads(data)
+
+
+def _datetime_to_int(value: datetime) -> int:
+    """本地时间（无时区）-> 自1970-01-01起的微秒数，精确可逆且与时区设置无关"""
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _int_to_datetime(value: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=value)
+
+
+# 消息分析结果（意图、情感、实体）在消息数组中的位置，与对应的信号历史字段
+_ANALYSIS_SLOTS = ((3, "intent_history"), (4, "emotion_history"), (5, "entity_history"))
+
+
+class _ShapeEncoder:
+    """分析结果字典按键的组合（形状）编码：记录中每种形状的键只写一次（k），字典写成 [值..., 形状下标]"""
+
+    def __init__(self):
+        self._shapes: Dict[Tuple[str, ...], int] = {}
+
+    def pack(self, value: Any) -> Any:
+        if not value or not isinstance(value, dict):
+            return value
+        keys = tuple(value)
+        shape = self._shapes.get(keys)
+        if shape is None:
+            shape = self._shapes[keys] = len(self._shapes)
+        return [*value.values(), shape]
+
+    def table(self) -> List[List[str]]:
+        return [list(keys) for keys in self._shapes]
+
+
+class _ShapeDecoder:
+    def __init__(self, table: Optional[List[List[str]]]):
+        # 键只在这里驻留一次，解码出的字典直接使用驻留的键
+        self._keys = [tuple(sys.intern(key) for key in keys) for keys in table or ()]
+
+    def unpack(self, value: Any) -> Any:
+        if isinstance(value, list):
+            # zip 在键用完时停止，末尾的形状下标不会成为值
+            return dict(zip(self._keys[value[-1]], value))
+        return intern_keys(value)
+
+
+def encode_message(message: Mapping, shapes: _ShapeEncoder, refs: Optional[List[Dict[int, int]]] = None) -> List[Any]:
+    """一条消息编码为定长数组 [role, content, timestamp, intent_scores, emotion_scores, entities]，去掉末尾的空值
+
+    分析结果与会话信号历史中的条目是同一个对象时（同一轮对话的分析结果），编码为该条目的下标而不重复写出。
+    """
+    if isinstance(message, ChatMessage):
+        row = [message.role, message.content, message.timestamp,
+               message.intent_scores, message.emotion_scores, message.entities]
+    else:
+        row = [message["role"], message["content"], message.get("timestamp"),
+               message.get("intent_scores"), message.get("emotion_scores"), message.get("entities")]
+    for slot, _field in _ANALYSIS_SLOTS:
+        value = row[slot]
+        if value is None:
+            continue
+        position = refs[slot - 3].get(id(value)) if refs else None
+        row[slot] = position if position is not None else shapes.pack(value)
+    while len(row) > 2 and row[-1] is None:
+        row.pop()
+    return row
+
+
+def decode_message(row: List[Any], shapes: _ShapeDecoder, histories: Optional[List[List[Any]]] = None) -> ChatMessage:
+    if len(row) <= 3:
+        # 没有分析结果的消息（助手回复）
+        return ChatMessage(*row)
+    timestamp = row[2]
+    analysis: List[Any] = [None, None, None]
+    for slot in range(3, len(row)):
+        value = row[slot]
+        if isinstance(value, int):
+            # 引用信号历史中的条目，解码后仍是同一个对象
+            value = histories[slot - 3][value]
+        elif value is not None:
+            value = shapes.unpack(value)
+        analysis[slot - 3] = value
+    return ChatMessage(row[0], row[1], timestamp, *analysis)
+
+
+def encode_messages(messages: Iterable[Mapping]) -> bytes:
+    """编码消息列表（冷历史记录）"""
+    shapes = _ShapeEncoder()
+    rows = [encode_message(message, shapes) for message in messages]
+    return _dumps({"v": SCHEMA_VERSION, "k": shapes.table(), "m": rows})
+
+
+def decode_messages(data: bytes) -> List[ChatMessage]:
+    record = _loads(data)
+    _check_version(record)
+    shapes = _ShapeDecoder(record.get("k"))
+    return [decode_message(row, shapes) for row in record["m"]]
+
+
+def encode_session(session: Mapping[str, Any]) -> bytes:
+    """编码单个会话：版本号与 session_id 总在最前面，时间字段为微秒整数，消息为定长数组（时间戳保持ISO字符串），
+    信号历史与分析结果按形状编码，其他字段放在 x 中
+    """
+    record: Dict[str, Any] = {"v": SCHEMA_VERSION, "id": session["session_id"]}
+    for field, key in _TIME_FIELDS.items():
+        value = session.get(field)
+        if isinstance(value, datetime):
+            # 带时区的时间写成ISO字符串
+            record[key] = _datetime_to_int(value) if value.tzinfo is None else value.isoformat()
+        elif value is not None:
+            record[key] = value
+    shapes = _ShapeEncoder()
+    extra = {}
+    for field, value in session.items():
+        if field in _SEQUENCE_FIELDS:
+            record[_FIELDS[field]] = None if value is None else [shapes.pack(item) for item in value]
+        elif field in _FIELDS:
+            record[_FIELDS[field]] = value
+        elif field not in _TIME_FIELDS and field not in _SPECIAL:
+            extra[field] = value
+    history = session.get("conversation_history")
+    if history is not None:
+        refs = [{id(value): position for position, value in enumerate(session.get(field) or ())}
+                for _slot, field in _ANALYSIS_SLOTS]
+        record["h"] = [encode_message(message, shapes, refs) for message in history]
+    record["k"] = shapes.table()
+    if extra:
+        record["x"] = extra
+    return _dumps(record)
+
+
+def decode_session(data: bytes) -> Dict[str, Any]:
+    """解码单个会话（消息为 ChatMessage，历史字段为普通列表，可再用 compact_session 转为紧凑表示；字典的键已驻留）"""
+    record = _loads(data)
+    _check_version(record)
+    shapes = _ShapeDecoder(record.get("k"))
+    session: Dict[str, Any] = {"session_id": record["id"]}
+    for field, key in _TIME_FIELDS.items():
+        value = record.get(key)
+        if isinstance(value, int):
+            session[field] = _int_to_datetime(value)
+        elif isinstance(value, str):
+            session[field] = datetime.fromisoformat(value)
+        elif value is not None:
+            session[field] = value
+    for field, key in _FIELDS.items():
+        if key in record:
+            value = record[key]
+            if field in _SEQUENCE_FIELDS and value is not None:
+                value = [shapes.unpack(item) for item in value]
+            session[field] = value
+    if "h" in record:
+        histories = [session.get(field) for _slot, field in _ANALYSIS_SLOTS]
+        session["conversation_history"] = [decode_message(row, shapes, histories) for row in record["h"]]
+    session.update(record.get("x", ()))
+    return session
+
+
+def _check_version(record: Dict[str, Any]):
+    if record.get("v", 0) > SCHEMA_VERSION:
+        raise ValueError(f"不支持的会话编码版本: {record.get('v')}（当前为 {SCHEMA_VERSION}）")
+
+
+# ---- JSON-lines 文件：每行一个会话，可逐行流式解码 ----
+
+def dump_sessions(sessions: Iterable[Mapping[str, Any]], f: BinaryIO) -> int:
+    """逐个会话写入一行，返回写入的会话数"""
+    count = 0
+    for session in sessions:
+        f.write(encode_session(session))
+        f.write(b"\n")
+        count += 1
+    return count
+
+
+def iter_sessions(f: BinaryIO) -> Iterator[Dict[str, Any]]:
+    """逐行解码会话，任一时刻只持有一个会话"""
+    for line in f:
+        if line.strip():
+            yield decode_session(line)
+
+
+def find_session(f: BinaryIO, session_id: str) -> Optional[Dict[str, Any]]:
+    """按 session_id 查找单个会话：只比较每行的前缀，其余会话不解码"""
+    prefix = b'{"v":%d,"id":%s,' % (SCHEMA_VERSION, _dumps(session_id))
+    for line in f:
+        if line.startswith(prefix):
+            return decode_session(line)
+    return None
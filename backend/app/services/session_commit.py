@@ -0,0 +1,225 @@
+import asyncio
+import random
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from app.services.session_store import SessionConflictError, SessionStore
+
+Replay = Callable[[Dict[str, Any]], None]
+
+
+class SessionLocks:
+    """按会话ID分配的异步锁：同一会话的对话轮次串行执行，不同会话互不阻塞
+
+    锁只在有协程持有或等待时存在，用完即删除，字典大小与正在进行中的会话数相同。
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._holders: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def hold(self, session_id: str) -> AsyncIterator[None]:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        self._holders[session_id] = self._holders.get(session_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._holders[session_id] -= 1
+            if not self._holders[session_id]:
+                del self._holders[session_id]
+                del self._locks[session_id]
+
+    def locked(self, session_id: str) -> bool:
+        """会话是否有进行中（或等待中）的对话轮次"""
+        return session_id in self._holders
+
+    def active(self) -> List[str]:
+        """有进行中（或等待中）对话轮次的会话ID"""
+        return list(self._holders)
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class SessionCommitter:
+    """会话的延迟批量保存（group commit）
+
+    对话轮次结束时只把会话标记为待保存，并登记本轮修改的重放函数；后台任务每隔 interval_seconds
+    把所有待保存、且没有进行中对话的会话在一个写事务中一起保存，关闭时保存全部剩余会话。
+    interval_seconds 不大于0时每轮对话结束立即保存。
+    保存时发生版本冲突（其他 worker 已写入同一会话）的会话，用 reload 取得最新版本，按顺序重放尚未保存的各轮修改后重试。
+    """
+
+    def __init__(self, store: SessionStore, sessions: Dict[str, Dict[str, Any]], locks: SessionLocks,
+                 reload: Callable[[str, Optional[str]], Awaitable[Dict[str, Any]]], interval_seconds: float,
+                 max_retries: int = 10, backoff_seconds: float = 0.02):
+        self.store = store
+        self.sessions = sessions
+        self.locks = locks
+        self.reload = reload
+        self.interval_seconds = interval_seconds
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        # session_id -> 尚未保存的各轮修改（按时间顺序）
+        self._pending: Dict[str, List[Replay]] = {}
+        self._task: Optional["asyncio.Task[None]"] = None
+        self.flushes = 0
+        self.saved = 0
+        self.turns_saved = 0
+        self.conflicts = 0
+        self.failures = 0
+        self.last_batch_size = 0
+        self.last_flush_ms = 0.0
+
+    @property
+    def deferred(self) -> bool:
+        return self.interval_seconds > 0
+
+    def mark_dirty(self, session_id: str, replay: Replay):
+        """登记一轮对话对会话的修改（调用方持有该会话的锁）"""
+        self._pending.setdefault(session_id, []).append(replay)
+        if self.deferred:
+            self._ensure_running()
+
+    def is_dirty(self, session_id: str) -> bool:
+        return session_id in self._pending
+
+    def dirty_session_ids(self) -> List[str]:
+        return list(self._pending)
+
+    def discard(self, session_id: str):
+        """放弃会话尚未保存的修改（会话已被删除）"""
+        self._pending.pop(session_id, None)
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.flush_idle()
+            except Exception as e:
+                print(f"批量保存会话失败: {e}")
+
+    async def flush_idle(self):
+        """保存没有进行中对话的待保存会话（进行中的会话在其对话结束后的下一批保存）"""
+        session_ids = [session_id for session_id in self._pending if not self.locks.locked(session_id)]
+        async with AsyncExitStack() as stack:
+            for session_id in session_ids:
+                await stack.enter_async_context(self.locks.hold(session_id))
+            await self.flush_locked(session_ids)
+
+    async def flush(self, session_ids: Optional[Iterable[str]] = None):
+        """立即保存指定（默认全部）待保存会话，等待其进行中的对话结束；调用方不能持有这些会话的锁"""
+        targets = sorted(self._pending if session_ids is None else
+                         [session_id for session_id in session_ids if session_id in self._pending])
+        async with AsyncExitStack() as stack:
+            for session_id in targets:
+                await stack.enter_async_context(self.locks.hold(session_id))
+            await self.flush_locked(targets)
+
+    async def flush_locked(self, session_ids: Iterable[str]):
+        """保存指定的待保存会话（调用方已持有这些会话的锁）"""
+        batch = []
+        for session_id in session_ids:
+            replays = self._pending.get(session_id)
+            if replays is None:
+                continue
+            session = self.sessions.get(session_id)
+            if session is None:
+                # 会话已被删除或清理
+                del self._pending[session_id]
+                continue
+            batch.append((session_id, session, len(replays)))
+        if not batch:
+            return
+
+        start = time.perf_counter()
+        try:
+            conflicts = await self.store.save_many([session for _, session, _ in batch])
+        except Exception as e:
+            # 保留待保存状态，下一批重试
+            self.failures += 1
+            print(f"保存会话数据失败: {e}")
+            return
+        conflicted = {conflict.session_id for conflict in conflicts}
+        for session_id, _, count in batch:
+            if session_id not in conflicted:
+                self._done(session_id, count)
+        for session_id in conflicted:
+            self.conflicts += 1
+            await self._resolve_conflict(session_id)
+
+        self.flushes += 1
+        self.last_batch_size = len(batch)
+        self.last_flush_ms = (time.perf_counter() - start) * 1e3
+
+    def _done(self, session_id: str, count: int):
+        replays = self._pending.get(session_id)
+        if replays is None:
+            return
+        del replays[:count]
+        if not replays:
+            del self._pending[session_id]
+        self.saved += 1
+        self.turns_saved += count
+
+    async def _resolve_conflict(self, session_id: str):
+        """重新加载最新的会话，重放尚未保存的各轮修改后保存"""
+        for attempt in range(self.max_retries):
+            # 随机退避，错开同时重试的 worker
+            await asyncio.sleep(random.uniform(0, self.backoff_seconds))
+            replays = list(self._pending.get(session_id, ()))
+            stale = self.sessions.get(session_id) or {}
+            session = await self.reload(session_id, stale.get("user_id"))
+            for replay in replays:
+                replay(session)
+            try:
+                await self.store.save(session)
+            except SessionConflictError:
+                self.conflicts += 1
+                continue
+            except Exception as e:
+                self.failures += 1
+                print(f"保存会话数据失败: {e}")
+                return
+            self._done(session_id, len(replays))
+            return
+        print(f"保存会话 {session_id} 时多次发生版本冲突，放弃未保存的修改")
+        self._pending.pop(session_id, None)
+
+    async def stop(self):
+        """停止后台任务并保存全部剩余会话"""
+        task, self._task = self._task, None
+        # 其他（已结束的）事件循环中创建的任务无需处理
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "deferred": self.deferred,
+            "interval_seconds": self.interval_seconds,
+            "pending_sessions": len(self._pending),
+            "pending_turns": sum(len(replays) for replays in self._pending.values()),
+            "active_sessions": len(self.locks),
+            "flushes": self.flushes,
+            "sessions_saved": self.saved,
+            "turns_saved": self.turns_saved,
+            "conflicts": self.conflicts,
+            "failures": self.failures,
+            "last_batch_size": self.last_batch_size,
+            "last_flush_ms": round(self.last_flush_ms, 3)
+        }
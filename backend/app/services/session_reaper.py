@@ -0,0 +1,176 @@
+import asyncio
+import heapq
+import time
+from datetime import datetime, timedelta
+from typing import AbstractSet, Any, Dict, List, Optional, Tuple
+
+
+class ExpiryIndex:
+    """按最后活动时间排序的过期索引（惰性删除的小顶堆）
+
+    touch 只把新的时间戳压入堆，旧条目留在堆中，弹出时与当前时间戳不符即丢弃；
+    失效条目多于存活条目时重建堆，因此堆的大小始终是存活键数的常数倍，找出过期键的代价只与过期（及失效）条目数有关。
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        self._timestamps: Dict[str, float] = {}
+
+    def touch(self, key: str, timestamp: float):
+        if self._timestamps.get(key) == timestamp:
+            return
+        self._timestamps[key] = timestamp
+        heapq.heappush(self._heap, (timestamp, key))
+        self._maybe_rebuild()
+
+    def discard(self, key: str):
+        if self._timestamps.pop(key, None) is not None:
+            self._maybe_rebuild()
+
+    def expired(self, cutoff: float, limit: Optional[int] = None, exclude: AbstractSet[str] = frozenset()) -> List[str]:
+        """时间戳早于 cutoff 的键（不修改索引，跳过 exclude 中的键）：只遍历堆顶部早于 cutoff 的子树"""
+        keys = []
+        stack = [0] if self._heap else []
+        while stack and (limit is None or len(keys) < limit):
+            position = stack.pop()
+            timestamp, key = self._heap[position]
+            if timestamp >= cutoff:
+                continue
+            if self._timestamps.get(key) == timestamp and key not in exclude:
+                keys.append(key)
+            stack.extend(child for child in (2 * position + 1, 2 * position + 2) if child < len(self._heap))
+        return keys
+
+    def pop_expired(self, cutoff: float, limit: Optional[int] = None) -> List[str]:
+        """按时间顺序弹出并移除时间戳早于 cutoff 的键"""
+        keys = []
+        while self._heap and self._heap[0][0] < cutoff and (limit is None or len(keys) < limit):
+            timestamp, key = heapq.heappop(self._heap)
+            if self._timestamps.get(key) == timestamp:
+                del self._timestamps[key]
+                keys.append(key)
+        return keys
+
+    def _maybe_rebuild(self):
+        if len(self._heap) > 2 * len(self._timestamps) + 64:
+            self._heap = [(timestamp, key) for key, timestamp in self._timestamps.items()]
+            heapq.heapify(self._heap)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._timestamps
+
+    def __len__(self) -> int:
+        return len(self._timestamps)
+
+    @property
+    def heap_size(self) -> int:
+        return len(self._heap)
+
+
+class SessionReaper:
+    """后台定期清理过期会话
+
+    每次清理先由会话存储分批删除最后活动时间早于截止时间的会话（每批之间让出事件循环），
+    再从内存的过期索引中弹出已过期的会话并移出内存缓存，两步的工作量都只与过期会话数有关。
+    有进行中对话或尚未保存修改的会话不清理，清理也不等待进行中的对话。
+    """
+
+    def __init__(self, service: Any, ttl_seconds: float, interval_seconds: float, batch_size: int = 500):
+        self.service = service
+        self.ttl_seconds = ttl_seconds
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self._task: Optional["asyncio.Task[None]"] = None
+        self.runs = 0
+        self.deleted = 0
+        self.evicted = 0
+        self.last_run_at: Optional[datetime] = None
+        self.last_duration_ms = 0.0
+        self.last_expired = 0
+
+    def start(self):
+        """在当前事件循环中启动后台清理任务（interval_seconds 不大于0时不启动）"""
+        if self.interval_seconds > 0 and (self._task is None or self._task.done()):
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                await self.reap()
+            except Exception as e:
+                print(f"清理过期会话失败: {e}")
+
+    async def reap(self, max_age: Optional[timedelta] = None) -> int:
+        """清理最后活动早于 max_age（默认为会话TTL）之前的会话，返回被清理的会话数"""
+        started = time.perf_counter()
+        cutoff = datetime.now() - (max_age if max_age is not None else timedelta(seconds=self.ttl_seconds))
+        sessions = self.service.user_sessions
+        expiry: ExpiryIndex = self.service.session_expiry
+        committer = self.service.session_committer
+        locks = self.service.session_locks
+        # 先写入空闲会话的待保存修改，存储中的最后活动时间才是最新的；
+        # 有进行中对话的会话不等待，与仍未保存的会话一起跳过
+        await committer.flush_idle()
+        busy = set(locks.active())
+        busy.update(committer.dirty_session_ids())
+
+        deleted = set()
+        while True:
+            batch = await self.service.session_store.delete_expired(cutoff, limit=self.batch_size, exclude=busy)
+            deleted.update(batch)
+            if len(batch) < self.batch_size:
+                break
+            await asyncio.sleep(0)
+        for session_id in deleted:
+            # 删除期间开始了新一轮对话的会话留在内存中，对话结束后重新保存
+            if locks.locked(session_id) or committer.is_dirty(session_id):
+                continue
+            sessions.pop(session_id, None)
+            expiry.discard(session_id)
+
+        # 内存中已过期但存储中仍存活的会话（其他 worker 刚更新过）只移出缓存
+        evicted = []
+        for session_id in expiry.pop_expired(cutoff.timestamp()):
+            session = sessions.get(session_id)
+            if session is not None and (locks.locked(session_id) or committer.is_dirty(session_id)):
+                # 仍在使用的会话放回过期索引
+                expiry.touch(session_id, session["last_activity"].timestamp())
+                continue
+            evicted.append(session_id)
+        for session_id in evicted:
+            sessions.pop(session_id, None)
+
+        self.runs += 1
+        self.deleted += len(deleted)
+        self.evicted += len(evicted)
+        self.last_expired = len(deleted.union(evicted))
+        self.last_run_at = datetime.now()
+        self.last_duration_ms = (time.perf_counter() - started) * 1e3
+        return self.last_expired
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "ttl_seconds": self.ttl_seconds,
+            "interval_seconds": self.interval_seconds,
+            "runs": self.runs,
+            "deleted": self.deleted,
+            "evicted": self.evicted,
+            "last_expired": self.last_expired,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "last_duration_ms": round(self.last_duration_ms, 3),
+            "sessions_in_memory": len(self.service.user_sessions),
+            "tracked_sessions": len(self.service.session_expiry),
+            "heap_size": self.service.session_expiry.heap_size
+        }
@@ -0,0 +1,127 @@
+import sys
+from collections import deque
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+ROLE_USER = sys.intern("user")
+ROLE_ASSISTANT = sys.intern("assistant")
+
+
+def intern_keys(data: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """字典的键改用驻留字符串（从JSON/pickle读回的会话中，每个字典都各有一份键字符串）"""
+    if not data:
+        return data
+    if all(sys.intern(key) is key for key in data):
+        # 已驻留时保持原对象，消息与信号历史共享的分析结果不会被复制成两份
+        return data
+    return {sys.intern(key): value for key, value in data.items()}
+
+
+class ChatMessage(Mapping):
+    """一条对话消息（固定字段的紧凑记录）
+
+    以只读映射的方式提供 msg["role"]、msg.get("entities")、msg.items() 等字典接口，
+    未设置的分析字段（助手消息的意图、情感、实体）不出现在映射中。
+    """
+
+    __slots__ = ("role", "content", "timestamp", "intent_scores", "emotion_scores", "entities")
+    _REQUIRED = ("role", "content", "timestamp")
+
+    def __init__(self, role: str, content: str, timestamp: Optional[str] = None,
+                 intent_scores: Optional[Dict[str, float]] = None, emotion_scores: Optional[Dict[str, float]] = None,
+                 entities: Optional[Dict[str, Any]] = None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.timestamp = timestamp
+        self.intent_scores = intent_scores
+        self.emotion_scores = emotion_scores
+        self.entities = entities
+
+    @classmethod
+    def from_dict(cls, data: Mapping) -> "ChatMessage":
+        if isinstance(data, ChatMessage):
+            return data
+        return cls(
+            data["role"], data["content"], data.get("timestamp"),
+            intern_keys(data.get("intent_scores")), intern_keys(data.get("emotion_scores")),
+            intern_keys(data.get("entities"))
+        )
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.__slots__:
+            value = getattr(self, key)
+            if value is not None or key in self._REQUIRED:
+                return value
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self.__slots__:
+            if key in self._REQUIRED or getattr(self, key) is not None:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __reduce__(self):
+        return (ChatMessage, tuple(getattr(self, key) for key in self.__slots__))
+
+    def __repr__(self) -> str:
+        return f"ChatMessage({dict(self)!r})"
+
+
+class RingBuffer(deque):
+    """固定容量的环形缓冲区，支持切片（history[-5:] 返回列表）"""
+
+    __slots__ = ()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        return super().__getitem__(index)
+
+
+class MessageWindow(RingBuffer):
+    """会话的热对话历史：只保留最近 maxlen 条消息
+
+    超出容量被挤出的消息先放入 spilled，由会话存储在下次保存时写入冷存储后清空，因此不会丢失未持久化的消息。
+    """
+
+    __slots__ = ("spilled",)
+
+    def __init__(self, messages: Iterable[Any] = (), maxlen: Optional[int] = None):
+        super().__init__((), maxlen)
+        self.spilled: List[ChatMessage] = []
+        for message in messages:
+            self.append(message)
+
+    def append(self, message: Any):
+        if self.maxlen is not None and len(self) == self.maxlen:
+            self.spilled.append(self[0])
+        super().append(ChatMessage.from_dict(message))
+
+    def extend(self, messages: Iterable[Any]):
+        for message in messages:
+            self.append(message)
+
+
+def compact_session(session: Dict[str, Any], history_window: int, signal_window: int) -> Dict[str, Any]:
+    """把会话转换为紧凑表示（就地修改并返回）
+
+    对话历史换成定长的 MessageWindow（消息为 ChatMessage），意图、情感、实体历史换成定长的 RingBuffer，
+    字典的键改用驻留字符串。已是紧凑表示的字段保持不变。
+    """
+    history = session.get("conversation_history")
+    if not isinstance(history, MessageWindow):
+        session["conversation_history"] = MessageWindow(history or (), maxlen=history_window)
+    for field in ("intent_history", "emotion_history", "entity_history"):
+        values = session.get(field)
+        if not isinstance(values, RingBuffer):
+            session[field] = RingBuffer((intern_keys(value) for value in values or ()), maxlen=signal_window)
+    if session.get("user_preferences"):
+        session["user_preferences"] = intern_keys(session["user_preferences"])
+    return session
+
+
+def plain_messages(messages: Iterable[Mapping]) -> List[Dict[str, Any]]:
+    """转换为普通字典列表（用于接口返回和JSON序列化）"""
+    return [dict(message) for message in messages]
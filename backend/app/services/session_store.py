@@ -0,0 +1,732 @@
+import os
+import json
+import pickle
+import struct
+import asyncio
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import AbstractSet, Callable, Dict, Any, Optional, List, Tuple
+import aiosqlite
+
+from app.services.session_codec import decode_messages, decode_session, encode_messages, encode_session
+from app.services.session_reaper import ExpiryIndex
+
+
+class SessionConflictError(Exception):
+    """保存会话时发现它已被其他进程（worker）修改或删除"""
+
+    def __init__(self, session_id: str, expected: Optional[int], actual: Optional[int]):
+        super().__init__(f"会话 {session_id} 已被其他进程修改（期望版本 {expected}，实际版本 {actual}）")
+        self.session_id = session_id
+        self.expected = expected
+        self.actual = actual
+
+
+class SessionStore:
+    """会话存储接口
+
+    以单个会话为粒度读写，AIService 只依赖这组异步方法，具体持久化方式可替换。
+    shared 为 True 的存储可被多个进程同时使用：会话带有版本号（session["version"]），
+    保存时版本不一致则抛出 SessionConflictError，进程内缓存的会话需先用 current_version 校验。
+    """
+
+    shared = False
+
+    async def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """读取单个会话（对话历史只包含最近的窗口）"""
+        raise NotImplementedError
+
+    async def save(self, session: Dict[str, Any]):
+        """保存单个会话"""
+        raise NotImplementedError
+
+    async def save_many(self, sessions: List[Dict[str, Any]]) -> List[SessionConflictError]:
+        """批量保存会话，返回因版本冲突未能保存的会话的冲突信息（其余会话均已保存）"""
+        conflicts = []
+        for session in sessions:
+            try:
+                await self.save(session)
+            except SessionConflictError as e:
+                conflicts.append(e)
+        return conflicts
+
+    async def delete(self, session_id: str) -> bool:
+        """删除会话"""
+        raise NotImplementedError
+
+    async def delete_expired(self, cutoff: datetime, limit: Optional[int] = None,
+                             exclude: AbstractSet[str] = frozenset()) -> List[str]:
+        """删除最后活动时间早于cutoff的会话（limit不为空时最多删除limit个，跳过exclude中的会话），返回被删除的会话ID"""
+        raise NotImplementedError
+
+    async def load_history(self, session_id: str) -> List[Dict[str, Any]]:
+        """读取完整对话历史"""
+        raise NotImplementedError
+
+    async def current_version(self, session_id: str) -> Optional[int]:
+        """会话在存储中的当前版本（不存在时为 None）；仅 shared 存储需要实现"""
+        return None
+
+    async def close(self):
+        """释放资源"""
+
+
+class AppendOnlySessionStore(SessionStore):
+    """追加写日志的会话存储
+
+    每次保存只向日志末尾追加被修改会话的一条完整记录，而不是重写全部会话。
+    会话的热历史只保留最近的消息，被挤出的较早消息以冷历史记录追加一次，之后不再随会话重复写入。
+    启动时顺序读一遍日志、校验每条记录的CRC并建立 session_id -> 偏移量 的索引，
+    会话内容在首次访问时才解码（记录格式见 session_codec）。
+    日志中失效记录过多时自动压缩（重写存活记录后原子替换）。
+    fsync 为真时每次保存（save_many 为每批）在返回前刷到磁盘；为假时断电可能丢失最近已确认的保存。
+    会话在调用方（事件循环）中编码，文件读写与刷盘在专用的单个线程中按提交顺序执行，不阻塞事件循环。
+    """
+
+    OP_PUT = 1
+    OP_DELETE = 2
+    OP_HISTORY = 3
+
+    # 记录头：负载长度、CRC32、操作类型、session_id长度、最后活动时间戳
+    _HEADER = struct.Struct("<IIBHd")
+    # 旧版本以pickle写入的负载（协议2及以上）以此字节开头，新记录是以 { 开头的会话编码
+    _PICKLE_PREFIX = b"\x80"
+
+    def __init__(self, path: str, fsync: bool = True, compact_min_bytes: int = 1024 * 1024,
+                 legacy_pickle_path: Optional[str] = None):
+        self.path = path
+        self.fsync = fsync
+        self.compact_min_bytes = compact_min_bytes
+        self._lock = threading.RLock()
+        # 文件读写在这个线程中依次执行，写入顺序与调用顺序一致
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-log")
+        # session_id -> (记录偏移量, 记录总长度, 最后活动时间戳)
+        self._index: Dict[str, Tuple[int, int, float]] = {}
+        # session_id -> 按时间顺序的冷历史记录 [(记录偏移量, 记录总长度)]
+        self._history: Dict[str, List[Tuple[int, int]]] = {}
+        # 按最后活动时间排序的过期索引
+        self._expiry = ExpiryIndex()
+        self._live_bytes = 0
+        self._file_size = 0
+
+        log_existed = os.path.exists(path)
+        self._open()
+        if not log_existed and legacy_pickle_path and os.path.exists(legacy_pickle_path):
+            self._migrate_legacy_pickle(legacy_pickle_path)
+
+    # ---- 日志扫描与恢复 ----
+
+    def _open(self):
+        """打开日志文件并建立索引，从第一条损坏的记录起截断（崩溃时写了一半或未刷盘的尾部记录）"""
+        records: List[Tuple[int, int, int, str, float]] = []
+        file_size = 0
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                file_size = os.fstat(f.fileno()).st_size
+                offset = 0
+                while offset + self._HEADER.size <= file_size:
+                    header = f.read(self._HEADER.size)
+                    payload_len, crc, op, sid_len, last_activity = self._HEADER.unpack(header)
+                    record_len = self._HEADER.size + sid_len + payload_len
+                    if op not in (self.OP_PUT, self.OP_DELETE, self.OP_HISTORY) or offset + record_len > file_size:
+                        break
+                    rest = f.read(record_len - self._HEADER.size)
+                    # 未刷盘的尾部可能不止一条记录损坏（如文件已变长但内容是0），每条都校验
+                    if zlib.crc32(header[8:] + rest) != crc:
+                        break
+                    session_id = rest[:sid_len].decode("utf-8", errors="replace")
+                    records.append((offset, record_len, op, session_id, last_activity))
+                    offset += record_len
+
+        valid_end = records[-1][0] + records[-1][1] if records else 0
+        for offset, record_len, op, session_id, last_activity in records:
+            self._apply_index(op, session_id, offset, record_len, last_activity)
+
+        if valid_end < file_size:
+            print(f"会话日志尾部存在不完整或损坏的记录，已截断 {file_size - valid_end} 字节")
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_end)
+        self._file_size = valid_end
+        self._fh = open(self.path, "ab")
+        print(f"会话日志索引完成：{len(self._index)} 个会话")
+
+    def _apply_index(self, op: int, session_id: str, offset: int, record_len: int, last_activity: float):
+        """根据一条记录更新内存索引"""
+        if op == self.OP_HISTORY:
+            self._history.setdefault(session_id, []).append((offset, record_len))
+            self._live_bytes += record_len
+            return
+        previous = self._index.pop(session_id, None)
+        if previous:
+            self._live_bytes -= previous[1]
+        if op == self.OP_DELETE:
+            self._live_bytes -= sum(length for _, length in self._history.pop(session_id, ()))
+            self._expiry.discard(session_id)
+        if op == self.OP_PUT:
+            self._index[session_id] = (offset, record_len, last_activity)
+            self._live_bytes += record_len
+            self._expiry.touch(session_id, last_activity)
+
+    def _read_record(self, f, offset: int, record_len: int) -> Optional[bytes]:
+        """读取并校验一条记录，返回负载；校验失败返回None"""
+        f.seek(offset)
+        data = f.read(record_len)
+        if len(data) != record_len:
+            return None
+        _payload_len, crc, _op, sid_len, _last_activity = self._HEADER.unpack_from(data)
+        body = data[8:]
+        if zlib.crc32(body) != crc:
+            return None
+        return data[self._HEADER.size + sid_len:]
+
+    def _migrate_legacy_pickle(self, legacy_path: str):
+        """一次性导入旧版整体pickle文件"""
+        try:
+            with open(legacy_path, "rb") as f:
+                sessions = pickle.load(f)
+            for session in sessions.values():
+                self._put(session)
+            print(f"已从 {legacy_path} 迁移 {len(sessions)} 个会话")
+        except Exception as e:
+            print(f"迁移旧会话数据失败: {e}")
+
+    # ---- 记录编码 ----
+
+    def _encode_record(self, op: int, session_id: str, last_activity: float, payload: bytes) -> bytes:
+        sid = session_id.encode("utf-8")
+        body = struct.pack("<BHd", op, len(sid), last_activity) + sid + payload
+        return struct.pack("<II", len(payload), zlib.crc32(body)) + body
+
+    def _append(self, op: int, session_id: str, last_activity: float, payload: bytes, sync: bool = True) -> int:
+        """向日志末尾追加一条记录，返回记录偏移量；sync为False时由调用方在批量写入后统一刷盘"""
+        record = self._encode_record(op, session_id, last_activity, payload)
+        offset = self._file_size
+        self._fh.write(record)
+        if sync:
+            self._sync()
+        self._file_size += len(record)
+        self._apply_index(op, session_id, offset, len(record), last_activity)
+        return offset
+
+    def _sync(self):
+        self._fh.flush()
+        if self.fsync:
+            os.fsync(self._fh.fileno())
+
+    # ---- 对外接口 ----
+
+    def _get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """按需读取单个会话"""
+        with self._lock:
+            entry = self._index.get(session_id)
+            if not entry:
+                return None
+            with open(self.path, "rb") as f:
+                payload = self._read_record(f, entry[0], entry[1])
+            if payload is None:
+                print(f"会话 {session_id} 记录校验失败，已忽略")
+                return None
+            return self._decode(payload, decode_session)
+
+    def _decode(self, payload: bytes, decode):
+        """解码记录负载，兼容旧版本写入的pickle记录"""
+        if payload[:1] == self._PICKLE_PREFIX:
+            return pickle.loads(payload)
+        return decode(payload)
+
+    def _encode_session(self, session: Dict[str, Any]) -> Tuple[List[Tuple[int, str, float, bytes]], int]:
+        """把会话编码为待追加的记录（热历史中被挤出的消息先作为冷历史记录），返回记录与其中冷历史的消息数"""
+        last_activity = session.get("last_activity")
+        timestamp = last_activity.timestamp() if isinstance(last_activity, datetime) else 0.0
+        spilled = list(getattr(session.get("conversation_history"), "spilled", ()))
+        records = []
+        if spilled:
+            records.append((self.OP_HISTORY, session["session_id"], timestamp, encode_messages(spilled)))
+        records.append((self.OP_PUT, session["session_id"], timestamp, encode_session(session)))
+        return records, len(spilled)
+
+    def _write(self, records: List[Tuple[int, str, float, bytes]]):
+        """追加一批记录，刷盘一次"""
+        with self._lock:
+            for op, session_id, timestamp, payload in records:
+                self._append(op, session_id, timestamp, payload, sync=False)
+            self._sync()
+            self._maybe_compact()
+
+    @staticmethod
+    def _spilled_written(session: Dict[str, Any], count: int):
+        """冷历史写入后从热历史的待写列表中移除"""
+        if count:
+            del session["conversation_history"].spilled[:count]
+
+    def _put(self, session: Dict[str, Any]):
+        """保存单个会话（只追加该会话的记录）"""
+        records, spilled = self._encode_session(session)
+        self._write(records)
+        self._spilled_written(session, spilled)
+
+    def _cold_history(self, session_id: str) -> List[Any]:
+        """按时间顺序读取会话的冷历史"""
+        messages: List[Any] = []
+        with self._lock:
+            chunks = list(self._history.get(session_id, ()))
+            if not chunks:
+                return messages
+            with open(self.path, "rb") as f:
+                for offset, record_len in chunks:
+                    payload = self._read_record(f, offset, record_len)
+                    if payload is None:
+                        print(f"会话 {session_id} 冷历史记录校验失败，已忽略")
+                        continue
+                    messages.extend(self._decode(payload, decode_messages))
+        return messages
+
+    def _remove(self, session_id: str) -> bool:
+        """删除会话（追加一条删除标记）"""
+        with self._lock:
+            if session_id not in self._index:
+                return False
+            self._append(self.OP_DELETE, session_id, 0.0, b"")
+            self._maybe_compact()
+            return True
+
+    async def _run(self, function: Callable[..., Any], *args) -> Any:
+        """在日志线程中执行文件读写"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return await self._run(self._get, session_id)
+
+    async def save(self, session: Dict[str, Any]):
+        await self.save_many([session])
+
+    async def save_many(self, sessions: List[Dict[str, Any]]) -> List[SessionConflictError]:
+        encoded = [self._encode_session(session) for session in sessions]
+        await self._run(self._write, [record for records, _ in encoded for record in records])
+        for session, (_, spilled) in zip(sessions, encoded):
+            self._spilled_written(session, spilled)
+        return []
+
+    async def delete(self, session_id: str) -> bool:
+        return await self._run(self._remove, session_id)
+
+    def _delete_expired(self, cutoff: datetime, limit: Optional[int], exclude: AbstractSet[str]) -> List[str]:
+        with self._lock:
+            expired = self.expired_session_ids(cutoff, limit, exclude)
+            for session_id in expired:
+                self._remove(session_id)
+        return expired
+
+    async def delete_expired(self, cutoff: datetime, limit: Optional[int] = None,
+                             exclude: AbstractSet[str] = frozenset()) -> List[str]:
+        return await self._run(self._delete_expired, cutoff, limit, exclude)
+
+    def _load_history(self, session_id: str) -> List[Dict[str, Any]]:
+        session = self._get(session_id)
+        if not session:
+            return []
+        return [dict(message) for message in self._cold_history(session_id) + list(session.get("conversation_history", []))]
+
+    async def load_history(self, session_id: str) -> List[Dict[str, Any]]:
+        return await self._run(self._load_history, session_id)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def session_ids(self) -> List[str]:
+        """所有会话ID"""
+        return list(self._index.keys())
+
+    def expired_session_ids(self, cutoff: datetime, limit: Optional[int] = None,
+                            exclude: AbstractSet[str] = frozenset()) -> List[str]:
+        """根据过期索引找出过期会话，无需反序列化，也不遍历全部会话"""
+        return self._expiry.expired(cutoff.timestamp(), limit, exclude)
+
+    # ---- 压缩 ----
+
+    def _maybe_compact(self):
+        if self._file_size > self.compact_min_bytes and self._file_size > 2 * self._live_bytes:
+            self.compact()
+
+    def compact(self):
+        """重写存活记录到新文件，并原子替换旧日志"""
+        with self._lock:
+            tmp_path = self.path + ".compact"
+            new_index: Dict[str, Tuple[int, int, float]] = {}
+            offset = 0
+            new_history: Dict[str, List[Tuple[int, int]]] = {}
+            with open(self.path, "rb") as src, open(tmp_path, "wb") as dst:
+                for session_id, (old_offset, record_len, last_activity) in self._index.items():
+                    # 冷历史记录写在会话记录之前，保持原有顺序
+                    for chunk_offset, chunk_len in self._history.get(session_id, ()):
+                        src.seek(chunk_offset)
+                        dst.write(src.read(chunk_len))
+                        new_history.setdefault(session_id, []).append((offset, chunk_len))
+                        offset += chunk_len
+                    src.seek(old_offset)
+                    dst.write(src.read(record_len))
+                    new_index[session_id] = (offset, record_len, last_activity)
+                    offset += record_len
+                dst.flush()
+                os.fsync(dst.fileno())
+            self._fh.close()
+            os.replace(tmp_path, self.path)
+            if self.fsync:
+                # 目录项也要刷盘，否则崩溃后可能丢失这次替换
+                dir_fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            self._fh = open(self.path, "ab")
+            self._index = new_index
+            self._history = new_history
+            self._file_size = offset
+            self._live_bytes = offset
+            print(f"会话日志已压缩：{len(new_index)} 个会话，{offset} 字节")
+
+    def _close(self):
+        with self._lock:
+            if not self._fh.closed:
+                self._fh.close()
+
+    async def close(self):
+        """等待进行中的读写完成后关闭日志文件"""
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
+
+
+class SQLiteSessionStore(SessionStore):
+    """基于aiosqlite的会话存储
+
+    会话元数据与对话历史分表存放：读取会话只取最近的若干条消息，
+    新消息按序号增量插入；过期清理是一条基于 last_activity 索引的DELETE。
+    数据库使用WAL模式，多个 worker 进程可以同时读写：每次保存在写事务（BEGIN IMMEDIATE）中先核对版本号，
+    与读取时不一致说明其他进程已写入了该会话，不写入该会话并报告 SessionConflictError（乐观并发控制）。
+    save_many 在同一个写事务中保存一批会话，只提交一次。
+    """
+
+    shared = True
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        user_id TEXT,
+        created_at REAL NOT NULL,
+        last_activity REAL NOT NULL,
+        interaction_count INTEGER NOT NULL DEFAULT 0,
+        conversation_length INTEGER NOT NULL DEFAULT 0,
+        state TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_sessions_last_activity ON sessions(last_activity);
+    CREATE TABLE IF NOT EXISTS conversation_messages (
+        session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+        seq INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        timestamp TEXT,
+        analysis TEXT,
+        PRIMARY KEY (session_id, seq)
+    ) WITHOUT ROWID;
+    """
+
+    # 会话中以JSON整体存放的字段
+    _STATE_FIELDS = ("user_preferences", "intent_history", "emotion_history", "entity_history", "context_summary")
+
+    def __init__(self, db_path: str, history_window: int = 20, legacy_pickle_path: Optional[str] = None,
+                 busy_timeout: float = 5.0):
+        self.db_path = db_path
+        self.history_window = history_window
+        self.legacy_pickle_path = legacy_pickle_path
+        # 其他进程持有写锁时最多等待的秒数
+        self.busy_timeout = busy_timeout
+        self._db: Optional[aiosqlite.Connection] = None
+        self._init_lock: Optional[asyncio.Lock] = None
+        # 同一连接上的写事务需要串行，避免并发对话的语句交错提交；
+        # 读取一律用 execute_fetchall 一次取完，不留下跨越 await 的读游标（否则写事务无法升级写锁，立即报 database is locked）
+        self._write_lock: Optional[asyncio.Lock] = None
+
+    @staticmethod
+    def path_from_url(database_url: str) -> str:
+        """从 sqlite:///./xxx.db 形式的URL中取出文件路径"""
+        for prefix in ("sqlite+aiosqlite:///", "sqlite:///"):
+            if database_url.startswith(prefix):
+                return database_url[len(prefix):]
+        raise ValueError(f"不支持的SQLite数据库URL: {database_url}")
+
+    async def _connection(self) -> aiosqlite.Connection:
+        """首次使用时建立连接并初始化表结构"""
+        if self._db is not None:
+            return self._db
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if self._db is None:
+                self._write_lock = asyncio.Lock()
+                db = await aiosqlite.connect(self.db_path, timeout=self.busy_timeout)
+                await db.execute("PRAGMA journal_mode = WAL")
+                await db.execute("PRAGMA synchronous = NORMAL")
+                await db.execute("PRAGMA foreign_keys = ON")
+                await db.executescript(self._SCHEMA)
+                await self._add_version_column(db)
+                await db.commit()
+                self._db = db
+                await self._migrate_legacy_pickle()
+        return self._db
+
+    @staticmethod
+    async def _add_version_column(db: aiosqlite.Connection):
+        """旧版数据库的 sessions 表没有 version 列"""
+        async with db.execute("PRAGMA table_info(sessions)") as cursor:
+            columns = [row[1] for row in await cursor.fetchall()]
+        if "version" not in columns:
+            await db.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    async def _migrate_legacy_pickle(self):
+        """数据库为空时一次性导入旧版整体pickle文件"""
+        if not self.legacy_pickle_path or not os.path.exists(self.legacy_pickle_path):
+            return
+        async with self._db.execute("SELECT 1 FROM sessions LIMIT 1") as cursor:
+            if await cursor.fetchone():
+                return
+        try:
+            with open(self.legacy_pickle_path, "rb") as f:
+                sessions = pickle.load(f)
+            for session in sessions.values():
+                try:
+                    await self.save(session)
+                except SessionConflictError:
+                    # 其他 worker 同时在迁移，已写入的会话跳过
+                    continue
+            print(f"已从 {self.legacy_pickle_path} 迁移 {len(sessions)} 个会话")
+        except Exception as e:
+            print(f"迁移旧会话数据失败: {e}")
+
+    async def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        db = await self._connection()
+        rows = await db.execute_fetchall(
+            "SELECT user_id, created_at, last_activity, interaction_count, conversation_length, state, version "
+            "FROM sessions WHERE session_id = ?",
+            (session_id,)
+        )
+        if not rows:
+            return None
+        row = rows[0]
+        # 两次查询之间其他进程可能追加了消息，只取与会话元数据一致的部分
+        history = await self._fetch_messages(db, session_id, self.history_window, before=row[4])
+
+        user_id, created_at, last_activity, interaction_count, conversation_length, state, version = row
+        session = {
+            "session_id": session_id,
+            "user_id": user_id,
+            "created_at": datetime.fromtimestamp(created_at),
+            "last_activity": datetime.fromtimestamp(last_activity),
+            "conversation_history": history,
+            "conversation_length": conversation_length,
+            "interaction_count": interaction_count,
+            "version": version,
+        }
+        session.update(json.loads(state))
+        return session
+
+    async def _fetch_messages(self, db: aiosqlite.Connection, session_id: str, limit: Optional[int] = None,
+                              before: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按序号读取消息；limit不为空时只取最近的limit条，before不为空时只取序号小于before的消息"""
+        query = "SELECT role, content, timestamp, analysis FROM conversation_messages WHERE session_id = ?"
+        params: Tuple = (session_id,)
+        if before is not None:
+            query += " AND seq < ?"
+            params += (before,)
+        if limit is None:
+            query += " ORDER BY seq"
+        else:
+            query += " ORDER BY seq DESC LIMIT ?"
+            params += (limit,)
+        rows = list(await db.execute_fetchall(query, params))
+        if limit is not None:
+            rows.reverse()
+
+        messages = []
+        for role, content, timestamp, analysis in rows:
+            message = {"role": role, "content": content, "timestamp": timestamp}
+            if analysis:
+                message.update(json.loads(analysis))
+            messages.append(message)
+        return messages
+
+    async def save(self, session: Dict[str, Any]):
+        conflicts = await self.save_many([session])
+        if conflicts:
+            raise conflicts[0]
+
+    async def save_many(self, sessions: List[Dict[str, Any]]) -> List[SessionConflictError]:
+        """在一个写事务中保存多个会话（一次提交）；版本冲突的会话跳过，其余会话照常写入"""
+        db = await self._connection()
+        prepared = []
+        for session in sessions:
+            history = session.get("conversation_history", [])
+            # 意图等历史可能是定长的环形缓冲区，按列表写入
+            state = json.dumps({field: session.get(field) for field in self._STATE_FIELDS if field in session},
+                               ensure_ascii=False, default=list)
+            # 热历史中被挤出、尚未写入的消息排在最前面
+            spilled = list(getattr(history, "spilled", ()))
+            prepared.append((session, spilled + list(history), session.get("conversation_length", len(history)),
+                             state, len(spilled)))
+        # 写事务不随调用方一起取消：语句在连接线程上执行，被中断的事务可能已经提交，
+        # 此时会话的版本号必须照常更新，否则下次保存会误判为版本冲突并重复写入这些修改
+        return await asyncio.shield(self._save_prepared(db, prepared))
+
+    async def _save_prepared(self, db: aiosqlite.Connection, prepared: List[Tuple]) -> List[SessionConflictError]:
+        conflicts: List[SessionConflictError] = []
+        written = []
+        async with self._write_lock:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                for session, history, conversation_length, state, spilled in prepared:
+                    try:
+                        version = await self._write_session(db, session, history, conversation_length, state)
+                    except SessionConflictError as e:
+                        conflicts.append(e)
+                        continue
+                    written.append((session, version, spilled))
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+        for session, version, spilled in written:
+            session["version"] = version
+            if spilled:
+                del session["conversation_history"].spilled[:spilled]
+        return conflicts
+
+    async def _write_session(self, db: aiosqlite.Connection, session: Dict[str, Any], history: List[Dict[str, Any]],
+                             conversation_length: int, state: str) -> int:
+        """在写事务内核对版本号（不一致时在写入任何数据之前抛出 SessionConflictError），写入会话元数据和新增消息，返回新版本号"""
+        session_id = session["session_id"]
+        expected = session.get("version")
+        async with db.execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)) as cursor:
+            row = await cursor.fetchone()
+        actual = row[0] if row else None
+        if actual != expected:
+            raise SessionConflictError(session_id, expected, actual)
+        version = (expected or 0) + 1
+        await db.execute(
+            "INSERT INTO sessions (session_id, user_id, created_at, last_activity, interaction_count, "
+            "conversation_length, state, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET user_id = excluded.user_id, "
+            "last_activity = excluded.last_activity, interaction_count = excluded.interaction_count, "
+            "conversation_length = excluded.conversation_length, state = excluded.state, "
+            "version = excluded.version",
+            (session_id, session.get("user_id"), session["created_at"].timestamp(),
+             session["last_activity"].timestamp(), session.get("interaction_count", 0),
+             conversation_length, state, version)
+        )
+        await self._insert_messages(db, session_id, history, conversation_length)
+        return version
+
+    async def _insert_messages(self, db: aiosqlite.Connection, session_id: str, history: List[Dict[str, Any]],
+                               conversation_length: int):
+        """只插入尚未持久化的新消息"""
+        async with db.execute(
+            "SELECT COALESCE(MAX(seq) + 1, 0) FROM conversation_messages WHERE session_id = ?",
+            (session_id,)
+        ) as cursor:
+            next_seq = (await cursor.fetchone())[0]
+        first_seq = conversation_length - len(history)
+        new_rows = []
+        for offset, message in enumerate(history):
+            seq = first_seq + offset
+            if seq < next_seq:
+                continue
+            analysis = {key: value for key, value in message.items() if key not in ("role", "content", "timestamp")}
+            new_rows.append((session_id, seq, message["role"], message["content"], message.get("timestamp"),
+                             json.dumps(analysis, ensure_ascii=False) if analysis else None))
+        if new_rows:
+            await db.executemany(
+                "INSERT INTO conversation_messages (session_id, seq, role, content, timestamp, analysis) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                new_rows
+            )
+
+    async def delete(self, session_id: str) -> bool:
+        db = await self._connection()
+        # 与 save_many 相同，写事务不随调用方一起取消
+        return await asyncio.shield(self._delete(db, session_id))
+
+    async def _delete(self, db: aiosqlite.Connection, session_id: str) -> bool:
+        async with self._write_lock:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = await db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+        return cursor.rowcount > 0
+
+    async def delete_expired(self, cutoff: datetime, limit: Optional[int] = None,
+                             exclude: AbstractSet[str] = frozenset()) -> List[str]:
+        db = await self._connection()
+        async with self._write_lock:
+            # 先在写事务中查出过期会话再按ID删除（不使用 DELETE ... RETURNING，它需要 SQLite 3.35 以上）；
+            # 沿 last_activity 索引从最旧的会话删起。使用中的会话在这里跳过而不是拼进 NOT IN，
+            # 这样绑定参数的个数不随进行中的会话数增长
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                expired = []
+                async with db.execute(
+                    "SELECT session_id FROM sessions WHERE last_activity < ? ORDER BY last_activity",
+                    (cutoff.timestamp(),)
+                ) as cursor:
+                    async for (session_id,) in cursor:
+                        if session_id in exclude:
+                            continue
+                        expired.append(session_id)
+                        if limit is not None and len(expired) >= limit:
+                            break
+                await db.executemany("DELETE FROM sessions WHERE session_id = ?", [(session_id,) for session_id in expired])
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+        return expired
+
+    async def load_history(self, session_id: str) -> List[Dict[str, Any]]:
+        db = await self._connection()
+        return await self._fetch_messages(db, session_id)
+
+    async def current_version(self, session_id: str) -> Optional[int]:
+        db = await self._connection()
+        rows = await db.execute_fetchall("SELECT version FROM sessions WHERE session_id = ?", (session_id,))
+        return rows[0][0] if rows else None
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+def create_session_store(settings) -> SessionStore:
+    """根据配置创建会话存储"""
+    if settings.SESSION_BACKEND == "sqlite":
+        try:
+            db_path = SQLiteSessionStore.path_from_url(settings.DATABASE_URL)
+            return SQLiteSessionStore(
+                db_path,
+                history_window=settings.SESSION_HISTORY_WINDOW,
+                legacy_pickle_path=settings.SESSION_LEGACY_PICKLE_PATH
+            )
+        except ValueError as e:
+            print(f"{e}，改用追加写日志存储会话")
+    return AppendOnlySessionStore(
+        settings.SESSION_LOG_PATH,
+        fsync=settings.SESSION_LOG_FSYNC,
+        compact_min_bytes=settings.SESSION_LOG_COMPACT_MIN_BYTES,
+        legacy_pickle_path=settings.SESSION_LEGACY_PICKLE_PATH
+    )
@@ -0,0 +1,43 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """合并同一键上并发进行的异步调用
+
+    第一个调用者发起真正的调用（作为独立任务运行），同一键上随后到达的调用者不再发起新调用，
+    而是等待同一个任务，得到相同的结果或异常（包括超时）。
+    任务结束后键即被移除，之后的调用会重新发起；某个等待者被取消不影响共享任务和其他等待者。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, "asyncio.Task[Any]"] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.leaders += 1
+        else:
+            self.followers += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: "asyncio.Task[Any]"):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 所有等待者都已被取消时，避免“异常未被读取”的告警
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        calls = self.leaders + self.followers
+        return {
+            "in_flight": len(self._calls),
+            "upstream_calls": self.leaders,
+            "coalesced_calls": self.followers,
+            "coalesced_rate": self.followers / calls if calls else 0.0
+        }
@@ -0,0 +1,192 @@
+import math
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.models.schemas import MenuItem
+from app.services.search_index import top_k_indices
+
+
+def embedding_text(item: MenuItem) -> str:
+    """菜品用于生成向量的文本：名称、描述和配料"""
+    return f"{item.name} {item.description} {' '.join(item.ingredients)}"
+
+
+class HashingEmbedder:
+    """本地文本向量化：字符 n-gram 特征哈希
+
+    把文本（小写化）切成 1~2 个字的 n-gram，用 crc32 把每个 n-gram 映射到固定维度上的一个桶和正负号，
+    词频取对数加权后做 L2 归一化。不依赖任何模型文件或网络，结果在不同进程间完全一致。
+    """
+
+    def __init__(self, dim: int = 256, max_gram: int = 2):
+        self.dim = dim
+        self.max_gram = max_gram
+        # n-gram -> (桶, 符号)
+        self._buckets: Dict[str, Tuple[int, float]] = {}
+
+    def _bucket(self, gram: str) -> Tuple[int, float]:
+        bucket = self._buckets.get(gram)
+        if bucket is None:
+            digest = zlib.crc32(gram.encode("utf-8"))
+            bucket = self._buckets[gram] = (digest % self.dim, 1.0 if digest >> 31 else -1.0)
+        return bucket
+
+    def _grams(self, text: str) -> List[str]:
+        text = text.lower()
+        return [
+            text[start:start + n]
+            for n in range(1, self.max_gram + 1)
+            for start in range(len(text) - n + 1)
+            if not text[start:start + n].isspace()
+        ]
+
+    def embed_many(self, texts: Sequence[str]) -> np.ndarray:
+        """把一批文本转换成 (len(texts), dim) 的 float32 矩阵，每行已归一化"""
+        rows: List[int] = []
+        columns: List[int] = []
+        values: List[float] = []
+        for row, text in enumerate(texts):
+            for gram, count in Counter(self._grams(text)).items():
+                bucket, sign = self._bucket(gram)
+                rows.append(row)
+                columns.append(bucket)
+                values.append(sign * (1.0 + math.log(count)))
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64)),
+                  np.array(values, dtype=np.float32))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.maximum(norms, 1e-12)
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.embed_many([text])[0]
+
+
+class VectorIndex:
+    """向量索引接口
+
+    向量均已归一化，相似度为内积（即余弦相似度）。
+    search 返回最相近的 k 个向量的位置（与建索引时的行号一致）和相似度，按相似度从高到低排列；
+    allowed 为布尔掩码时只在其中为 True 的位置里检索。
+    以后接入 Pinecone 等外部向量库时实现同样的接口即可。
+    """
+
+    size: int = 0
+
+    def search(self, query: np.ndarray, k: int,
+               allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+    def _select(self, positions: np.ndarray, similarities: np.ndarray, k: int,
+                allowed: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        if allowed is not None:
+            keep = allowed[positions]
+            positions, similarities = positions[keep], similarities[keep]
+        chosen = top_k_indices(similarities, positions, k)
+        return positions[chosen].astype(np.int64), similarities[chosen].astype(np.float32)
+
+
+class FlatIndex(VectorIndex):
+    """暴力检索：与所有向量逐一求内积
+
+    quantize=True 时按行对称量化成 int8（每行一个缩放系数），内存约为 float32 的四分之一，
+    计算时按块还原成 float32，避免一次性展开整个矩阵。
+    """
+
+    CHUNK_ROWS = 65536
+
+    def __init__(self, vectors: np.ndarray, quantize: bool = False):
+        self.size = len(vectors)
+        self.quantize = quantize
+        if quantize:
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            self._scales = np.maximum(scales, 1e-12).astype(np.float32)
+            self._matrix = np.rint(vectors / self._scales[:, None]).astype(np.int8)
+        else:
+            self._scales = None
+            self._matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def similarities(self, query: np.ndarray, positions: Optional[np.ndarray] = None) -> np.ndarray:
+        """查询向量与所有（或指定位置的）向量的相似度"""
+        query = query.astype(np.float32)
+        if not self.quantize:
+            matrix = self._matrix if positions is None else self._matrix[positions]
+            return matrix @ query
+        matrix = self._matrix if positions is None else self._matrix[positions]
+        scales = self._scales if positions is None else self._scales[positions]
+        result = np.empty(len(matrix), dtype=np.float32)
+        for start in range(0, len(matrix), self.CHUNK_ROWS):
+            chunk = matrix[start:start + self.CHUNK_ROWS].astype(np.float32)
+            result[start:start + self.CHUNK_ROWS] = (chunk @ query) * scales[start:start + self.CHUNK_ROWS]
+        return result
+
+    def search(self, query: np.ndarray, k: int,
+               allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        positions = np.arange(self.size, dtype=np.int64)
+        return self._select(positions, self.similarities(query), k, allowed)
+
+
+class IVFIndex(VectorIndex):
+    """倒排文件索引（IVF）：先用球面 k-means 把向量分成若干簇，检索时只扫描与查询最相近的 n_probe 个簇
+
+    适合大菜单：每次查询只计算约 n_probe / n_lists 的向量，代价是结果为近似的。
+    """
+
+    TRAIN_PER_LIST = 64
+
+    def __init__(self, vectors: np.ndarray, n_lists: int = 0, n_probe: int = 8, iterations: int = 10,
+                 seed: int = 0, quantize: bool = False):
+        self.size = len(vectors)
+        self.n_lists = max(1, min(n_lists or int(math.sqrt(self.size)), self.size))
+        self.n_probe = max(1, min(n_probe, self.n_lists))
+        self._flat = FlatIndex(vectors, quantize=quantize)
+
+        # 聚类中心只用抽样的向量训练（每个簇约 TRAIN_PER_LIST 个），最后再把所有向量分配到簇
+        rng = np.random.default_rng(seed)
+        train_size = min(self.size, self.n_lists * self.TRAIN_PER_LIST)
+        training = vectors[rng.choice(self.size, train_size, replace=False)] if self.size else vectors
+        centroids = training[:self.n_lists] if self.size else np.zeros((1, vectors.shape[1]), dtype=np.float32)
+        for _ in range(iterations):
+            labels = self._assign(training, centroids)
+            sums = np.zeros_like(centroids)
+            for column in range(centroids.shape[1]):
+                sums[:, column] = np.bincount(labels, weights=training[:, column], minlength=len(centroids))
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # 空簇保留原来的中心
+            centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids)
+        self._centroids = centroids.astype(np.float32)
+        assignment = self._assign(vectors, self._centroids)
+
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=self.n_lists)
+        self._members = order
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    @staticmethod
+    def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), chunk):
+            assignment[start:start + chunk] = np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+        return assignment
+
+    def search(self, query: np.ndarray, k: int,
+               allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        closest = np.argsort(-(self._centroids @ query.astype(np.float32)), kind="stable")[:self.n_probe]
+        positions = np.sort(np.concatenate(
+            [self._members[self._offsets[c]:self._offsets[c + 1]] for c in closest]
+        ))
+        return self._select(positions, self._flat.similarities(query, positions), k, allowed)
+
+
+def create_vector_index(vectors: np.ndarray, kind: str = "flat", ivf_lists: int = 0,
+                        ivf_probes: int = 8) -> VectorIndex:
+    """根据配置创建向量索引：flat / int8 / ivf"""
+    if kind == "flat":
+        return FlatIndex(vectors)
+    if kind == "int8":
+        return FlatIndex(vectors, quantize=True)
+    if kind == "ivf":
+        return IVFIndex(vectors, n_lists=ivf_lists, n_probe=ivf_probes)
+    raise ValueError(f"未知的向量索引类型: {kind}")
@@ -4,7 +4,7 @@ from fastapi.staticfiles import StaticFiles
 import os
 from dotenv import load_dotenv
 
-from app.api.routes import api_router
+from app.api.routes import api_router, ai_service
 from app.core.config import settings
 
 # 加载环境变量
@@ -53,6 +53,22 @@ print(f"Mounting static files from directory: {static_dir}")
 app.mount("/", StaticFiles(directory=static_dir, html=True), name="static")
 print("Static files mounted successfully")
 
+@app.on_event("startup")
+async def startup_event():
+    """启动后台过期会话清理和词表文件检查"""
+    ai_service.session_reaper.start()
+    ai_service.lexicon_manager.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """停止后台清理和词表检查，保存全部待保存的会话，关闭会话存储和回复缓存的连接"""
+    await ai_service.session_reaper.stop()
+    await ai_service.lexicon_manager.stop()
+    await ai_service.session_committer.stop()
+    await ai_service.session_store.close()
+    if ai_service.llm_cache is not None:
+        await ai_service.llm_cache.close()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "service": "PalonaAI菜品推荐系统", "version": "1.0.0"}
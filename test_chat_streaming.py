@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+流式对话测试脚本
+使用本地假流式模型，验证事件顺序（analysis -> token -> done）、首个片段早于完整回复到达、
+会话只在流结束时保存一次、缓存命中与出错时的事件，以及 SSE 和 WebSocket 接口
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.api import routes
+from app.services.fake_llm import FakeChatModel
+from testing_helpers import FailingChatModel, make_service, override_settings
+
+
+def _count_saves(service):
+    """统计会话存储的保存次数"""
+    saves = []
+    save_many = service.session_store.save_many
+
+    async def counting_save_many(sessions):
+        saves.extend(session["session_id"] for session in sessions)
+        return await save_many(sessions)
+
+    service.session_store.save_many = counting_save_many
+    return saves
+
+
+def test_stream_events():
+    """测试事件顺序、首个片段的到达时间以及会话只在流结束时保存一次"""
+    print("🌊 测试流式对话事件...")
+
+    async def scenario(tmp_dir):
+        service = make_service(tmp_dir, latency=0.3)
+        saves = _count_saves(service)
+        start = time.perf_counter()
+        events, arrivals = [], []
+        async for event in service.chat_stream(message="推荐一道辣的川菜", session_id="s1"):
+            events.append(event)
+            arrivals.append(time.perf_counter() - start)
+            if event["event"] == "token":
+                # 流结束之前不写入会话
+                assert saves == []
+        kinds = [event["event"] for event in events]
+        assert kinds[0] == "analysis" and kinds[-1] == "done" and kinds.count("token") > 3
+        assert set(kinds[1:-1]) == {"token"}
+        assert events[0]["data"]["entities"]["taste_preferences"] == ["spicy"]
+        # 分析结果立即到达，首个片段远早于完整回复
+        assert arrivals[0] < 0.1 and arrivals[1] < arrivals[-1] / 2
+
+        done = events[-1]["data"]
+        assert done["response"] == "".join(event["data"]["text"] for event in events[1:-1])
+        assert done["conversation_length"] == 2 and "spicy" in done["user_preferences"]["taste_preferences"]
+        assert saves == ["s1"]
+        history = await service.session_store.load_history("s1")
+        assert [msg["content"] for msg in history] == ["推荐一道辣的川菜", done["response"]]
+
+        # 非流式对话得到相同的回复（命中流式调用写入的缓存），缓存命中时一次发送整段回复
+        result = await service.chat(message="推荐一道辣的川菜", session_id="s2")
+        assert result["response"] == done["response"] and service.chat_model.call_count == 1
+        events = [event async for event in service.chat_stream(message="推荐一道辣的川菜", session_id="s3")]
+        assert [event["event"] for event in events] == ["analysis", "token", "done"]
+        await service.session_store.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(scenario(tmp_dir))
+    print("✅ 流式对话事件通过")
+
+
+def test_stream_errors():
+    """测试上游出错、超时和中途断开"""
+    print("\n💥 测试流式对话出错...")
+
+    async def scenario(tmp_dir):
+        service = make_service(tmp_dir, latency=0.2)
+        saves = _count_saves(service)
+        service.chat_model = FailingChatModel(latency=0.01)
+        service.chat_model.astream = lambda messages: _failing_stream()
+        events = [event async for event in service.chat_stream(message="你好", session_id="e1")]
+        assert [event["event"] for event in events] == ["analysis", "token", "error"]
+        assert "上游错误" in events[-1]["data"]["response"] and saves == []
+
+        service.chat_model = FakeChatModel(latency=2)
+        with override_settings(LLM_TIMEOUT_SECONDS=0.1):
+            events = [event async for event in service.chat_stream(message="你好", session_id="e2")]
+        assert events[-1]["event"] == "error" and "超时" in events[-1]["data"]["response"]
+
+        # 中途断开：不保存会话，并发名额被释放
+        stream = service.chat_stream(message="你好", session_id="e3")
+        await stream.__anext__()
+        await stream.__anext__()
+        await stream.aclose()
+        assert saves == [] and service.llm_semaphore._value == service.llm_max_concurrency
+        await service.session_store.close()
+
+    async def _failing_stream():
+        yield FakeChatModel(latency=0)._build_reply([])
+        raise RuntimeError("上游错误")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(scenario(tmp_dir))
+    print("✅ 流式对话出错通过")
+
+
+def test_stream_endpoints():
+    """测试 SSE 和 WebSocket 接口"""
+    print("\n🔌 测试 SSE 和 WebSocket 接口...")
+    app = FastAPI()
+    app.include_router(routes.api_router, prefix="/api")
+    original = routes.ai_service
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        routes.ai_service = make_service(tmp_dir, latency=0.05)
+        try:
+            with TestClient(app) as client:
+                with client.stream("POST", "/api/chat/stream", json={"message": "推荐一道川菜", "session_id": "sse"}) as response:
+                    assert response.status_code == 200
+                    assert response.headers["content-type"].startswith("text/event-stream")
+                    body = "".join(response.iter_text())
+                blocks = [block for block in body.split("\n\n") if block]
+                kinds = [block.split("\n")[0] for block in blocks]
+                assert kinds[0] == "event: analysis" and kinds[-1] == "event: done"
+                done = json.loads(blocks[-1].split("\n", 1)[1][len("data: "):])
+                assert done["session_id"] == "sse" and done["conversation_length"] == 2
+
+                with client.websocket_connect("/api/ws/chat") as websocket:
+                    for turn in (1, 2):
+                        websocket.send_json({"message": "推荐一道川菜", "session_id": "ws"})
+                        events = []
+                        while not events or events[-1]["event"] not in ("done", "error"):
+                            events.append(websocket.receive_json())
+                        assert events[0]["event"] == "analysis" and events[-1]["event"] == "done"
+                        assert events[-1]["data"]["conversation_length"] == 2 * turn
+                    websocket.send_json({"session_id": "ws"})
+                    assert websocket.receive_json()["event"] == "error"
+        finally:
+            asyncio.run(routes.ai_service.session_store.close())
+            routes.ai_service = original
+    print("✅ SSE 和 WebSocket 接口通过")
+
+
+def test_stream_store_errors():
+    """测试会话存储出错时 SSE 和 WebSocket 都以 error 事件结束，WebSocket 连接仍可继续使用"""
+    print("\n🧱 测试会话存储出错时的流式接口...")
+    app = FastAPI()
+    app.include_router(routes.api_router, prefix="/api")
+    original = routes.ai_service
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        routes.ai_service = make_service(tmp_dir, latency=0)
+        store = routes.ai_service.session_store
+        load = store.load
+
+        async def failing_load(session_id):
+            raise sqlite3.OperationalError("database is locked")
+
+        store.load = failing_load
+        try:
+            with TestClient(app) as client:
+                with client.stream("POST", "/api/chat/stream", json={"message": "你好", "session_id": "sse"}) as response:
+                    assert response.status_code == 200
+                    body = "".join(response.iter_text())
+                blocks = [block for block in body.split("\n\n") if block]
+                assert len(blocks) == 1 and blocks[0].startswith("event: error")
+                error = json.loads(blocks[0].split("\n", 1)[1][len("data: "):])
+                assert "database is locked" in error["response"] and error["session_id"] == "sse"
+
+                with client.websocket_connect("/api/ws/chat") as websocket:
+                    websocket.send_json({"message": "你好", "session_id": "ws"})
+                    event = websocket.receive_json()
+                    assert event["event"] == "error" and "database is locked" in event["data"]["response"]
+                    store.load = load
+                    websocket.send_json({"message": "你好", "session_id": "ws"})
+                    events = []
+                    while not events or events[-1]["event"] not in ("done", "error"):
+                        events.append(websocket.receive_json())
+                    assert events[-1]["event"] == "done" and events[-1]["data"]["conversation_length"] == 2
+        finally:
+            store.load = load
+            asyncio.run(store.close())
+            routes.ai_service = original
+    print("✅ 会话存储出错时的流式接口通过")
+
+
+def test_session_info_endpoint():
+    """测试会话信息包含完整对话历史（超出内存窗口的部分从会话存储读取），与会话是否在缓存中无关"""
+    print("\n📋 测试会话信息接口...")
+    app = FastAPI()
+    app.include_router(routes.api_router, prefix="/api")
+    original = routes.ai_service
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        routes.ai_service = make_service(tmp_dir, latency=0, LLM_CACHE_ENABLED=False)
+        try:
+            with TestClient(app) as client:
+                turns = 12
+                for turn in range(turns):
+                    assert client.post("/api/chat", json={"message": f"第{turn}个问题", "session_id": "long"}).status_code == 200
+                assert client.get("/api/session/long").json()["conversation_length"] == 2 * turns
+                cached = client.portal.call(routes.ai_service.get_session_info, "long")
+                assert len(cached["conversation_history"]) == 2 * turns
+                assert cached["conversation_history"][0]["content"] == "第0个问题"
+
+                # 新进程（会话不在缓存中）返回相同的历史
+                client.portal.call(routes.ai_service.session_store.close)
+                routes.ai_service = make_service(tmp_dir, latency=0, LLM_CACHE_ENABLED=False)
+                assert client.get("/api/session/long").json()["conversation_length"] == 2 * turns
+                uncached = client.portal.call(routes.ai_service.get_session_info, "long")
+                assert uncached["conversation_history"] == cached["conversation_history"]
+                assert client.get("/api/session/missing").status_code == 404
+        finally:
+            asyncio.run(routes.ai_service.session_store.close())
+            routes.ai_service = original
+    print("✅ 会话信息接口通过")
+
+
+def benchmark_time_to_first_token(latency=1.0):
+    """首个片段到达时间：非流式与流式"""
+    print(f"\n⏱️ 首个片段到达时间（模型生成耗时 {latency:.1f}s）...")
+
+    async def scenario(tmp_dir):
+        service = make_service(tmp_dir, latency=latency, LLM_CACHE_ENABLED=False)
+        start = time.perf_counter()
+        await service.chat(message="推荐一道菜", session_id="blocking")
+        blocking = time.perf_counter() - start
+        start = time.perf_counter()
+        first_token = None
+        async for event in service.chat_stream(message="推荐一道菜", session_id="streaming"):
+            if event["event"] == "token" and first_token is None:
+                first_token = time.perf_counter() - start
+        await service.session_store.close()
+        return blocking, first_token
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        blocking, first_token = asyncio.run(scenario(tmp_dir))
+    print(f"   非流式 {blocking * 1e3:.0f}ms，流式首个片段 {first_token * 1e3:.0f}ms")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试流式对话")
+    print("=" * 50)
+    test_stream_events()
+    test_stream_errors()
+    test_stream_endpoints()
+    test_stream_store_errors()
+    test_session_info_endpoint()
+    benchmark_time_to_first_token()
+    print("\n" + "=" * 50)
+    print("🎉 流式对话测试完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+对话上下文token预算测试脚本
+测试token估算与截断、按预算装入最近的消息、较早消息增量并入滚动摘要，以及每轮提示词token用量的报告
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from app.services.context_builder import ContextBuilder, clip_tokens, count_tokens
+from app.services.fake_llm import FakeChatModel
+from testing_helpers import make_service
+
+LONG_REPLY = "推荐您试试宫保鸡丁，鸡肉鲜嫩、花生香脆，微辣开胃。" + "这道菜的做法讲究火候，" * 40
+
+
+def _conversation(turns):
+    history = []
+    for turn in range(turns):
+        history.append({"role": "user", "content": f"第{turn}轮：有什么辣的菜推荐吗"})
+        history.append({"role": "assistant", "content": f"第{turn}轮回复。" + LONG_REPLY})
+    return history
+
+
+def test_count_and_clip():
+    """测试token估算与截断"""
+    print("🔢 测试token估算...")
+    assert count_tokens("") == 0
+    assert count_tokens("川菜") == 2
+    assert count_tokens("spicy food") == 2 + 1
+    assert count_tokens("价格¥38.0") == 2 + 1 + 1 + 1 + 1
+    text = "推荐一道辣的川菜" * 10
+    assert clip_tokens(text, 100) is text
+    clipped = clip_tokens(text, 10)
+    assert clipped.endswith("…") and count_tokens(clipped) <= 10
+    print("✅ token估算通过")
+
+
+def test_budget_and_rolling_summary():
+    """测试预算内装入最近的消息，滑出窗口的消息增量并入摘要"""
+    print("\n📦 测试预算与滚动摘要...")
+    builder = ContextBuilder(max_tokens=600, message_max_tokens=150, summary_max_tokens=80)
+    summarized = []
+    summarize = builder._summarize_message
+    builder._summarize_message = lambda msg: summarized.append(msg["content"]) or summarize(msg)
+
+    session = {"conversation_history": [], "conversation_length": 0}
+    previous_covered = 0
+    for turn in range(12):
+        message = f"第{turn}轮：有什么辣的菜推荐吗"
+        system, history, tokens = builder.build(session, "系统提示词", message)
+        assert tokens <= builder.max_tokens
+        assert tokens == count_tokens(system) + sum(count_tokens(m["content"]) for m in history) + count_tokens(message)
+        # 最近的消息完整保留（过长的被截断），窗口总是从用户消息开始
+        assert not history or history[0]["role"] == "user"
+        assert all(count_tokens(m["content"]) <= builder.message_max_tokens for m in history)
+        if session["conversation_history"]:
+            assert history[-1]["content"].startswith(session["conversation_history"][-1]["content"][:10])
+
+        summary = session.get("context_summary", {"covered": 0, "lines": []})
+        assert summary["covered"] >= previous_covered
+        # 每条消息只被摘要一次
+        assert len(summarized) == summary["covered"]
+        assert sum(count_tokens(line) for line in summary["lines"]) <= builder.summary_max_tokens
+        assert summary["covered"] + len(history) == len(session["conversation_history"])
+        previous_covered = summary["covered"]
+
+        session["conversation_history"].append({"role": "user", "content": message})
+        session["conversation_history"].append({"role": "assistant", "content": f"第{turn}轮回复。" + LONG_REPLY})
+        session["conversation_length"] = len(session["conversation_history"])
+
+    summary = session["context_summary"]
+    assert summary["omitted"] > 0 and "更早的对话摘要（另有" in system
+    assert summary["lines"][-1].startswith("助手：第") and "火候" not in summary["lines"][-1]
+
+    # 内存中只有最近的窗口时，按消息总数对齐已摘要的位置
+    windowed = {"conversation_history": _conversation(12)[-6:], "conversation_length": 24,
+                "context_summary": {"covered": 20, "lines": ["用户：很早的问题"], "omitted": 0}}
+    _, history, _ = ContextBuilder(max_tokens=5000).build(windowed, "系统", "你好")
+    assert len(history) == 4 and history[0]["content"].startswith("第10轮")
+    print("✅ 预算与滚动摘要通过")
+
+
+def test_chat_reports_prompt_tokens():
+    """测试对话按预算组装提示词、报告每轮token用量，摘要随会话持久化"""
+    print("\n💬 测试对话提示词用量...")
+
+    async def scenario(tmp_dir):
+        service = make_service(tmp_dir, latency=0, CONTEXT_MAX_TOKENS=1200, LLM_CACHE_ENABLED=False,
+                               CONTEXT_REPORT_BASELINE=True)
+        service.chat_model = FakeChatModel(latency=0, reply=LONG_REPLY)
+        usages = []
+        for turn in range(10):
+            result = await service.chat(message=f"第{turn}轮：有什么辣的菜推荐吗", session_id="budget")
+            usages.append(result["prompt_tokens"])
+        assert all(usage["prompt"] <= 1200 for usage in usages)
+        assert usages[-1]["saved"] > usages[-1]["baseline"] / 2
+        assert all(usage["saved"] == usage["baseline"] - usage["prompt"] for usage in usages)
+        # 默认只报告实际用量，不额外计算对比
+        service.context_report_baseline = False
+        result = await service.chat(message="再推荐一道", session_id="budget")
+        assert set(result["prompt_tokens"]) == {"prompt"}
+
+        covered = service.user_sessions["budget"]["context_summary"]["covered"]
+        # 系统提示词不再包含原始的得分字典
+        messages, _, _ = service._build_chat_messages("budget", service.user_sessions["budget"], "你好")
+        assert "{'" not in messages[0].content and "更早的对话摘要" in messages[0].content
+
+        # 重新加载会话后摘要仍在，不需要重新处理已摘要的消息
+        service.user_sessions.clear()
+        loaded = await service.session_store.load("budget")
+        assert loaded["context_summary"]["covered"] == covered
+        await service.session_store.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(scenario(tmp_dir))
+    print("✅ 对话提示词用量通过")
+
+
+def benchmark_prompt_tokens(turns=20):
+    """长回复的多轮对话中每轮提示词token数：不裁剪与按预算组装"""
+    print(f"\n⏱️ {turns} 轮对话的提示词token数...")
+
+    async def scenario(tmp_dir):
+        service = make_service(tmp_dir, latency=0, LLM_CACHE_ENABLED=False, CONTEXT_REPORT_BASELINE=True)
+        service.chat_model = FakeChatModel(latency=0, reply=LONG_REPLY)
+        usages = []
+        for turn in range(turns):
+            result = await service.chat(message=f"第{turn}轮：还有别的推荐吗", session_id="bench")
+            usages.append(result["prompt_tokens"])
+        await service.session_store.close()
+        return usages
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        usages = asyncio.run(scenario(tmp_dir))
+    for turn, usage in enumerate(usages):
+        if turn % 5 == 4 or turn == 0:
+            print(f"   第{turn + 1}轮：{usage['baseline']} -> {usage['prompt']} tokens（节省 {usage['saved']}）")
+    baseline = sum(usage["baseline"] for usage in usages)
+    prompt = sum(usage["prompt"] for usage in usages)
+    print(f"   合计：{baseline} -> {prompt} tokens（减少 {1 - prompt / baseline:.0%}）")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试对话上下文token预算")
+    print("=" * 50)
+    test_count_and_clip()
+    test_budget_and_rolling_summary()
+    test_chat_reports_prompt_tokens()
+    benchmark_prompt_tokens()
+    print("\n" + "=" * 50)
+    print("🎉 对话上下文token预算测试完成！")
+
+
+if __name__ == "__main__":
+    main()
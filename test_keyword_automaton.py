@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+关键词自动机测试脚本
+验证一次扫描的意图/情感/实体/偏好识别结果与逐关键词匹配完全一致，对比长消息上的耗时，并测试词表热加载
+"""
+
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from app.services.ai_service import AIService
+from app.core.config import settings
+from app.services.keyword_automaton import KeywordAutomaton
+from app.services.lexicon import Lexicon, LexiconManager
+
+LEXICON = Lexicon.from_file(settings.LEXICON_PATH)
+
+
+def _groups(name):
+    return LEXICON.tables[name].groups
+
+
+def _legacy_scores(message, tables):
+    """原实现：逐表、逐关键词做子串判断"""
+    message_lower = message.lower()
+    scores = {}
+    for label, keywords in tables.items():
+        score = sum(1 for keyword in keywords if keyword in message_lower)
+        if score > 0:
+            scores[label] = score / len(keywords)
+    return scores
+
+
+def _legacy_entities(message):
+    entities = {
+        "cuisine_types": [],
+        "taste_preferences": [],
+        "dietary_restrictions": [],
+        "budget_range": None,
+        "meal_type": None,
+        "cooking_method": None
+    }
+    for key in ("cuisine_types", "taste_preferences", "dietary_restrictions"):
+        patterns = _groups(key)
+        for label, words in patterns.items():
+            if any(word in message for word in words):
+                entities[key].append(label)
+    for budget, words in _groups("budget_range").items():
+        if any(word in message for word in words):
+            entities["budget_range"] = budget
+            break
+    return entities
+
+
+def _legacy_first(message, tables):
+    message_lower = message.lower()
+    for label, words in tables.items():
+        if any(word in message_lower for word in words):
+            return label
+    return None
+
+
+def _legacy_analyze(message):
+    return {
+        "intent_scores": _legacy_scores(message, _groups("intent")),
+        "emotion_scores": _legacy_scores(message, _groups("emotion")),
+        "entities": _legacy_entities(message),
+        "preference_signals": {
+            "meal_time": _legacy_first(message, _groups("meal_time")),
+            "occasion": _legacy_first(message, _groups("occasion"))
+        }
+    }
+
+
+def _vocabulary():
+    words = []
+    for table in LEXICON.tables.values():
+        for keywords in table.groups.values():
+            words.extend(keywords)
+    return words + ["Pizza", "PASTA", "我们", "今天", "一起", "的", "，", "。", "hello", "菜"]
+
+
+def _random_message(rng, vocabulary, length):
+    return "".join(rng.choice(vocabulary) for _ in range(length))
+
+
+def test_automaton_finds_overlapping_keywords():
+    """测试重叠关键词全部被找到"""
+    print("🔤 测试重叠关键词...")
+    automaton = KeywordAutomaton(["辣", "麻辣", "香辣", "不能吃", "不能吃海鲜", "海鲜过敏", "海鲜"])
+    assert automaton.find("我不能吃海鲜过敏，也怕麻辣") == {"辣", "麻辣", "不能吃", "不能吃海鲜", "海鲜过敏", "海鲜"}
+    assert automaton.find("清淡一点") == set()
+    # 全部关键词都由正则扫描时结果相同
+    automaton = KeywordAutomaton(["辣", "麻辣", "香辣", "不能吃", "不能吃海鲜", "海鲜过敏", "海鲜"], frequent_chars=())
+    assert automaton.find("我不能吃海鲜过敏，也怕麻辣") == {"辣", "麻辣", "不能吃", "不能吃海鲜", "海鲜过敏", "海鲜"}
+    print("✅ 重叠关键词通过")
+
+
+def test_analysis_matches_legacy():
+    """测试与原实现结果完全一致"""
+    print("\n🧪 测试结果一致性...")
+    service = AIService()
+    vocabulary = _vocabulary()
+    rng = random.Random(42)
+    messages = ["我想吃辣的菜", "这个推荐太棒了！", "我对海鲜过敏", "我想吃Pizza", "晚上和朋友聚会，4个人", ""]
+    messages += [_random_message(rng, vocabulary, rng.randint(1, 40)) for _ in range(2000)]
+    for message in messages:
+        assert service._analyze_message(message) == _legacy_analyze(message), message
+    print(f"✅ {len(messages)} 条消息结果一致")
+
+
+def test_lexicon_hot_reload():
+    """测试词表热加载与原子替换：读取当前词表不触发加载，新词表在后台任务（线程池）中编译后换上"""
+    print("\n🔄 测试词表热加载...")
+    with open(settings.LEXICON_PATH, encoding="utf-8") as f:
+        data = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "lexicon.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        manager = LexiconManager(path, check_interval=0.05)
+        before = manager.current
+        assert not manager.check()
+        assert "recommendation" not in before.analyzer.analyze("来点招牌")["intent"]
+
+        data["version"] = 2
+        data["tables"]["intent"]["groups"]["recommendation"].append("招牌")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+        # 只读取当前词表时不重新加载
+        assert manager.current is before
+
+        async def watch():
+            manager.start()
+            try:
+                for _ in range(100):
+                    if manager.current is not before:
+                        break
+                    await asyncio.sleep(0.02)
+            finally:
+                await manager.stop()
+
+        asyncio.run(watch())
+        after = manager.current
+        assert after is not before and after.version == 2
+        assert "recommendation" in after.analyzer.analyze("来点招牌")["intent"]
+        # 旧词表对象保持不变，进行中的请求不受影响
+        assert "recommendation" not in before.analyzer.analyze("来点招牌")["intent"]
+
+        # 写坏的文件不会替换掉当前词表
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("{broken")
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 2 * 10 ** 9))
+        assert not manager.check() and manager.current is after
+        assert asyncio.run(manager.reload()) is after
+    print("✅ 词表热加载通过")
+
+
+def benchmark_long_messages():
+    """对比长消息上的耗时"""
+    print("\n⏱️ 长消息耗时对比...")
+    service = AIService()
+    rng = random.Random(7)
+    filler = "今天天气不错我们一起去吃饭吧这家餐厅环境很好服务也很周到"
+    vocabulary = _vocabulary()
+    for length in (200, 2000, 20000):
+        message = "".join(
+            rng.choice(vocabulary) if rng.random() < 0.01 else rng.choice(filler) for _ in range(length)
+        )
+        rounds = max(1, 20000 // length)
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            _legacy_analyze(message)
+        legacy = (time.perf_counter() - start) / rounds
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            service._analyze_message(message)
+        compiled = (time.perf_counter() - start) / rounds
+
+        print(f"   {length:>6} 字：逐关键词 {legacy * 1e6:9.1f}µs，自动机 {compiled * 1e6:9.1f}µs，"
+              f"加速 {legacy / compiled:.1f}x")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试关键词自动机")
+    print("=" * 50)
+    test_automaton_finds_overlapping_keywords()
+    test_analysis_matches_legacy()
+    test_lexicon_hot_reload()
+    benchmark_long_messages()
+    print("\n" + "=" * 50)
+    print("🎉 关键词自动机测试完成！")
+
+
+if __name__ == "__main__":
+    main()
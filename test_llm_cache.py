@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+大模型回复缓存测试脚本
+使用本地假模型，验证相同提示词复用回复、LRU/TTL 淘汰、磁盘持久化、按请求关闭缓存以及菜单变化后失效，
+以及语义缓存对相近消息复用回复、相同的进行中调用只发往模型一次
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from langchain.schema import HumanMessage, SystemMessage
+from app.services.llm_cache import LLMResponseCache, SemanticResponseCache, message_key
+from app.services.single_flight import SingleFlight
+from testing_helpers import FailingChatModel, make_service, override_settings
+
+
+def test_cache_eviction_and_disk():
+    """测试缓存键、LRU/TTL 淘汰和磁盘持久化"""
+    print("🗃 测试回复缓存...")
+    params = {"model": "fake", "temperature": 0.7}
+    messages = [SystemMessage(content="系统"), HumanMessage(content="推荐一下")]
+    key = message_key(params, messages, "menu-a")
+    assert key == message_key(params, list(messages), "menu-a")
+    assert key != message_key(params, messages, "menu-b")
+    assert key != message_key({"model": "fake", "temperature": 0.0}, messages, "menu-a")
+    assert key != message_key(params, [SystemMessage(content="推荐一下"), HumanMessage(content="系统")], "menu-a")
+
+    async def scenario(tmp_dir):
+        db_path = os.path.join(tmp_dir, "llm_cache.db")
+        cache = LLMResponseCache(max_entries=2, ttl=0.2, db_path=db_path)
+        await cache.bind_menu("menu-a")
+        for name in ("a", "b", "c"):
+            await cache.put(name, f"回复{name}")
+        # 内存只保留最近的两条，被淘汰的条目仍能从磁盘读回
+        assert cache.stats()["entries"] == 2 and cache.evictions == 1
+        assert await cache.get("a") == "回复a" and cache.disk_hits == 1
+        assert await cache.get("missing") is None
+
+        # 另一个进程（新的缓存实例）可以命中磁盘上的条目
+        other = LLMResponseCache(db_path=db_path, ttl=0.2)
+        await other.bind_menu("menu-a")
+        assert await other.get("b") == "回复b"
+
+        # 菜单变化后旧条目不再命中（内存和磁盘）
+        await other.bind_menu("menu-b")
+        assert await other.get("c") is None and other.invalidations == 1
+        # 仍在旧菜单上的进程（滚动重载）照常命中磁盘上的条目
+        assert await cache.get("b") == "回复b" and cache.disk_hits == 2
+        await other.close()
+
+        # 过期
+        await asyncio.sleep(0.25)
+        assert await cache.get("a") is None and cache.expirations == 1
+        await cache.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(scenario(tmp_dir))
+    print("✅ 回复缓存通过")
+
+
+def test_chat_uses_cache():
+    """测试相同的首轮对话只调用一次大模型，可按请求关闭缓存，菜单变化后失效"""
+    print("\n💬 测试对话回复缓存...")
+
+    async def scenario(tmp_dir):
+        service = make_service(tmp_dir)
+        model = service.chat_model
+        first = await service.chat(message="推荐一下", session_id="a")
+        second = await service.chat(message="推荐一下", session_id="b")
+        assert model.call_count == 1 and second["response"] == first["response"]
+        # 命中缓存的回复同样写入会话历史
+        assert second["conversation_length"] == 2
+
+        await service.chat(message="推荐一下", session_id="c", use_cache=False)
+        assert model.call_count == 2
+
+        # 历史不同（第二轮）则提示词不同，不会命中
+        await service.chat(message="推荐一下", session_id="a")
+        assert model.call_count == 3
+
+        await service.get_recommendations({"taste": "spicy"})
+        await service.get_recommendations({"taste": "spicy"})
+        assert model.call_count == 4
+
+        # 菜单价格变化后缓存失效
+        items = service.menu_service.get_all_menu_items()
+        service.menu_service.replace_menu_items([item.model_copy(update={"price": item.price + 1}) for item in items])
+        await service.chat(message="推荐一下", session_id="d")
+        assert model.call_count == 5
+        stats = service.llm_cache.stats()
+        assert stats["hits"] == 2 and stats["invalidations"] == 1
+        await service.session_store.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(scenario(tmp_dir))
+
+    with tempfile.TemporaryDirectory() as tmp_dir, override_settings(LLM_CACHE_ENABLED=False):
+        service = make_service(tmp_dir, LLM_CACHE_ENABLED=False)
+        assert service.llm_cache is None
+    print("✅ 对话回复缓存通过")
+
+
+def test_semantic_cache():
+    """测试语义缓存：相近消息复用回复，上下文不同不复用，容量满时淘汰最久未用的记录"""
+    print("\n🧠 测试语义缓存...")
+    cache = SemanticResponseCache(capacity=2, threshold=0.8, ttl=0.2)
+    cache.bind_menu("menu-a")
+    cache.add("推荐一道川菜", "scope-1", "回复1", latency=1.5)
+    assert cache.lookup("推荐一道川菜吧", "scope-1") == "回复1"
+    assert cache.lookup("推荐一道川菜吧", "scope-2") is None
+    assert cache.lookup("今天天气怎么样", "scope-1") is None
+    assert cache.saved_seconds == 1.5
+
+    cache.add("有什么甜点", "scope-1", "回复2")
+    cache.lookup("推荐一道川菜", "scope-1")
+    cache.add("有什么汤", "scope-2", "回复3")
+    # “有什么甜点”最久未被使用，被淘汰
+    assert cache.evictions == 1 and cache.lookup("有什么甜点", "scope-1") is None
+    assert cache.lookup("推荐一道川菜", "scope-1") == "回复1"
+
+    cache.bind_menu("menu-b")
+    assert cache.stats()["entries"] == 0 and cache.invalidations == 1
+    cache.add("推荐一道川菜", "scope-1", "回复1")
+    time.sleep(0.25)
+    assert cache.lookup("推荐一道川菜", "scope-1") is None and cache.stats()["entries"] == 0
+
+    async def scenario(tmp_dir):
+        service = make_service(tmp_dir, LLM_CACHE_ENABLED=False, SEMANTIC_CACHE_ENABLED=True)
+        model = service.chat_model
+        first = await service.chat(message="推荐一道川菜", session_id="a")
+        second = await service.chat(message="请推荐一道川菜", session_id="b")
+        assert model.call_count == 1 and second["response"] == first["response"]
+        # 复用的回复同样经过偏好更新
+        assert second["user_preferences"].get("cuisine_preferences") == ["chinese"]
+        # 识别出的实体不同（多了口味“辣”）或消息不够相近时不复用
+        await service.chat(message="推荐一道辣的川菜", session_id="c")
+        await service.chat(message="推荐一道粤菜", session_id="d")
+        assert model.call_count == 3
+        stats = service.semantic_cache.stats()
+        assert stats["hits"] == 1 and stats["saved_seconds"] > 0
+        await service.session_store.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(scenario(tmp_dir))
+    print("✅ 语义缓存通过")
+
+
+def test_single_flight():
+    """测试相同的进行中调用只发往模型一次，异常和超时传给所有等待者，取消某个等待者不影响其他等待者"""
+    print("\n🛫 测试合并进行中的相同调用...")
+
+    async def flight_scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return len(calls)
+
+        waiters = [asyncio.ensure_future(flight.do("k", call)) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        waiters[0].cancel()
+        results = await asyncio.gather(*waiters, return_exceptions=True)
+        assert isinstance(results[0], asyncio.CancelledError) and results[1:] == [1] * 4
+        # 调用结束后键被移除，之后的调用重新发起
+        assert await flight.do("k", call) == 2
+        assert flight.stats() == {"in_flight": 0, "upstream_calls": 2, "coalesced_calls": 4, "coalesced_rate": 4 / 6}
+
+    asyncio.run(flight_scenario())
+
+    async def scenario(tmp_dir):
+        service = make_service(tmp_dir, LLM_CACHE_ENABLED=False)
+        model = service.chat_model
+        results = await asyncio.gather(*[service.chat(message="推荐一下", session_id=f"s{i}") for i in range(50)])
+        assert model.call_count == 1 and len({result["response"] for result in results}) == 1
+        # 每个会话各自记录历史
+        assert all(result["conversation_length"] == 2 for result in results)
+        await asyncio.gather(*[service.get_recommendations({"taste": "spicy"}) for _ in range(10)])
+        assert model.call_count == 2
+
+        # 要求不使用缓存的请求不合并
+        await asyncio.gather(*[service.chat(message="推荐一下", session_id=f"fresh{i}", use_cache=False) for i in range(3)])
+        assert model.call_count == 5
+
+        # 上游异常传给所有等待者，且不会被缓存
+        service.chat_model = FailingChatModel(latency=0.05)
+        messages = [SystemMessage(content="系统"), HumanMessage(content="推荐一下")]
+        errors = await asyncio.gather(*[service._invoke_llm(messages) for _ in range(10)], return_exceptions=True)
+        assert all(isinstance(error, RuntimeError) for error in errors) and service.chat_model.call_count == 1
+        await asyncio.gather(service._invoke_llm(messages), return_exceptions=True)
+        assert service.chat_model.call_count == 2
+        await service.session_store.close()
+
+        # 超时同样传给所有等待者
+        with override_settings(LLM_TIMEOUT_SECONDS=0.05):
+            service = make_service(tmp_dir, latency=1)
+            errors = await asyncio.gather(*[service._invoke_llm(messages) for _ in range(10)], return_exceptions=True)
+        assert all(isinstance(error, TimeoutError) for error in errors)
+        assert service.llm_single_flight.stats()["upstream_calls"] == 1
+        await service.llm_cache.close()
+        await service.session_store.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(scenario(tmp_dir))
+    print("✅ 合并进行中的相同调用通过")
+
+
+def benchmark_cached_openers(rounds=200, latency=0.05):
+    """相同首轮对话的平均耗时：不缓存与缓存"""
+    print(f"\n⏱️ {rounds} 个相同首轮对话的平均耗时（模型延迟 {latency * 1e3:.0f}ms）...")
+
+    async def scenario(tmp_dir, use_cache):
+        service = make_service(tmp_dir, latency=latency)
+        start = time.perf_counter()
+        for i in range(rounds):
+            await service.chat(message="有什么川菜", session_id=f"bench-{use_cache}-{i}", use_cache=use_cache)
+        elapsed = (time.perf_counter() - start) / rounds
+        calls = service.chat_model.call_count
+        await service.session_store.close()
+        return elapsed, calls
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        uncached, uncached_calls = asyncio.run(scenario(tmp_dir, False))
+        cached, cached_calls = asyncio.run(scenario(tmp_dir, True))
+    print(f"   不缓存 {uncached * 1e3:.1f}ms（调用模型{uncached_calls}次），"
+          f"缓存 {cached * 1e3:.2f}ms（调用模型{cached_calls}次）")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试大模型回复缓存")
+    print("=" * 50)
+    test_cache_eviction_and_disk()
+    test_chat_uses_cache()
+    test_semantic_cache()
+    test_single_flight()
+    benchmark_cached_openers()
+    print("\n" + "=" * 50)
+    print("🎉 大模型回复缓存测试完成！")
+
+
+if __name__ == "__main__":
+    main()
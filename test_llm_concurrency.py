@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+大模型并发调用测试脚本
+使用会睡眠的本地假模型，验证对话不会阻塞事件循环、并发上限和超时生效
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from testing_helpers import make_service, override_settings
+
+
+async def _max_loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """测量事件循环的最大调度延迟"""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+def test_concurrent_chats_do_not_block_loop():
+    """测试数百个并发对话同时在途"""
+    print("⚡ 测试并发对话...")
+
+    async def scenario(tmp_dir):
+        service = make_service(tmp_dir, latency=0.5)
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(_max_loop_lag(stop))
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            service.chat(message="推荐一道川菜", session_id=f"session-{i}") for i in range(300)
+        ])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        lag = await lag_task
+        await service.session_store.close()
+        return results, elapsed, lag
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        results, elapsed, lag = asyncio.run(scenario(tmp_dir))
+
+    print(f"   300个对话耗时 {elapsed:.2f}s（串行约需150s），事件循环最大延迟 {lag * 1000:.1f}ms")
+    assert all(result["response"].startswith("（本地模拟回复）") for result in results)
+    assert elapsed < 10
+    print("✅ 并发对话通过")
+
+
+def test_concurrency_limit():
+    """测试并发上限"""
+    print("\n🚦 测试并发上限...")
+
+    async def scenario(tmp_dir):
+        service = make_service(tmp_dir, latency=0.2, LLM_MAX_CONCURRENCY=5)
+        start = time.perf_counter()
+        # 关闭缓存：相同的进行中请求不会被合并，20个调用都真正发往模型
+        await asyncio.gather(*[service.get_recommendations({"taste": "spicy"}, use_cache=False) for _ in range(20)])
+        elapsed = time.perf_counter() - start
+        await service.session_store.close()
+        return elapsed
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        elapsed = asyncio.run(scenario(tmp_dir))
+
+    # 20个调用、并发5、每个0.2s => 至少4批
+    print(f"   20个推荐请求耗时 {elapsed:.2f}s")
+    assert elapsed >= 0.8
+    print("✅ 并发上限通过")
+
+
+def test_llm_timeout():
+    """测试单次调用超时"""
+    print("\n⏱️ 测试调用超时...")
+
+    async def scenario(tmp_dir):
+        service = make_service(tmp_dir, latency=5)
+        result = await service.chat(message="推荐一道菜", session_id="slow")
+        await service.session_store.close()
+        return result
+
+    with tempfile.TemporaryDirectory() as tmp_dir, override_settings(LLM_TIMEOUT_SECONDS=0.1):
+        result = asyncio.run(scenario(tmp_dir))
+
+    assert "超时" in result["response"]
+    print("✅ 调用超时通过")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试大模型并发调用")
+    print("=" * 50)
+    test_concurrent_chats_do_not_block_loop()
+    test_concurrency_limit()
+    test_llm_timeout()
+    print("\n" + "=" * 50)
+    print("🎉 大模型并发调用测试完成！")
+
+
+if __name__ == "__main__":
+    main()
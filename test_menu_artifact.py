@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+预构建菜单制品测试脚本
+测试制品的构建与 mmap 加载：搜索、过滤、推荐、各类查询与内存中的菜单完全一致，菜品按需解析，启动耗时与菜单大小无关
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from app.models.schemas import SearchRequest
+from app.services.ai_service import AIService
+from app.services.menu_artifact import CURRENT_FILE, MenuArtifact, build_menu_artifact
+from app.services.menu_registry import MenuRegistry
+from app.services.menu_scorer import MenuScorer
+from app.services.menu_service import MenuService
+from testing_helpers import synthetic_menu
+
+
+def test_artifact_roundtrip():
+    """测试从制品加载的菜单与内存中的菜单查询结果一致"""
+    print("📦 测试菜单制品构建与加载...")
+    items = MenuService(artifact_path="").get_all_menu_items() + synthetic_menu(2000, seed=5)
+    memory = MenuService(artifact_path="")
+    memory.replace_menu_items(items)
+    with tempfile.TemporaryDirectory() as root:
+        directory = build_menu_artifact(items, root, memory.embedder)
+        # 相同内容再次构建得到同一版本
+        assert build_menu_artifact(items, root, memory.embedder) == directory
+        with open(os.path.join(root, CURRENT_FILE), encoding="utf-8") as f:
+            assert f.read() == os.path.basename(directory)
+
+        mapped = MenuService(artifact_path=root)
+        assert mapped.artifact is not None and mapped.get_item_count() == len(items)
+        assert isinstance(mapped.get_menu_columns().price, np.memmap)
+
+        for query in ("", "鸡", "豆腐", "麻辣", "清蒸鲈鱼", "pizza"):
+            for filters in (None, {"max_price": 40}, {"category": "川菜", "exclude_allergens": ["花生"]}):
+                request = SearchRequest(query=query, filters=filters, limit=20)
+                assert mapped.search_menu_items(request) == memory.search_menu_items(request)
+            request = SearchRequest(query=query, semantic=True, limit=10)
+            assert mapped.search_menu_items(request) == memory.search_menu_items(request)
+
+        assert mapped.get_categories() == memory.get_categories()
+        assert mapped.get_category_counts() == memory.get_category_counts()
+        for category in memory.get_categories():
+            assert mapped.get_items_by_category(category, limit=3) == memory.get_items_by_category(category)[:3]
+        assert mapped.get_seasonal_items() == memory.get_seasonal_items()
+        assert mapped.get_popular_items(10) == memory.get_popular_items(10)
+        assert mapped.get_menu_item_by_id(items[7].id) == items[7]
+        assert (mapped.get_menu_columns().free_of(["鱼类", "花生"]) ==
+                memory.get_menu_columns().free_of(["鱼类", "花生"])).all()
+
+        mapped_scorer = MenuScorer(mapped.get_menu_columns(), ["辣", "川菜"])
+        memory_scorer = MenuScorer(memory.get_menu_columns(), ["辣", "川菜"])
+        for args in ((["辣"], ["川菜"], "便宜", []), ([], ["粤菜"], None, ["清淡"])):
+            assert mapped_scorer.recommend(*args, excluded_allergens=["鱼类"], limit=10) == \
+                memory_scorer.recommend(*args, excluded_allergens=["鱼类"], limit=10)
+
+        # 变更菜单后不再使用制品
+        mapped.remove_menu_item(items[0].id)
+        assert mapped.artifact is None and mapped.get_menu_item_by_id(items[0].id) is None
+    print("✅ 菜单制品构建与加载通过")
+
+
+def test_lazy_items():
+    """测试从制品加载后只解析用到的菜品，菜单概要不需要解析整份菜单"""
+    print("\n💤 测试菜品按需解析...")
+    items = synthetic_menu(3000, seed=8)
+    with tempfile.TemporaryDirectory() as root:
+        build_menu_artifact(items, root)
+        service = AIService(menu_registry=MenuRegistry(MenuService(artifact_path=root)))
+        parsed = service.menu_service.menu_items._items
+        summary = service._render_menu_summary()
+        assert f"共有{len(items)}道菜品" in summary
+        recommended = service._get_menu_recommendations({"taste_preferences": ["辣"]}, {}, limit=5)
+        assert len(recommended) == 5
+        assert sum(item is not None for item in parsed) <= 3 * len(service.menu_service.get_categories()) + 5
+
+        # GET /menu 的响应直接由制品中的记录拼接：不解析菜品，与内存菜单的响应逐字节相同
+        parsed_count = sum(item is not None for item in parsed)
+        response = service.menu_service.get_menu_response()
+        assert sum(item is not None for item in parsed) == parsed_count
+        assert service.menu_service.menu_items._items is parsed
+        memory = MenuService(artifact_path="")
+        memory.replace_menu_items(items)
+        assert response.body == memory.get_menu_response().body
+        assert response.etag == memory.get_menu_response().etag
+        # 预构建（菜单换上之前）同样不会把整份菜单解析成列表
+        service.menu_service.build_indexes()
+        assert not isinstance(service.menu_service.menu_items, list)
+
+        # 损坏的制品：回退到示例菜单
+        with open(os.path.join(root, CURRENT_FILE), "w", encoding="utf-8") as f:
+            f.write("missing")
+        fallback = MenuService(artifact_path=root)
+        assert fallback.artifact is None and fallback.get_item_count() > 0
+    print("✅ 菜品按需解析通过")
+
+
+def benchmark_startup(size=100000):
+    """大菜单下从制品启动与在内存中构建的耗时对比"""
+    print(f"\n⏱️ {size} 道菜品的启动耗时...")
+    items = synthetic_menu(size)
+    with tempfile.TemporaryDirectory() as root:
+        start = time.perf_counter()
+        build_menu_artifact(items, root)
+        print(f"   构建制品：{time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        memory = MenuService(artifact_path="")
+        memory.replace_menu_items(items)
+        memory.search_menu_items(SearchRequest(query="鸡", limit=10))
+        memory.get_vector_index()
+        print(f"   内存构建（列式+检索索引+向量）：{time.perf_counter() - start:.2f}s")
+
+        start = time.perf_counter()
+        mapped = MenuService(artifact_path=root)
+        mapped.search_menu_items(SearchRequest(query="鸡", limit=10))
+        mapped.get_vector_index()
+        print(f"   制品 mmap 加载并完成首次检索：{time.perf_counter() - start:.2f}s")
+        assert MenuArtifact.load(root).version == mapped.artifact.version
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试预构建菜单制品")
+    print("=" * 50)
+    test_artifact_roundtrip()
+    test_lazy_items()
+    benchmark_startup()
+    print("\n" + "=" * 50)
+    print("🎉 预构建菜单制品测试完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+菜单只读接口缓存测试脚本
+测试 /menu、/categories、/seasonal、/popular 的预序列化响应：内容与原接口一致、强ETag与304、
+预先压缩的gzip版本、Cache-Control，以及菜单变更或重新加载后响应随之更新
+"""
+
+import gzip
+import json
+import os
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from fastapi import Depends, FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.testclient import TestClient
+from app.api import routes
+from app.models.schemas import MenuItem
+from app.services.menu_registry import MenuRegistry, get_menu_service
+from app.services.menu_responses import accepts_gzip, etag_matches
+from app.services.menu_service import MenuService
+
+ENDPOINTS = ("/api/menu", "/api/categories", "/api/seasonal", "/api/popular", "/api/popular?limit=3")
+
+
+def _make_app(registry):
+    app = FastAPI()
+    app.include_router(routes.api_router, prefix="/api")
+    app.dependency_overrides[get_menu_service] = lambda: registry.current
+    return app
+
+
+def _legacy_payloads(menu_service):
+    """原接口的返回值（经 response_model 校验后序列化）"""
+    return {
+        "/api/menu": jsonable_encoder([MenuItem.model_validate(item.model_dump()) for item in menu_service.get_all_menu_items()]),
+        "/api/categories": jsonable_encoder({"categories": menu_service.get_categories()}),
+        "/api/seasonal": jsonable_encoder({"items": menu_service.get_seasonal_items()}),
+        "/api/popular": jsonable_encoder({"items": menu_service.get_popular_items(5)}),
+        "/api/popular?limit=3": jsonable_encoder({"items": menu_service.get_popular_items(3)})
+    }
+
+
+def test_header_parsing():
+    """测试 If-None-Match 与 Accept-Encoding 的解析"""
+    print("🏷️ 测试请求头解析...")
+    assert etag_matches('"abc"', '"abc"') and etag_matches('W/"abc"', '"abc"')
+    assert etag_matches('"x", "abc"', '"abc"') and etag_matches("*", '"abc"')
+    assert not etag_matches(None, '"abc"') and not etag_matches('"abcd"', '"abc"')
+    assert accepts_gzip("gzip, deflate, br") and accepts_gzip("br;q=1.0, gzip;q=0.8") and accepts_gzip("*")
+    assert not accepts_gzip(None) and not accepts_gzip("br") and not accepts_gzip("gzip;q=0")
+    assert not accepts_gzip("*, gzip;q=0")
+    print("✅ 请求头解析通过")
+
+
+def test_cached_responses():
+    """测试预序列化响应：内容与原接口一致，ETag/304、gzip、Cache-Control"""
+    print("\n📦 测试菜单接口的预序列化响应...")
+    registry = MenuRegistry(MenuService(artifact_path=""))
+    with TestClient(_make_app(registry)) as client:
+        legacy = _legacy_payloads(registry.current)
+        for path in ENDPOINTS:
+            response = client.get(path, headers={"Accept-Encoding": "identity"})
+            assert response.status_code == 200 and response.json() == legacy[path], path
+            assert response.headers["content-type"] == "application/json"
+            assert response.headers["cache-control"] == "public, max-age=0, must-revalidate"
+            assert response.headers["vary"] == "Accept-Encoding" and "content-encoding" not in response.headers
+            etag = response.headers["etag"]
+            assert etag.startswith('"') and not etag.startswith('W/')
+
+            # 客户端缓存仍有效：304，无响应体
+            revalidated = client.get(path, headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+            assert revalidated.status_code == 304 and revalidated.content == b""
+            assert revalidated.headers["etag"] == etag
+            # 每次返回的是同一份字节
+            assert registry.current.get_menu_response() is registry.current.get_menu_response()
+
+        # 完整菜单较大，接受gzip时返回预先压缩的版本（另一个强ETag）
+        plain = registry.current.get_menu_response()
+        response = client.get("/api/menu", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip" and response.headers["etag"] == plain.gzip_etag
+        assert response.content == plain.body and int(response.headers["content-length"]) == len(plain.gzip_body)
+        assert gzip.decompress(plain.gzip_body) == plain.body and len(plain.gzip_body) < len(plain.body) / 2
+        assert client.get("/api/menu", headers={"Accept-Encoding": "gzip", "If-None-Match": plain.gzip_etag}).status_code == 304
+        # 类别列表很小，不压缩
+        response = client.get("/api/categories", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+
+        # 超出菜品数的 limit 共用同一个响应
+        count = registry.current.get_item_count()
+        assert registry.current.get_popular_response(count + 100) is registry.current.get_popular_response(count)
+        assert len(client.get("/api/popular?limit=1000").json()["items"]) == count
+        assert client.get("/api/popular?limit=-1000").json()["items"] == []
+    print("✅ 菜单接口的预序列化响应通过")
+
+
+def test_etag_follows_menu_version():
+    """测试菜单变更或重新加载后ETag随之变化，相同内容的菜单ETag相同（多个 worker 之间一致）"""
+    print("\n🔄 测试ETag随菜单版本变化...")
+    registry = MenuRegistry(MenuService(artifact_path=""))
+    with TestClient(_make_app(registry)) as client:
+        etags = {path: client.get(path).headers["etag"] for path in ENDPOINTS}
+        # 另一个 worker 加载的同一份菜单：ETag 相同
+        other = MenuService(artifact_path="")
+        assert other.get_menu_response().etag == registry.current.get_menu_response().etag
+
+        # 就地修改菜单：受影响的接口返回新内容和新ETag
+        menu_service = registry.current
+        item = menu_service.get_menu_item_by_id(menu_service.get_all_menu_items()[0].id)
+        menu_service.update_menu_item(item.model_copy(update={"rating": 5.0, "is_seasonal": True}))
+        for path in ("/api/menu", "/api/seasonal", "/api/popular"):
+            response = client.get(path, headers={"If-None-Match": etags[path]})
+            assert response.status_code == 200 and response.headers["etag"] != etags[path], path
+        assert client.get("/api/popular").json()["items"][0]["id"] == item.id
+        # 内容未变的接口ETag不变
+        assert client.get("/api/categories", headers={"If-None-Match": etags["/api/categories"]}).status_code == 304
+
+        # 重新加载为新菜单：预先构建好响应再换上
+        replacement = MenuService(artifact_path="")
+        replacement.replace_menu_items(replacement.get_all_menu_items()[:5])
+        replacement.build_indexes()
+        assert "menu" in replacement._responses and "popular:5" in replacement._responses
+        registry.swap(replacement)
+        response = client.get("/api/menu", headers={"If-None-Match": etags["/api/menu"]})
+        assert response.status_code == 200 and len(response.json()) == 5
+    print("✅ ETag随菜单版本变化通过")
+
+
+def benchmark_menu_endpoints(items=500, requests=300):
+    """原接口（每次校验并序列化）与预序列化响应、304 的每请求耗时"""
+    print(f"\n⏱️ {items} 道菜品的 /api/menu，每种方式 {requests} 次请求...")
+    menu_service = MenuService(artifact_path="")
+    base = menu_service.get_all_menu_items()
+    menu_service.replace_menu_items([
+        base[index % len(base)].model_copy(update={"id": f"item{index}"}) for index in range(items)
+    ])
+    registry = MenuRegistry(menu_service)
+    app = _make_app(registry)
+
+    @app.get("/legacy/menu", response_model=List[MenuItem])
+    async def legacy_menu(service: MenuService = Depends(get_menu_service)):
+        return service.get_all_menu_items()
+
+    with TestClient(app) as client:
+        etag = client.get("/api/menu").headers["etag"]
+        cases = (
+            ("原接口（response_model）", "/legacy/menu", {"Accept-Encoding": "identity"}),
+            ("预序列化响应", "/api/menu", {"Accept-Encoding": "identity"}),
+            ("预压缩gzip响应", "/api/menu", {"Accept-Encoding": "gzip"}),
+            ("If-None-Match 命中（304）", "/api/menu", {"If-None-Match": etag})
+        )
+        for label, path, headers in cases:
+            response = client.get(path, headers=headers)
+            size = int(response.headers.get("content-length", 0))
+            start = time.perf_counter()
+            for _ in range(requests):
+                client.get(path, headers=headers)
+            elapsed = (time.perf_counter() - start) / requests
+            print(f"   {label}：{elapsed * 1e3:.2f}ms/请求，响应体 {size / 1024:.1f}KB")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试菜单只读接口缓存")
+    print("=" * 50)
+    test_header_parsing()
+    test_cached_responses()
+    test_etag_follows_menu_version()
+    benchmark_menu_endpoints()
+    print("\n" + "=" * 50)
+    print("🎉 菜单只读接口缓存测试完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+菜单服务测试脚本
+测试菜单概要缓存、菜单版本、索引查询、全文检索、过滤与推荐
+"""
+
+import asyncio
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from app.services.ai_service import AIService
+from app.services.menu_columns import MenuColumns
+from app.services.menu_filter import MenuFilter
+from app.api import routes
+from app.core.config import settings
+from app.services.menu_registry import MenuRegistry, get_menu_registry, get_menu_service
+from app.services.menu_service import MenuService
+from app.models.schemas import MenuItem, SearchRequest
+from testing_helpers import synthetic_menu
+
+
+def _legacy_context(service, session):
+    """原实现：每次重新拼接完整上下文"""
+    context = service.system_prompt
+    menu_items = service.menu_service.get_all_menu_items()
+    context += f"\n\n菜单信息：我们共有{len(menu_items)}道菜品，包括：\n"
+    categories = {}
+    for item in menu_items:
+        if item.category not in categories:
+            categories[item.category] = []
+        categories[item.category].append(item)
+    for category, items in categories.items():
+        context += f"- {category}：{', '.join([f'{item.name}(¥{item.price})' for item in items[:3]])}"
+        if len(items) > 3:
+            context += f"等{len(items)}道菜"
+        context += "\n"
+    preferences = session.get("user_preferences", {})
+    if preferences:
+        context += f"\n\n用户偏好信息：{json.dumps(preferences, ensure_ascii=False)}"
+    if session.get("intent_history"):
+        context += f"\n\n最近的用户意图：{session['intent_history'][-5:]}"
+    if session.get("emotion_history"):
+        context += f"\n\n最近的情感状态：{session['emotion_history'][-5:]}"
+    return context
+
+
+def _make_session(service, session_id):
+    service.user_sessions[session_id] = {
+        "session_id": session_id,
+        "created_at": datetime.now(),
+        "last_activity": datetime.now(),
+        "conversation_history": [],
+        "user_preferences": {"taste_preferences": ["spicy"], "budget_preference": "low"},
+        "interaction_count": 0,
+        "intent_history": [{"recommendation": 0.2}] * 7,
+        "emotion_history": [{"positive": 1 / 6}],
+        "entity_history": []
+    }
+    return service.user_sessions[session_id]
+
+
+def test_menu_context_cache():
+    """测试菜单概要缓存结果不变，并在菜单更新后失效"""
+    print("📋 测试菜单概要缓存...")
+    service = AIService(menu_registry=MenuRegistry())
+    session = _make_session(service, "menu-context")
+
+    context = service._build_conversation_context("menu-context")
+    assert context == _legacy_context(service, session)
+    assert service._get_menu_context() is service._get_menu_context()
+
+    items = service.menu_service.get_all_menu_items()
+    updated = [item.model_copy(update={"price": item.price + 1}) for item in items[:5]]
+    service.menu_service.replace_menu_items(updated)
+    context = service._build_conversation_context("menu-context")
+    assert context == _legacy_context(service, session)
+    assert "共有5道菜品" in context
+    print("✅ 菜单概要缓存通过")
+
+
+def _assert_indexes_consistent(menu_service):
+    """索引查询结果与逐项扫描完全一致"""
+    items = menu_service.get_all_menu_items()
+    for item in items:
+        expected = next(candidate for candidate in items if candidate.id == item.id)
+        assert menu_service.get_menu_item_by_id(item.id) is expected
+    assert menu_service.get_menu_item_by_id("missing") is None
+    assert set(menu_service.get_categories()) == set(item.category for item in items)
+    for category in menu_service.get_categories():
+        assert menu_service.get_items_by_category(category) == [item for item in items if item.category == category]
+    assert menu_service.get_seasonal_items() == [item for item in items if item.is_seasonal]
+    for limit in (1, 5, len(items) + 1):
+        assert menu_service.get_popular_items(limit) == sorted(items, key=lambda x: x.rating, reverse=True)[:limit]
+    allergens = set(allergen for item in items for allergen in item.allergens)
+    columns = menu_service.get_menu_columns()
+    for allergen in allergens:
+        free = columns.free_of([allergen])
+        assert [item for i, item in enumerate(items) if free[i]] == \
+            [item for item in items if allergen not in item.allergens]
+
+
+def test_menu_indexes():
+    """测试索引在菜单增删改后保持一致，且每次变更都递增版本号"""
+    print("\n🗂 测试菜单索引...")
+    menu_service = MenuService()
+    _assert_indexes_consistent(menu_service)
+
+    items = menu_service.get_all_menu_items()
+    version = menu_service.version
+    menu_service.add_menu_item(items[0].model_copy(update={"id": "new-1", "rating": items[0].rating, "allergens": ["鸡蛋"]}))
+    assert menu_service.version == version + 1
+    _assert_indexes_consistent(menu_service)
+
+    assert menu_service.update_menu_item(items[1].model_copy(update={"category": "新品", "is_seasonal": True}))
+    assert menu_service.get_items_by_category("新品")[0].id == items[1].id
+    _assert_indexes_consistent(menu_service)
+
+    assert menu_service.remove_menu_item(items[2].id)
+    assert not menu_service.remove_menu_item(items[2].id)
+    assert menu_service.get_menu_item_by_id(items[2].id) is None
+    assert menu_service.version == version + 3
+    _assert_indexes_consistent(menu_service)
+    print("✅ 菜单索引通过")
+
+
+def _legacy_apply_filters(items, filters):
+    """原实现：每个条件各扫描一遍"""
+    filtered_items = items
+    if "max_price" in filters:
+        filtered_items = [item for item in filtered_items if item.price <= filters["max_price"]]
+    if "min_price" in filters:
+        filtered_items = [item for item in filtered_items if item.price >= filters["min_price"]]
+    if "category" in filters:
+        filtered_items = [item for item in filtered_items if item.category == filters["category"]]
+    if "exclude_allergens" in filters:
+        exclude_allergens = filters["exclude_allergens"]
+        filtered_items = [item for item in filtered_items
+                          if not any(allergen in exclude_allergens for allergen in item.allergens)]
+    if "seasonal_only" in filters and filters["seasonal_only"]:
+        filtered_items = [item for item in filtered_items if item.is_seasonal]
+    if "min_rating" in filters:
+        filtered_items = [item for item in filtered_items if item.rating >= filters["min_rating"]]
+    return filtered_items
+
+
+def _legacy_recommendations(menu_service, preferences, entities, limit=5):
+    """原实现：逐个菜品打分后整体排序"""
+    recommended_items = []
+    all_tastes = preferences.get("taste_preferences", []) + entities.get("taste_preferences", [])
+    all_cuisines = preferences.get("cuisine_preferences", []) + entities.get("cuisine_types", [])
+    all_budget = preferences.get("budget_preference") or entities.get("budget_range")
+    dietary_restrictions = preferences.get("dietary_restrictions", [])
+    health_concerns = preferences.get("health_concerns", [])
+    for item in menu_service.get_all_menu_items():
+        score = 0
+        for taste in all_tastes:
+            if taste in item.description.lower() or taste in item.name.lower():
+                score += 2
+        for cuisine in all_cuisines:
+            if cuisine in item.category or cuisine in item.description.lower():
+                score += 3
+        if all_budget:
+            if "便宜" in all_budget and item.price <= 30:
+                score += 2
+            elif "中等" in all_budget and 30 < item.price <= 60:
+                score += 2
+            elif "高档" in all_budget and item.price > 60:
+                score += 2
+        if health_concerns:
+            if "清淡" in health_concerns and "清蒸" in item.description:
+                score += 2
+            elif "营养" in health_concerns and "蔬菜" in item.description:
+                score += 2
+        if dietary_restrictions:
+            if any(allergen in item.allergens for allergen in dietary_restrictions):
+                continue
+        score += item.rating * 0.5
+        if score > 0:
+            recommended_items.append((item, score))
+    recommended_items.sort(key=lambda x: x[1], reverse=True)
+    return [item for item, score in recommended_items[:limit]]
+
+
+def _legacy_search_matches(menu_service, query, filters=None):
+    """原实现的命中规则：任一字段包含查询串"""
+    query = query.lower()
+    results = [
+        item for item in menu_service.get_all_menu_items()
+        if query in item.name.lower() or query in item.description.lower() or
+        query in item.category.lower() or any(query in ingredient.lower() for ingredient in item.ingredients)
+    ]
+    if filters:
+        results = _legacy_apply_filters(results, filters)
+    return results
+
+
+def test_search_index():
+    """测试全文检索的命中集合与原实现一致，total_count 为真实命中数，结果按相关度排序"""
+    print("\n🔍 测试全文检索...")
+    menu_service = MenuService()
+    menu_service.add_menu_item(synthetic_menu(1)[0].model_copy(update={"id": "x", "name": "ABC Pizza"}))
+    queries = ["", "辣", "川菜", "鸡肉", "宫保鸡丁", "经典川菜，选用", "pizza", "PIZZA", "abc p", "不存在的菜", "豆腐", "a"]
+    filters_list = [None, {"max_price": 40}, {"category": "川菜", "exclude_allergens": ["花生"]}]
+    for query in queries:
+        for filters in filters_list:
+            expected = _legacy_search_matches(menu_service, query, filters)
+            response = menu_service.search_menu_items(SearchRequest(query=query, filters=filters, limit=1000))
+            assert sorted(item.id for item in response.results) == sorted(item.id for item in expected), query
+            assert response.total_count == len(expected)
+            limited = menu_service.search_menu_items(SearchRequest(query=query, filters=filters, limit=3))
+            assert limited.results == response.results[:3] and limited.total_count == len(expected)
+
+    # 名称里含两次“豆腐”的菜品应排在只在配料里出现一次的菜品前面
+    response = menu_service.search_menu_items(SearchRequest(query="豆腐", limit=3))
+    assert response.results[0].name == "麻婆豆腐"
+
+    # 菜单变更后索引随之更新
+    menu_service.remove_menu_item("x")
+    assert menu_service.search_menu_items(SearchRequest(query="pizza")).total_count == 0
+    print("✅ 全文检索通过")
+
+
+def test_compiled_filters():
+    """测试编译后的过滤器（逐个判断和列式掩码两种方式）与逐条件过滤结果一致"""
+    print("\n🧹 测试过滤器...")
+    menu_service = MenuService()
+    items = synthetic_menu(500, seed=3) + menu_service.get_all_menu_items()
+    categories = sorted(set(item.category for item in items))
+    allergens = sorted(set(allergen for item in items for allergen in item.allergens))
+    columns = MenuColumns(items)
+    rng = random.Random(5)
+    for _ in range(500):
+        filters = {}
+        if rng.random() < 0.5:
+            filters["max_price"] = rng.uniform(10, 200)
+        if rng.random() < 0.5:
+            filters["min_price"] = rng.uniform(10, 100)
+        if rng.random() < 0.3:
+            filters["category"] = rng.choice(categories)
+        if rng.random() < 0.5:
+            chosen = rng.sample(allergens, rng.randint(0, 2))
+            filters["exclude_allergens"] = "、".join(chosen) if rng.random() < 0.3 else chosen
+        if rng.random() < 0.3:
+            filters["seasonal_only"] = rng.random() < 0.5
+        if rng.random() < 0.5:
+            filters["min_rating"] = rng.uniform(3.5, 5.0)
+        if rng.random() < 0.1:
+            filters["unknown"] = 1
+        expected = _legacy_apply_filters(items, filters)
+        assert menu_service._apply_filters(items, filters) == expected, filters
+        mask = MenuFilter(filters).mask(columns)
+        if mask is not None:
+            assert [item for item, keep in zip(items, mask) if keep] == expected, filters
+    print("✅ 过滤器通过")
+
+
+def test_recommendations_match_legacy():
+    """测试推荐结果与原实现一致"""
+    print("\n🍽 测试推荐排序...")
+    service = AIService(menu_registry=MenuRegistry())
+    cases = [
+        ({}, {}),
+        ({"taste_preferences": ["辣", "麻"]}, {"cuisine_types": ["川菜"]}),
+        ({"dietary_restrictions": ["花生", "海鲜"], "budget_preference": "便宜"}, {}),
+        ({"dietary_restrictions": "花生", "health_concerns": ["清淡"]}, {"budget_range": "中等"}),
+        ({"cuisine_preferences": ["粤菜"], "health_concerns": ["营养"]}, {"taste_preferences": ["甜"], "budget_range": "高档"}),
+    ]
+    for menu in (None, synthetic_menu(3000, seed=9)):
+        if menu is not None:
+            service.menu_service.replace_menu_items(menu)
+        for preferences, entities in cases:
+            for limit in (1, 5, 50):
+                assert service._get_menu_recommendations(preferences, entities, limit) == \
+                    _legacy_recommendations(service.menu_service, preferences, entities, limit), (preferences, entities)
+    print("✅ 推荐排序通过")
+
+
+def _write_menu_csv(path, items):
+    fields = list(MenuItem.model_fields)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for item in items:
+            row = item.model_dump()
+            row["ingredients"] = "|".join(item.ingredients)
+            row["allergens"] = "|".join(item.allergens)
+            row["nutrition_info"] = json.dumps(item.nutrition_info, ensure_ascii=False) if item.nutrition_info else ""
+            writer.writerow({key: "" if value is None else value for key, value in row.items()})
+
+
+def test_menu_registry_reload():
+    """测试从JSON/CSV文件热替换菜单：共享注册表的AI服务立即使用新菜单，加载失败时保留旧菜单"""
+    print("\n🔄 测试菜单热替换...")
+    assert get_menu_service() is get_menu_registry().current
+    assert AIService().menu_service is get_menu_service()
+
+    registry = MenuRegistry()
+    service = AIService(menu_registry=registry)
+    old_menu = registry.current
+    old_context = service._get_menu_context()
+    items = old_menu.get_all_menu_items()
+    updated = [item.model_copy(update={"price": item.price + 10}) for item in items[:6]]
+    updated[0] = updated[0].model_copy(update={"spice_level": 3, "nutrition_info": {"热量": 320}})
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_path = os.path.join(tmp_dir, "menu.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"items": [item.model_dump() for item in updated]}, f, ensure_ascii=False)
+        csv_path = os.path.join(tmp_dir, "menu.csv")
+        _write_menu_csv(csv_path, updated[::-1])
+
+        # 线程池中的预热只做计算，不修改事件循环同时在使用的缓存
+        caches = (dict(service._menu_context_cache), dict(service._menu_scorer_cache))
+        _, installers = registry.build(json_path)
+        assert (service._menu_context_cache, service._menu_scorer_cache) == caches and len(installers) == 1
+        assert registry.current is old_menu
+
+        menu = asyncio.run(registry.reload(json_path))
+        assert registry.current is menu and service.menu_service is menu
+        assert menu.version > old_menu.version
+        assert menu.get_all_menu_items() == updated
+        # 菜单概要和推荐打分引擎在换上之前已预热
+        assert menu.version in service._menu_context_cache and menu.version in service._menu_scorer_cache
+        context = service._get_menu_context()
+        assert context != old_context and f"¥{updated[1].price}" in context
+        assert service._get_menu_recommendations({}, {}, limit=3) == _legacy_recommendations(menu, {}, {}, 3)
+        # 旧菜单对象不受影响，进行中的请求可以继续使用
+        assert old_menu.get_all_menu_items() == items
+
+        menu = asyncio.run(registry.reload(csv_path))
+        assert menu.get_all_menu_items() == updated[::-1]
+        _assert_indexes_consistent(menu)
+
+        for bad_path in (os.path.join(tmp_dir, "missing.json"), tmp_dir):
+            try:
+                asyncio.run(registry.reload(bad_path))
+                assert False, "加载失败时应抛出异常"
+            except (OSError, ValueError):
+                pass
+            assert registry.current is menu
+    print("✅ 菜单热替换通过")
+
+
+def test_menu_reload_endpoint():
+    """测试重新加载菜单接口：必须配置并提供管理令牌，只接受菜单目录内的路径，错误信息不包含文件内容"""
+    print("\n🔐 测试重新加载菜单接口...")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    app = FastAPI()
+    app.include_router(routes.api_router, prefix="/api")
+    registry = MenuRegistry()
+    original = (settings.ADMIN_TOKEN, settings.MENU_DIR, settings.DEBUG, routes.get_menu_registry)
+    routes.get_menu_registry = lambda: registry
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir, TestClient(app) as client:
+            menu_dir = os.path.join(tmp_dir, "menus")
+            os.makedirs(menu_dir)
+            items = registry.current.get_all_menu_items()[:4]
+            with open(os.path.join(menu_dir, "menu.json"), "w", encoding="utf-8") as f:
+                json.dump([item.model_dump() for item in items], f, ensure_ascii=False)
+            with open(os.path.join(menu_dir, "bad.json"), "w", encoding="utf-8") as f:
+                json.dump([{"id": "secret-value-123"}], f)
+            with open(os.path.join(tmp_dir, "outside.json"), "w", encoding="utf-8") as f:
+                json.dump([item.model_dump() for item in items], f, ensure_ascii=False)
+
+            # DEBUG 模式下未配置令牌同样不可用
+            settings.DEBUG, settings.ADMIN_TOKEN, settings.MENU_DIR = True, "", menu_dir
+            assert client.post("/api/admin/menu/reload", json={"path": "menu.json"}).status_code == 403
+            settings.ADMIN_TOKEN = "token"
+            assert client.post("/api/admin/menu/reload", json={"path": "menu.json"}).status_code == 403
+            headers = {"X-Admin-Token": "token"}
+
+            for path in ("../outside.json", os.path.join(tmp_dir, "outside.json"), ".", "/etc/passwd"):
+                response = client.post("/api/admin/menu/reload", json={"path": path}, headers=headers)
+                assert response.status_code == 400 and response.json()["detail"] == "菜单路径不在菜单目录内", path
+            response = client.post("/api/admin/menu/reload", json={"path": "bad.json"}, headers=headers)
+            assert response.status_code == 400 and response.json()["detail"] == "加载菜单失败"
+            assert "secret-value-123" not in response.text
+
+            response = client.post("/api/admin/menu/reload", json={"path": "menu.json"}, headers=headers)
+            assert response.status_code == 200 and response.json()["item_count"] == 4
+            assert registry.current.get_all_menu_items() == items
+            settings.MENU_DIR = ""
+            response = client.post("/api/admin/menu/reload", json={"path": "menu.json"}, headers=headers)
+            assert response.status_code == 400 and response.json()["detail"] == "未配置菜单目录"
+    finally:
+        settings.ADMIN_TOKEN, settings.MENU_DIR, settings.DEBUG, routes.get_menu_registry = original
+    print("✅ 重新加载菜单接口通过")
+
+
+def benchmark_search(size=100000):
+    """大菜单上的检索耗时"""
+    print(f"\n⏱️ {size} 道菜品的检索耗时...")
+    menu_service = MenuService()
+    items = synthetic_menu(size)
+    start = time.perf_counter()
+    menu_service.replace_menu_items(items)
+    menu_service._get_search_index()
+    print(f"   建索引 {time.perf_counter() - start:.1f}s")
+    for query in ("宫保鸡丁", "鸡肉嫩滑", "豆腐", "辣"):
+        request = SearchRequest(query=query)
+        rounds = 20
+        start = time.perf_counter()
+        for _ in range(rounds):
+            response = menu_service.search_menu_items(request)
+        indexed = (time.perf_counter() - start) / rounds
+        start = time.perf_counter()
+        _legacy_search_matches(menu_service, query)
+        legacy = time.perf_counter() - start
+        print(f"   “{query}” 命中 {response.total_count}：逐项扫描 {legacy * 1e3:.1f}ms，倒排索引 {indexed * 1e3:.2f}ms")
+
+
+def benchmark_recommendations(sizes=(10000, 100000, 1000000)):
+    """不同菜单规模下推荐打分的耗时"""
+    print("\n⏱️ 推荐打分耗时对比...")
+    service = AIService(menu_registry=MenuRegistry())
+    preferences = {"taste_preferences": ["辣", "spicy"], "dietary_restrictions": ["花生"], "budget_preference": "便宜"}
+    entities = {"cuisine_types": ["川菜"]}
+    for size in sizes:
+        service.menu_service.replace_menu_items(synthetic_menu(size))
+        start = time.perf_counter()
+        service._get_menu_scorer()
+        build = time.perf_counter() - start
+        service._get_menu_recommendations(preferences, entities)
+
+        rounds = 5
+        start = time.perf_counter()
+        for _ in range(rounds):
+            result = service._get_menu_recommendations(preferences, entities)
+        vectorized = (time.perf_counter() - start) / rounds
+        start = time.perf_counter()
+        expected = _legacy_recommendations(service.menu_service, preferences, entities)
+        legacy = time.perf_counter() - start
+        assert result == expected
+        print(f"   {size:>8} 道菜：逐项打分 {legacy * 1e3:8.1f}ms，特征矩阵 {vectorized * 1e3:7.2f}ms"
+              f"（建特征 {build * 1e3:.0f}ms），加速 {legacy / vectorized:.0f}x")
+
+
+def benchmark_context_build():
+    """对比上下文构建耗时"""
+    print("\n⏱️ 上下文构建耗时对比...")
+    service = AIService()
+    session = _make_session(service, "bench")
+    rounds = 2000
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        _legacy_context(service, session)
+    legacy = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        service._build_conversation_context("bench")
+    cached = (time.perf_counter() - start) / rounds
+    print(f"   每次重新拼接 {legacy * 1e6:.1f}µs，缓存菜单概要 {cached * 1e6:.1f}µs")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试菜单服务")
+    print("=" * 50)
+    test_menu_context_cache()
+    test_menu_indexes()
+    test_search_index()
+    test_compiled_filters()
+    test_recommendations_match_legacy()
+    test_menu_registry_reload()
+    test_menu_reload_endpoint()
+    benchmark_context_build()
+    benchmark_search()
+    benchmark_recommendations()
+    print("\n" + "=" * 50)
+    print("🎉 菜单服务测试完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+多 worker 共享会话测试脚本
+多个进程（模拟 gunicorn worker）共用同一个SQLite会话库，同时对相同的会话发起对话，
+验证版本冲突被检测并重放（会话修改批量保存时同样成立）、不丢失任何一轮对话，以及 worker 数从1增加到8时的吞吐量
+"""
+
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from app.services.session_store import SQLiteSessionStore
+from testing_helpers import make_service
+
+
+def _worker(tmp_dir, worker, session_ids, turns, latency, clients, barrier, results):
+    """一个 worker 进程：各自创建服务实例，由 clients 个并发客户端轮流对会话发起对话"""
+
+    async def scenario():
+        # 会话修改批量保存，版本冲突在保存时重放
+        service = make_service(tmp_dir, latency=latency, LLM_CACHE_ENABLED=False, SESSION_FLUSH_INTERVAL_SECONDS=0.05)
+
+        async def client(index):
+            for turn in range(turns):
+                for session_id in session_ids[index::clients]:
+                    await service.chat(message=f"w{worker}-t{turn}：推荐一道川菜", session_id=session_id)
+
+        barrier.wait()
+        start = time.time()
+        await asyncio.gather(*(client(index) for index in range(clients)))
+        await service.session_committer.stop()
+        end = time.time()
+        await service.session_store.close()
+        return start, end, service.session_committer.conflicts
+
+    results.put((worker,) + asyncio.run(scenario()))
+
+
+def _run_workers(tmp_dir, workers, session_ids_for, turns, latency=0.0, clients=1):
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [
+        context.Process(target=_worker, args=(tmp_dir, worker, session_ids_for(worker), turns, latency,
+                                              clients, barrier, results))
+        for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    outcomes = [results.get(timeout=120) for _ in processes]
+    for process in processes:
+        process.join(timeout=30)
+        assert process.exitcode == 0
+    return outcomes
+
+
+def test_concurrent_workers_same_sessions(workers=4, turns=5):
+    """测试多个 worker 同时写相同的会话：每一轮对话都被保存，历史连续完整"""
+    print("🔀 测试多个 worker 同时写相同的会话...")
+    session_ids = [f"shared-{index}" for index in range(3)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        outcomes = _run_workers(tmp_dir, workers, lambda worker: session_ids, turns, latency=0.01)
+        conflicts = sum(outcome[3] for outcome in outcomes)
+
+        async def verify():
+            store = SQLiteSessionStore(os.path.join(tmp_dir, "sessions.db"))
+            try:
+                for session_id in session_ids:
+                    session = await store.load(session_id)
+                    history = await store.load_history(session_id)
+                    assert session["conversation_length"] == len(history) == 2 * workers * turns
+                    assert session["interaction_count"] == workers * turns - 1
+                    # 批量保存时连续几轮可能合并为一个版本
+                    assert 0 < session["version"] <= workers * turns
+                    # 用户消息与回复交替出现，每个 worker 的每一轮恰好出现一次
+                    assert [msg["role"] for msg in history] == ["user", "assistant"] * (workers * turns)
+                    asked = sorted(msg["content"].split("：")[0] for msg in history[::2])
+                    assert asked == sorted(f"w{w}-t{turn}" for w in range(workers) for turn in range(turns))
+            finally:
+                await store.close()
+
+        asyncio.run(verify())
+    print(f"   {workers} 个 worker 共发生 {conflicts} 次版本冲突，均已重放")
+    print("✅ 多 worker 共享会话通过")
+
+
+def test_stale_cache_refresh():
+    """测试进程内缓存的会话被其他进程修改后，下一轮对话先重新加载"""
+    print("\n🔄 测试过期会话缓存的刷新...")
+
+    async def scenario(tmp_dir):
+        first = make_service(tmp_dir, latency=0, LLM_CACHE_ENABLED=False)
+        second = make_service(tmp_dir, latency=0, LLM_CACHE_ENABLED=False)
+        await first.chat(message="推荐一道川菜", session_id="s1")
+        await second.chat(message="有辣的吗", session_id="s1")
+        # first 缓存的会话已过期：先重新加载，不产生冲突
+        result = await first.chat(message="再来一道", session_id="s1")
+        assert result["conversation_length"] == 6
+        history = await first.session_store.load_history("s1")
+        assert [msg["content"] for msg in history[::2]] == ["推荐一道川菜", "有辣的吗", "再来一道"]
+
+        # 读取之后、保存之前被其他进程写入：保存时冲突，在最新的会话上重放本轮
+        session = await first._get_or_create_session("s1")
+        await second.chat(message="不要太辣", session_id="s1")
+        persisted = await first._persist_turn("s1", session, lambda fresh: fresh.update(user_id="u1"))
+        assert persisted is not session and persisted["user_id"] == "u1"
+        assert persisted["version"] == await first.session_store.current_version("s1")
+        await first.session_store.close()
+        await second.session_store.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(scenario(tmp_dir))
+    print("✅ 过期会话缓存刷新通过")
+
+
+def benchmark_worker_scaling(total_turns=240, latency=0.05, clients=4):
+    """worker 数从1增加到8时的对话吞吐量（每个 worker 处理各自的会话，总轮数固定）"""
+    print(f"\n⏱️ worker 扩展性（CPU 核数 {os.cpu_count()}，模型耗时 {latency * 1e3:.0f}ms，"
+          f"每个 worker {clients} 个并发客户端）...")
+    baseline = None
+    for workers in (1, 2, 4, 8):
+        turns = total_turns // (workers * clients)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            outcomes = _run_workers(
+                tmp_dir, workers, lambda worker: [f"w{worker}-c{index}" for index in range(clients)],
+                turns, latency=latency, clients=clients
+            )
+        elapsed = max(outcome[2] for outcome in outcomes) - min(outcome[1] for outcome in outcomes)
+        throughput = workers * clients * turns / elapsed
+        baseline = baseline or throughput
+        print(f"   {workers} 个 worker：{throughput:.1f} 轮/秒（{throughput / baseline:.2f}x）")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试多 worker 共享会话")
+    print("=" * 50)
+    test_concurrent_workers_same_sessions()
+    test_stale_cache_refresh()
+    benchmark_worker_scaling()
+    print("\n" + "=" * 50)
+    print("🎉 多 worker 共享会话测试完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+会话编码测试脚本
+测试会话编码的往返一致性（时间字段、消息时间戳、共享的分析结果、紧凑表示、未知字段）、格式版本检查、
+JSON-lines 文件的流式解码与按ID查找，以及会话日志兼容旧版本写入的pickle记录
+"""
+
+import asyncio
+import io
+import os
+import pickle
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from app.services import session_codec
+from app.services.session_codec import (
+    decode_session, dump_sessions, encode_session, find_session, iter_sessions
+)
+from app.services.session_records import ChatMessage, compact_session
+from app.services.session_store import AppendOnlySessionStore
+from testing_helpers import chat_turn, make_session
+
+
+def _long_session(session_id, turns=10, history_window=20):
+    """紧凑表示的会话，包含 turns 轮带分析结果的对话"""
+    session = compact_session(make_session(session_id), history_window=history_window, signal_window=5)
+    session["conversation_length"] = 1
+    for turn in range(turns):
+        chat_turn(session, turn)
+    session["conversation_history"].spilled.clear()
+    session["context_summary"] = {"covered": 2, "lines": ["用户偏好：辣"], "omitted": 0}
+    return session
+
+
+def test_round_trip():
+    """测试编码往返：字段、时间、消息与紧凑表示保持不变"""
+    print("🔁 测试会话编码往返...")
+    session = _long_session("s1")
+    session["created_at"] = datetime(2024, 1, 1, 12, 0, 0, 123456)
+    session["version"] = 7
+    session["custom_flag"] = {"vip": True}
+    session["conversation_history"].append({"role": "user", "content": "时间戳不规范", "timestamp": "2024-01-01T12:00:00.000000"})
+    session["conversation_history"].append({"role": "user", "content": "带时区", "timestamp": "2024-01-01T12:00:00+08:00"})
+    session["conversation_history"].append({"role": "user", "content": "无时间戳", "timestamp": None})
+    session["conversation_history"].spilled.clear()
+
+    data = encode_session(session)
+    assert data.startswith(b'{"v":1,"id":"s1",')
+    decoded = decode_session(data)
+    assert decoded["created_at"] == session["created_at"] and decoded["last_activity"] == session["last_activity"]
+    assert [dict(m) for m in decoded["conversation_history"]] == [dict(m) for m in session["conversation_history"]]
+    assert all(isinstance(m, ChatMessage) for m in decoded["conversation_history"])
+    for field in ("intent_history", "emotion_history", "entity_history"):
+        assert decoded[field] == list(session[field])
+    for field in ("user_id", "user_preferences", "interaction_count", "conversation_length",
+                  "context_summary", "version", "custom_flag"):
+        assert decoded[field] == session[field], field
+
+    # 消息与信号历史共享的分析结果只写一次，解码后仍是同一个对象（紧凑表示也不复制）
+    assert decoded["conversation_history"][-5]["intent_scores"] is decoded["intent_history"][-1]
+    compacted = compact_session(decoded, history_window=20, signal_window=5)
+    assert len(compacted["conversation_history"]) == 20 and compacted["conversation_history"].spilled == []
+    assert compacted["conversation_history"][-5]["entities"] is compacted["entity_history"][-1]
+    # 普通字典表示的会话同样可以编码
+    plain = make_session("plain")
+    plain["created_at"] = datetime(2024, 1, 1, 12, 0, tzinfo=timezone.utc)
+    decoded = decode_session(encode_session(plain))
+    assert decoded["conversation_history"][0]["content"] == "plain 想吃辣的"
+    assert decoded["created_at"] == plain["created_at"] and decoded["last_activity"] == plain["last_activity"]
+    assert len(data) < len(pickle.dumps(session, protocol=pickle.HIGHEST_PROTOCOL))
+    print(f"   编码 {len(data)} 字节，pickle {len(pickle.dumps(session, protocol=pickle.HIGHEST_PROTOCOL))} 字节")
+    print("✅ 会话编码往返通过")
+
+
+def test_schema_version():
+    """测试格式版本：更新版本写入的数据被拒绝"""
+    print("\n🏷️ 测试编码格式版本...")
+    data = encode_session(make_session("s1"))
+    future = data.replace(b'{"v":1,', b'{"v":2,', 1)
+    try:
+        decode_session(future)
+        raise AssertionError("应拒绝更新版本的编码")
+    except ValueError as e:
+        assert "版本" in str(e)
+    print("✅ 编码格式版本通过")
+
+
+def test_json_lines_streaming():
+    """测试 JSON-lines 文件：逐行解码全部会话，按ID查找时只解码目标会话"""
+    print("\n📜 测试 JSON-lines 流式解码...")
+    buffer = io.BytesIO()
+    assert dump_sessions((_long_session(f"s{index}", turns=2) for index in range(100)), buffer) == 100
+
+    buffer.seek(0)
+    assert [session["session_id"] for session in iter_sessions(buffer)] == [f"s{index}" for index in range(100)]
+
+    decoded = []
+    original = session_codec.decode_session
+
+    def counting_decode(data):
+        decoded.append(data)
+        return original(data)
+
+    session_codec.decode_session = counting_decode
+    try:
+        buffer.seek(0)
+        found = find_session(buffer, "s42")
+        buffer.seek(0)
+        # s4 是 s42 的前缀，但不会被误匹配
+        assert find_session(buffer, "s4")["session_id"] == "s4"
+        buffer.seek(0)
+        assert find_session(buffer, "missing") is None
+    finally:
+        session_codec.decode_session = original
+    assert found["session_id"] == "s42" and found["conversation_length"] == 5
+    assert len(decoded) == 2
+    print("✅ JSON-lines 流式解码通过")
+
+
+def test_log_store_reads_legacy_pickle_records():
+    """测试会话日志：新记录使用会话编码，旧版本写入的pickle记录仍能读取"""
+    print("\n🧩 测试会话日志兼容旧的pickle记录...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.log")
+        store = AppendOnlySessionStore(path)
+        # 模拟旧版本写入的记录
+        legacy = make_session("legacy")
+        store._append(store.OP_HISTORY, "legacy", 0.0, pickle.dumps([{"role": "user", "content": "更早的消息"}]))
+        store._append(store.OP_PUT, "legacy", legacy["last_activity"].timestamp(), pickle.dumps(legacy))
+
+        # 热历史只保留8条，被挤出的消息作为冷历史记录写入
+        session = compact_session(make_session("new"), history_window=8, signal_window=5)
+        session["conversation_length"] = 1
+        for turn in range(16):
+            chat_turn(session, turn)
+        asyncio.run(store.save(session))
+        asyncio.run(store.close())
+
+        reopened = AppendOnlySessionStore(path)
+        offset, record_len, _ = reopened._index["new"]
+        with open(path, "rb") as f:
+            assert reopened._read_record(f, offset, record_len).startswith(b'{"v":1,"id":"new",')
+        assert asyncio.run(reopened.load("legacy"))["user_preferences"] == {"taste_preferences": ["spicy"]}
+        assert [m["content"] for m in asyncio.run(reopened.load_history("legacy"))] == ["更早的消息", "legacy 想吃辣的"]
+        history = asyncio.run(reopened.load_history("new"))
+        assert len(history) == 33 and history[0]["content"] == "new 想吃辣的"
+        assert history[-1]["timestamp"] == "2024-01-01T12:00:01"
+        asyncio.run(reopened.close())
+    print("✅ 会话日志兼容旧的pickle记录通过")
+
+
+def benchmark_session_codec(sessions=50_000, turns=5):
+    """编码/解码吞吐量与文件大小：pickle 与会话编码（JSON-lines），以及按ID读取单个会话"""
+    print(f"\n⏱️ {sessions} 个会话（每个 {turns} 轮对话），json 实现："
+          f"{'orjson' if session_codec.orjson is not None else '标准库 json'}...")
+    # 每个会话是独立的对象，避免pickle的对象复用缩小文件
+    corpus = [_long_session(f"session-{index:06d}", turns=turns) for index in range(sessions)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        pickle_path = os.path.join(tmp, "sessions.pkl")
+        start = time.perf_counter()
+        with open(pickle_path, "wb") as f:
+            pickle.dump({session["session_id"]: session for session in corpus}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        encode = time.perf_counter() - start
+        start = time.perf_counter()
+        with open(pickle_path, "rb") as f:
+            loaded = pickle.load(f)
+        decode = time.perf_counter() - start
+        start = time.perf_counter()
+        with open(pickle_path, "rb") as f:
+            pickle.load(f)["session-025000"]
+        single = time.perf_counter() - start
+        results["pickle（整体文件）"] = (encode, decode, single, os.path.getsize(pickle_path))
+        del loaded
+
+        # 原会话日志的做法：每个会话单独pickle为一条记录
+        start = time.perf_counter()
+        payloads = [pickle.dumps(session, protocol=pickle.HIGHEST_PROTOCOL) for session in corpus]
+        encode = time.perf_counter() - start
+        start = time.perf_counter()
+        for payload in payloads:
+            pickle.loads(payload)
+        decode = time.perf_counter() - start
+        results["pickle（逐个会话）"] = (encode, decode, None, sum(len(payload) for payload in payloads))
+        del payloads
+
+        lines_path = os.path.join(tmp, "sessions.jsonl")
+        start = time.perf_counter()
+        with open(lines_path, "wb") as f:
+            dump_sessions(corpus, f)
+        encode = time.perf_counter() - start
+        start = time.perf_counter()
+        with open(lines_path, "rb") as f:
+            for _ in iter_sessions(f):
+                pass
+        decode = time.perf_counter() - start
+        start = time.perf_counter()
+        with open(lines_path, "rb") as f:
+            assert find_session(f, "session-025000")["session_id"] == "session-025000"
+        single = time.perf_counter() - start
+        results["会话编码（JSON-lines）"] = (encode, decode, single, os.path.getsize(lines_path))
+
+        log_path = os.path.join(tmp, "sessions.log")
+        store = AppendOnlySessionStore(log_path)
+        start = time.perf_counter()
+        asyncio.run(store.save_many(corpus))
+        encode = time.perf_counter() - start
+        start = time.perf_counter()
+        for session in corpus:
+            store._get(session["session_id"])
+        decode = time.perf_counter() - start
+        start = time.perf_counter()
+        assert store._get("session-025000")["session_id"] == "session-025000"
+        single = time.perf_counter() - start
+        asyncio.run(store.close())
+        results["会话日志（逐条记录）"] = (encode, decode, single, os.path.getsize(log_path))
+
+    for label, (encode, decode, single, size) in results.items():
+        print(f"   {label}：编码 {sessions / encode:,.0f} 个/秒，解码 {sessions / decode:,.0f} 个/秒，"
+              f"{size / 1024 / 1024:.1f}MB（{size / sessions:.0f} 字节/会话）"
+              + (f"，读取单个会话 {single * 1e3:.1f}ms" if single is not None else ""))
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试会话编码")
+    print("=" * 50)
+    test_round_trip()
+    test_schema_version()
+    test_json_lines_streaming()
+    test_log_store_reads_legacy_pickle_records()
+    benchmark_session_codec()
+    print("\n" + "=" * 50)
+    print("🎉 会话编码测试完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+会话锁与批量保存测试脚本
+测试同一会话的并发对话依次进行（后一轮能看到前一轮的对话）、不同会话互不阻塞，
+会话修改按间隔批量保存（一个写事务保存多个会话）、关闭时保存剩余修改，以及批量保存时的版本冲突重放
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from app.services.fake_llm import FakeChatModel
+from app.services.session_commit import SessionLocks
+from testing_helpers import make_service
+
+
+class RecordingChatModel(FakeChatModel):
+    """记录每次调用收到的消息条数"""
+
+    def __init__(self, latency):
+        super().__init__(latency=latency)
+        self.prompt_sizes = []
+
+    async def ainvoke(self, messages):
+        self.prompt_sizes.append(len(messages))
+        return await super().ainvoke(messages)
+
+
+def _count_transactions(service):
+    """统计会话存储的写事务数及每个事务保存的会话数"""
+    batches = []
+    save_many = service.session_store.save_many
+
+    async def counting_save_many(sessions):
+        batches.append(len(sessions))
+        return await save_many(sessions)
+
+    service.session_store.save_many = counting_save_many
+    return batches
+
+
+def test_session_locks():
+    """测试会话锁：同一会话串行、不同会话并行，锁用完即释放"""
+    print("🔒 测试会话锁...")
+
+    async def scenario(tmp_dir):
+        service = make_service(tmp_dir, latency=0.2, LLM_CACHE_ENABLED=False)
+        service.chat_model = RecordingChatModel(latency=0.05)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            service.chat(message=f"第{turn}个问题：推荐一道菜", session_id="same") for turn in range(5)
+        ])
+        serial = time.perf_counter() - start
+        # 每一轮都看到之前各轮的对话：系统提示词 + 之前的消息 + 当前消息
+        assert service.chat_model.prompt_sizes == [2, 4, 6, 8, 10]
+        assert [result["conversation_length"] for result in results] == [2, 4, 6, 8, 10]
+        history = await service.session_store.load_history("same")
+        assert [msg["role"] for msg in history] == ["user", "assistant"] * 5
+        assert all(reply["content"].endswith(question["content"]) for question, reply in zip(history[::2], history[1::2]))
+
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            service.chat(message="推荐一道菜", session_id=f"other{index}") for index in range(5)
+        ])
+        parallel = time.perf_counter() - start
+        assert serial >= 5 * 0.05 and parallel < 2 * 0.05
+        assert len(service.session_locks) == 0
+        await service.session_store.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(scenario(tmp_dir))
+
+    async def cancelled_waiter():
+        locks = SessionLocks()
+        async with locks.hold("s"):
+            waiter = asyncio.ensure_future(locks.hold("s").__aenter__())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            assert locks.locked("s")
+        assert not locks.locked("s") and len(locks) == 0
+
+    asyncio.run(cancelled_waiter())
+    print("✅ 会话锁通过")
+
+
+def test_group_commit():
+    """测试批量保存：多轮对话的修改合并到少数写事务中，关闭时保存剩余修改"""
+    print("\n📦 测试会话批量保存...")
+
+    async def scenario(tmp_dir):
+        service = make_service(tmp_dir, latency=0.01, LLM_CACHE_ENABLED=False, SESSION_FLUSH_INTERVAL_SECONDS=0.1)
+        batches = _count_transactions(service)
+
+        async def client(index):
+            for turn in range(3):
+                await service.chat(message=f"第{turn}轮：推荐一道菜", session_id=f"s{index}")
+
+        await asyncio.gather(*(client(index) for index in range(20)))
+        # 对话结束时还没有写入存储
+        assert batches == [] and service.session_committer.stats()["pending_sessions"] == 20
+        assert await service.session_store.load("s0") is None
+        # 会话信息接口先保存该会话
+        info = await service.get_session_info("s0")
+        assert len(info["conversation_history"]) == 6 and batches == [1]
+
+        await asyncio.sleep(0.25)
+        assert batches == [1, 19]
+        stats = service.session_committer.stats()
+        assert stats["pending_sessions"] == 0 and stats["turns_saved"] == 60 and stats["sessions_saved"] == 20
+        for index in range(20):
+            assert (await service.session_store.load(f"s{index}"))["conversation_length"] == 6
+
+        # 关闭时保存剩余修改
+        await service.chat(message="最后一个问题", session_id="s0")
+        await service.session_committer.stop()
+        assert batches == [1, 19, 1]
+        assert (await service.session_store.load("s0"))["conversation_length"] == 8
+        await service.session_store.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(scenario(tmp_dir))
+    print("✅ 会话批量保存通过")
+
+
+def test_group_commit_conflict_replay():
+    """测试批量保存时的版本冲突：在最新的会话上按顺序重放尚未保存的各轮修改"""
+    print("\n🔁 测试批量保存的冲突重放...")
+
+    async def scenario(tmp_dir):
+        first = make_service(tmp_dir, latency=0, LLM_CACHE_ENABLED=False, SESSION_FLUSH_INTERVAL_SECONDS=60)
+        second = make_service(tmp_dir, latency=0, LLM_CACHE_ENABLED=False)
+        await first.chat(message="第一个问题", session_id="s1")
+        await first.session_committer.flush()
+        # first 连续两轮尚未保存期间，另一个进程写入了同一会话
+        await first.chat(message="第二个问题", session_id="s1")
+        await first.chat(message="第三个问题", session_id="s1")
+        await second.chat(message="另一个进程的问题", session_id="s1")
+        await first.session_committer.stop()
+
+        stats = first.session_committer.stats()
+        assert stats["conflicts"] == 1 and stats["pending_sessions"] == 0
+        history = await first.session_store.load_history("s1")
+        assert [msg["content"] for msg in history[::2]] == ["第一个问题", "另一个进程的问题", "第二个问题", "第三个问题"]
+        assert first.user_sessions["s1"]["conversation_length"] == 8
+        # 重新加载不计入交互次数，重放的每一轮各计一次（第一轮新建会话不计）
+        assert first.user_sessions["s1"]["interaction_count"] == 3
+        assert (await first.session_store.load("s1"))["interaction_count"] == 3
+        await first.session_store.close()
+        await second.session_store.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(scenario(tmp_dir))
+    print("✅ 批量保存的冲突重放通过")
+
+
+def test_clear_session_during_turn():
+    """测试删除会话时有进行中的对话轮次：等这轮结束后删除，待保存的修改不会把会话重新写回存储"""
+    print("\n🧽 测试删除进行中的会话...")
+
+    async def scenario(tmp_dir):
+        service = make_service(tmp_dir, latency=0.1, LLM_CACHE_ENABLED=False, SESSION_FLUSH_INTERVAL_SECONDS=60)
+        await service.chat(message="第一个问题", session_id="s1")
+        await service.session_committer.flush()
+        turn = asyncio.ensure_future(service.chat(message="第二个问题", session_id="s1"))
+        await asyncio.sleep(0.02)
+        assert await service.clear_session("s1")
+        assert turn.done() and (await turn)["conversation_length"] == 4
+        assert not service.session_committer.is_dirty("s1") and "s1" not in service.user_sessions
+        await service.session_committer.stop()
+        assert await service.session_store.load("s1") is None
+        assert await service._get_session("s1") is None
+        await service.session_store.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(scenario(tmp_dir))
+    print("✅ 删除进行中的会话通过")
+
+
+def benchmark_group_commit(sessions=200, turns=5):
+    """并发对话的吞吐量与写事务数：每轮立即保存与批量保存"""
+    print(f"\n⏱️ {sessions} 个会话并发、每个 {turns} 轮对话...")
+
+    async def scenario(tmp_dir, interval):
+        service = make_service(tmp_dir, latency=0, LLM_CACHE_ENABLED=False, SESSION_FLUSH_INTERVAL_SECONDS=interval)
+        batches = _count_transactions(service)
+
+        async def client(index):
+            for turn in range(turns):
+                await service.chat(message=f"第{turn}轮：推荐一道菜", session_id=f"s{index}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(index) for index in range(sessions)))
+        await service.session_committer.stop()
+        elapsed = time.perf_counter() - start
+        await service.session_store.close()
+        return elapsed, len(batches)
+
+    for label, interval in (("每轮立即保存", 0), ("批量保存（200ms）", 0.2)):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            elapsed, transactions = asyncio.run(scenario(tmp_dir, interval))
+        print(f"   {label}：{sessions * turns / elapsed:.0f} 轮/秒，{transactions} 个写事务")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试会话锁与批量保存")
+    print("=" * 50)
+    test_session_locks()
+    test_group_commit()
+    test_group_commit_conflict_replay()
+    test_clear_session_during_turn()
+    benchmark_group_commit()
+    print("\n" + "=" * 50)
+    print("🎉 会话锁与批量保存测试完成！")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+过期会话后台清理测试脚本
+测试按最后活动时间排序的过期索引、会话存储的分批过期删除、后台清理任务及其统计，
+以及清理结果持久化（重启后过期会话不再出现）
+"""
+
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from app.services.session_reaper import ExpiryIndex
+from app.services.session_store import AppendOnlySessionStore, SQLiteSessionStore
+from testing_helpers import make_service, make_session
+
+
+def test_expiry_index():
+    """测试过期索引：重复更新、删除、按时间顺序弹出，堆大小有界"""
+    print("⏳ 测试过期索引...")
+    index = ExpiryIndex()
+    for key, timestamp in (("a", 10), ("b", 20), ("c", 30), ("d", 40)):
+        index.touch(key, timestamp)
+    index.touch("a", 50)
+    index.discard("c")
+    assert sorted(index.expired(45)) == ["b", "d"] and len(index) == 3
+    assert index.expired(45, limit=1) in (["b"], ["d"])
+    assert index.pop_expired(45) == ["b", "d"]
+    assert index.pop_expired(45) == [] and "a" in index and len(index) == 1
+
+    # 同一批键反复更新时，失效条目被定期清除
+    for round_ in range(1000):
+        for key in range(50):
+            index.touch(f"k{key}", 100 + round_)
+    assert len(index) == 51 and index.heap_size <= 2 * len(index) + 64
+    assert index.pop_expired(1099) == ["a"] and len(index.pop_expired(1100)) == 50
+    print("✅ 过期索引通过")
+
+
+def test_store_batched_expiry():
+    """测试两种会话存储按批删除过期会话，删除结果在重新打开后仍然有效"""
+    print("\n🗑️ 测试会话存储分批过期删除...")
+    cutoff = datetime.now() - timedelta(hours=24)
+
+    async def scenario(tmp_dir):
+        log_path = os.path.join(tmp_dir, "sessions.log")
+        db_path = os.path.join(tmp_dir, "sessions.db")
+        for store in (AppendOnlySessionStore(log_path), SQLiteSessionStore(db_path)):
+            for index in range(10):
+                await store.save(make_session(f"old{index}", hours_ago=48 + index))
+            for index in range(5):
+                await store.save(make_session(f"new{index}"))
+            # 使用中的会话（old9）即使过期也不删除；使用中的会话很多时也不受 SQLite 绑定参数个数的限制
+            busy = {"old9"} | {f"busy{index}" for index in range(40000)}
+            batches = []
+            while True:
+                batch = await store.delete_expired(cutoff, limit=4, exclude=busy)
+                batches.append(batch)
+                if len(batch) < 4:
+                    break
+            assert [len(batch) for batch in batches] == [4, 4, 1]
+            assert sorted(sum(batches, [])) == sorted(f"old{index}" for index in range(9))
+            if isinstance(store, SQLiteSessionStore):
+                # 从最旧的会话删起
+                assert sorted(batches[0]) == [f"old{index}" for index in range(5, 9)]
+            await store.close()
+
+        reopened = AppendOnlySessionStore(log_path)
+        assert sorted(reopened.session_ids()) == [f"new{index}" for index in range(5)] + ["old9"]
+        assert reopened.expired_session_ids(cutoff) == ["old9"]
+        await reopened.close()
+        reopened = SQLiteSessionStore(db_path)
+        assert await reopened.load("old0") is None and await reopened.load("new0") is not None
+        assert await reopened.load("old9") is not None
+        await reopened.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(scenario(tmp_dir))
+    print("✅ 会话存储分批过期删除通过")
+
+
+async def _age_session(service, session_id, hours):
+    """把会话的最后活动时间改到 hours 小时之前（内存与存储）"""
+    session = service.user_sessions[session_id]
+    session["last_activity"] = datetime.now() - timedelta(hours=hours)
+    await service.session_store.save(session)
+    service.session_expiry.touch(session_id, session["last_activity"].timestamp())
+
+
+def test_reaper_service():
+    """测试对话服务的过期清理：内存和存储都被清理，重启后不再出现，后台任务定期运行"""
+    print("\n🧹 测试后台过期会话清理...")
+
+    async def scenario(tmp_dir):
+        service = make_service(tmp_dir, latency=0, SESSION_REAPER_BATCH_SIZE=2)
+        for session_id in ("s1", "s2", "s3", "s4"):
+            await service.chat(message="推荐一道川菜", session_id=session_id)
+        for session_id in ("s1", "s2", "s3"):
+            await _age_session(service, session_id, hours=48)
+        # 只在内存中过期（存储中的会话刚被其他 worker 更新）：只移出缓存
+        service.session_expiry.touch("s4", (datetime.now() - timedelta(hours=48)).timestamp())
+
+        assert await service.cleanup_old_sessions(24) == 4
+        assert service.user_sessions == {} and len(service.session_expiry) == 0
+        stats = service.session_reaper.stats()
+        assert stats["runs"] == 1 and stats["deleted"] == 3 and stats["evicted"] == 1
+        assert stats["running"] is False
+
+        # 有进行中对话的会话：清理不等待这轮对话，也不删除该会话
+        await service.chat(message="你好", session_id="busy")
+        await _age_session(service, "busy", hours=48)
+        turn_started = asyncio.Event()
+
+        async def slow_turn():
+            async with service.session_locks.hold("busy"):
+                turn_started.set()
+                await asyncio.sleep(1.0)
+
+        turn = asyncio.ensure_future(slow_turn())
+        await turn_started.wait()
+        started = time.perf_counter()
+        assert await service.cleanup_old_sessions(24) == 0
+        assert time.perf_counter() - started < 0.5
+        assert "busy" in service.user_sessions and "busy" in service.session_expiry
+        assert await service.session_store.load("busy") is not None
+        await turn
+        assert await service.cleanup_old_sessions(24) == 1 and "busy" not in service.user_sessions
+
+        # 重新启动后过期会话不再出现，未过期的会话仍可加载
+        restarted = make_service(tmp_dir, latency=0)
+        assert await restarted._get_session("s1") is None
+        assert (await restarted._get_session("s4"))["conversation_length"] == 2
+        await restarted.session_store.close()
+
+        # 后台任务
+        service.session_reaper.interval_seconds = 0.05
+        await service.chat(message="你好", session_id="s5")
+        service.session_reaper.start()
+        await _age_session(service, "s5", hours=48)
+        await asyncio.sleep(0.3)
+        stats = service.session_reaper.stats()
+        assert stats["running"] and stats["runs"] >= 2 and "s5" not in service.user_sessions
+        await service.session_reaper.stop()
+        assert service.session_reaper.stats()["running"] is False
+        await service.session_store.close()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(scenario(tmp_dir))
+    print("✅ 后台过期会话清理通过")
+
+
+def benchmark_reaper_tick(sessions=200_000, interval_seconds=60, ttl_hours=24, ticks=20):
+    """单次清理找出过期会话的耗时：遍历全部会话（原 cleanup_old_sessions 的做法）与过期索引"""
+    ttl = ttl_hours * 3600
+    print(f"\n⏱️ {sessions} 个会话、TTL {ttl_hours}h、每 {interval_seconds}s 清理一次的单次耗时...")
+    now = datetime.now()
+    user_sessions = {
+        f"s{index}": {"last_activity": now - timedelta(seconds=random.uniform(0, ttl))} for index in range(sessions)
+    }
+    index = ExpiryIndex()
+    for session_id, session in user_sessions.items():
+        index.touch(session_id, session["last_activity"].timestamp())
+
+    cutoffs = [now - timedelta(seconds=ttl - interval_seconds * (tick + 1)) for tick in range(ticks)]
+    start = time.perf_counter()
+    for cutoff in cutoffs:
+        [session_id for session_id, session in user_sessions.items() if session["last_activity"] < cutoff]
+    scan = (time.perf_counter() - start) / ticks
+    start = time.perf_counter()
+    expired = sum(len(index.pop_expired(cutoff.timestamp())) for cutoff in cutoffs)
+    heap = (time.perf_counter() - start) / ticks
+    print(f"   遍历全部会话 {scan * 1e3:.2f}ms，过期索引 {heap * 1e3:.3f}ms（每次约 {expired // ticks} 个过期）")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试过期会话后台清理")
+    print("=" * 50)
+    test_expiry_index()
+    test_store_batched_expiry()
+    test_reaper_service()
+    benchmark_reaper_tick()
+    print("\n" + "=" * 50)
+    print("🎉 过期会话后台清理测试完成！")
+
+
+if __name__ == "__main__":
+    main()
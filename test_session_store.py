@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+会话存储测试脚本
+测试追加写会话日志与SQLite会话存储，以及定长热历史被挤出的消息写入冷存储
+"""
+
+import asyncio
+import json
+import os
+import pickle
+import sys
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from app.services.session_records import ChatMessage, compact_session
+from app.services.session_store import AppendOnlySessionStore, SQLiteSessionStore
+from testing_helpers import chat_turn, make_session
+
+
+def _run(coro):
+    return asyncio.run(coro)
+
+
+def test_put_get_and_reopen():
+    """测试保存、重启后按需加载"""
+    print("💾 测试会话保存与重新加载...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.log")
+        store = AppendOnlySessionStore(path)
+        for i in range(10):
+            _run(store.save(make_session(f"s{i}")))
+        session = make_session("s3")
+        session["interaction_count"] = 5
+        _run(store.save(session))
+        _run(store.close())
+
+        reopened = AppendOnlySessionStore(path)
+        assert len(reopened) == 10
+        assert _run(reopened.load("s3"))["interaction_count"] == 5
+        assert _run(reopened.load("missing")) is None
+        _run(reopened.close())
+    print("✅ 会话保存与重新加载通过")
+
+
+def test_torn_tail_is_truncated():
+    """测试崩溃时写了一半的记录被丢弃"""
+    print("\n🧯 测试崩溃恢复...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.log")
+        store = AppendOnlySessionStore(path)
+        _run(store.save(make_session("a")))
+        _run(store.save(make_session("b")))
+        _run(store.close())
+        intact_size = os.path.getsize(path)
+
+        # 模拟进程在写记录时崩溃
+        with open(path, "ab") as f:
+            f.write(b"\x40\x00\x00\x00partial")
+
+        recovered = AppendOnlySessionStore(path)
+        assert len(recovered) == 2
+        assert _run(recovered.load("b"))["session_id"] == "b"
+        assert os.path.getsize(path) == intact_size
+        _run(recovered.close())
+
+        # 未刷盘时中间的记录也可能损坏：从第一条校验失败的记录起截断
+        store = AppendOnlySessionStore(path)
+        offset = store._index["b"][0]
+        _run(store.save(make_session("c")))
+        _run(store.close())
+        with open(path, "r+b") as f:
+            f.seek(offset + 20)
+            f.write(b"\x00\x00\x00\x00")
+        recovered = AppendOnlySessionStore(path)
+        assert recovered.session_ids() == ["a"]
+        assert os.path.getsize(path) == offset
+        _run(recovered.close())
+    print("✅ 崩溃恢复通过")
+
+
+def test_delete_expire_and_compact():
+    """测试删除、过期查询与压缩"""
+    print("\n🗜️ 测试删除与压缩...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.log")
+        store = AppendOnlySessionStore(path, compact_min_bytes=0)
+        _run(store.save(make_session("old", hours_ago=48)))
+        _run(store.save(make_session("new")))
+        for _ in range(20):
+            _run(store.save(make_session("new")))
+
+        expired = store.expired_session_ids(datetime.now() - timedelta(hours=24))
+        assert expired == ["old"]
+        assert _run(store.delete("old"))
+        assert not _run(store.delete("old"))
+        assert os.path.getsize(path) <= 2 * store._live_bytes
+        _run(store.close())
+
+        reopened = AppendOnlySessionStore(path)
+        assert reopened.session_ids() == ["new"]
+        _run(reopened.close())
+    print("✅ 删除与压缩通过")
+
+
+def test_sqlite_store_history_window():
+    """测试SQLite存储：增量写入消息、按窗口读取、过期清理"""
+    print("\n🗄️ 测试SQLite会话存储...")
+
+    async def scenario(db_path):
+        store = SQLiteSessionStore(db_path, history_window=4)
+        session = make_session("chat")
+        session["conversation_history"] = []
+        session["conversation_length"] = 0
+        for turn in range(5):
+            for role in ("user", "assistant"):
+                session["conversation_history"].append({"role": role, "content": f"{role}-{turn}", "timestamp": None})
+                session["conversation_length"] += 1
+            await store.save(session)
+        await store.save(make_session("stale", hours_ago=48))
+
+        loaded = await store.load("chat")
+        assert loaded["conversation_length"] == 10
+        assert [m["content"] for m in loaded["conversation_history"]] == \
+            ["user-3", "assistant-3", "user-4", "assistant-4"]
+        assert loaded["user_preferences"] == {"taste_preferences": ["spicy"]}
+        assert len(await store.load_history("chat")) == 10
+
+        expired = await store.delete_expired(datetime.now() - timedelta(hours=24))
+        assert expired == ["stale"]
+        assert await store.load("stale") is None
+        assert await store.delete("chat")
+        assert await store.load_history("chat") == []
+        await store.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _run(scenario(os.path.join(tmp, "sessions.db")))
+    print("✅ SQLite会话存储通过")
+
+
+def test_bounded_history_spill():
+    """测试定长热历史：被挤出的消息（包括尚未保存的）写入冷存储，完整历史可以读回"""
+    print("\n🧊 测试热历史溢出到冷存储...")
+
+    async def scenario(store, reopen):
+        session = compact_session(make_session("long"), history_window=4, signal_window=3)
+        assert isinstance(session["conversation_history"][0], ChatMessage)
+        session["conversation_length"] = 1
+        for turn in range(10):
+            chat_turn(session, turn)
+            # 每三轮才保存一次，期间被挤出的消息暂存在 spilled 中
+            if turn % 3 == 2 or turn == 9:
+                await store.save(session)
+                assert session["conversation_history"].spilled == []
+        assert len(session["conversation_history"]) == 4 and len(session["intent_history"]) == 3
+
+        store = await reopen(store)
+        history = await store.load_history("long")
+        assert len(history) == 21 and history[0]["content"] == "long 想吃辣的"
+        assert [m["content"][:4] for m in history[1::2]] == [f"第{turn}轮：" for turn in range(10)]
+        assert history[1]["intent_scores"]["recommendation"] == 0.6
+        loaded = compact_session(await store.load("long"), history_window=4, signal_window=3)
+        assert [m["content"] for m in loaded["conversation_history"]] == [m["content"] for m in history[-4:]]
+        assert loaded["conversation_history"].spilled == [] and len(loaded["entity_history"]) == 3
+        assert await store.delete("long") and await store.load_history("long") == []
+        await store.close()
+
+    async def reopen_log(store):
+        # 压缩并重启后冷历史仍在
+        store.compact()
+        await store.close()
+        return AppendOnlySessionStore(store.path)
+
+    async def reopen_sqlite(store):
+        return store
+
+    with tempfile.TemporaryDirectory() as tmp:
+        _run(scenario(AppendOnlySessionStore(os.path.join(tmp, "sessions.log")), reopen_log))
+        _run(scenario(SQLiteSessionStore(os.path.join(tmp, "sessions.db"), history_window=4), reopen_sqlite))
+    print("✅ 热历史溢出到冷存储通过")
+
+
+def benchmark_session_memory(sessions=200, turns=100):
+    """每个会话的内存占用与pickle大小：原始列表+字典与紧凑表示"""
+    print(f"\n⏱️ {sessions} 个 {turns} 轮会话的内存占用...")
+    template = make_session("bench")
+    for field in ("conversation_history", "intent_history", "emotion_history", "entity_history"):
+        template[field] = []
+    for turn in range(turns):
+        chat_turn(template, turn)
+    # 从存储读回的会话中，每条消息、每个字典都是独立的对象
+    encoded = json.dumps(template, ensure_ascii=False, default=str)
+
+    def measure(build):
+        tracemalloc.start()
+        built = [build() for _ in range(sessions)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size / sessions, len(pickle.dumps(built[0], protocol=pickle.HIGHEST_PROTOCOL))
+
+    legacy, legacy_pickle = measure(lambda: json.loads(encoded))
+    compact, compact_pickle = measure(lambda: _without_spill(compact_session(json.loads(encoded), 20, 5)))
+    print(f"   原始表示 {legacy / 1024:.1f}KB/会话（pickle {legacy_pickle / 1024:.1f}KB），"
+          f"紧凑表示 {compact / 1024:.1f}KB/会话（pickle {compact_pickle / 1024:.1f}KB）")
+
+
+def _without_spill(session):
+    """模拟保存后：被挤出的消息已写入冷存储"""
+    session["conversation_history"].spilled.clear()
+    return session
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试会话存储")
+    print("=" * 50)
+    test_put_get_and_reopen()
+    test_torn_tail_is_truncated()
+    test_delete_expire_and_compact()
+    test_sqlite_store_history_window()
+    test_bounded_history_spill()
+    benchmark_session_memory()
+    print("\n" + "=" * 50)
+    print("🎉 会话存储测试完成！")
+
+
+if __name__ == "__main__":
+    main()
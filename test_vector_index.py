@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+本地向量索引测试脚本
+测试本地文本向量化、暴力/量化/IVF 三种索引的检索结果，以及搜索和推荐中的语义检索阶段
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from app.core.config import settings
+from app.models.schemas import SearchRequest
+from app.services.ai_service import AIService
+from app.services.menu_service import MenuService
+from app.services.vector_index import FlatIndex, HashingEmbedder, IVFIndex, create_vector_index
+from testing_helpers import override_settings, synthetic_menu
+
+
+def _item_texts(items):
+    return [f"{item.name} {item.description} {' '.join(item.ingredients)}" for item in items]
+
+
+def test_embedder():
+    """测试向量化结果确定、已归一化，且相近文本更相似"""
+    print("🧮 测试本地文本向量化...")
+    embedder = HashingEmbedder(dim=256)
+    vectors = embedder.embed_many(["麻辣鸡丁", "宫保鸡丁", "清蒸鲈鱼", ""])
+    assert vectors.shape == (4, 256) and vectors.dtype == np.float32
+    assert np.allclose(np.linalg.norm(vectors[:3], axis=1), 1.0, atol=1e-5)
+    assert not vectors[3].any()
+    assert np.array_equal(HashingEmbedder(dim=256).embed("麻辣鸡丁"), vectors[0])
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+    print("✅ 文本向量化通过")
+
+
+def test_indexes_agree():
+    """测试量化索引和 IVF 索引与暴力检索结果基本一致"""
+    print("\n🧭 测试向量索引...")
+    items = synthetic_menu(5000, seed=11)
+    embedder = HashingEmbedder(dim=128)
+    vectors = embedder.embed_many(_item_texts(items))
+    queries = embedder.embed_many(["宫保鸡丁", "清蒸鱼", "麻辣豆腐", "甜品", "牛肉面", "凉拌黄瓜"])
+
+    flat = FlatIndex(vectors)
+    int8 = create_vector_index(vectors, kind="int8")
+    ivf = IVFIndex(vectors, n_lists=50, n_probe=10)
+    allowed = np.arange(len(items)) % 2 == 0
+
+    recalls = {"int8": [], "ivf": []}
+    for query in queries:
+        expected, similarities = flat.search(query, 10)
+        assert np.all(np.diff(similarities) <= 1e-6)
+        assert np.allclose(similarities, vectors[expected] @ query, atol=1e-5)
+        for name, index in (("int8", int8), ("ivf", ivf)):
+            found, _ = index.search(query, 10)
+            recalls[name].append(len(set(found.tolist()) & set(expected.tolist())) / 10)
+        filtered, _ = flat.search(query, 10, allowed)
+        assert allowed[filtered].all() and len(filtered) == 10
+    print(f"   int8 召回率 {np.mean(recalls['int8']):.2f}，IVF 召回率 {np.mean(recalls['ivf']):.2f}")
+    assert np.mean(recalls["int8"]) >= 0.9
+    assert np.mean(recalls["ivf"]) >= 0.7
+    print("✅ 向量索引通过")
+
+
+def test_semantic_stages():
+    """测试搜索和推荐中的语义检索阶段"""
+    print("\n🔎 测试语义检索阶段...")
+    menu_service = MenuService()
+    # 关键词检索找不到“鸡肉料理”，语义检索补上含鸡肉的菜
+    keyword_only = menu_service.search_menu_items(SearchRequest(query="鸡肉料理", semantic=False))
+    assert keyword_only.total_count == 0 and keyword_only.results == []
+    semantic = menu_service.search_menu_items(SearchRequest(query="鸡肉料理", semantic=True, limit=3))
+    assert semantic.total_count == 0 and semantic.results
+    assert any("鸡" in item.name + item.description for item in semantic.results)
+
+    # 关键词结果排在前面，语义结果不与之重复，且遵守过滤条件
+    request = SearchRequest(query="豆腐", semantic=True, limit=8, filters={"max_price": 60})
+    response = menu_service.search_menu_items(request)
+    keyword = menu_service.search_menu_items(request.model_copy(update={"semantic": False}))
+    assert response.results[:len(keyword.results)] == keyword.results
+    assert len(set(item.id for item in response.results)) == len(response.results)
+    assert all(item.price <= 60 for item in response.results)
+
+    # 推荐：开启后与用户原话相近的菜品得到加成
+    service = AIService()
+    preferences = {}
+    baseline = service._get_menu_recommendations(preferences, {}, query_text="想吃清蒸鱼")
+    with override_settings(SEMANTIC_SEARCH_ENABLED=True):
+        boosted = service._get_menu_recommendations(preferences, {}, query_text="想吃清蒸鱼")
+    assert baseline != boosted
+    assert "鱼" in boosted[0].name
+    print("✅ 语义检索阶段通过")
+
+
+def benchmark_vector_search(size=200000):
+    """大菜单上三种索引的检索耗时"""
+    print(f"\n⏱️ {size} 个向量的检索耗时...")
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((size, settings.EMBEDDING_DIM)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query = vectors[123] + 0.1 * rng.standard_normal(settings.EMBEDDING_DIM).astype(np.float32)
+    for kind in ("flat", "int8", "ivf"):
+        start = time.perf_counter()
+        index = create_vector_index(vectors, kind=kind)
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(10):
+            found, _ = index.search(query, 10)
+        elapsed = (time.perf_counter() - start) / 10
+        print(f"   {kind:>4}：建索引 {build:.2f}s，每次检索 {elapsed * 1e3:.2f}ms，最近邻 {found[0]}")
+
+
+def main():
+    """主测试函数"""
+    print("🚀 开始测试本地向量索引")
+    print("=" * 50)
+    test_embedder()
+    test_indexes_agree()
+    test_semantic_stages()
+    benchmark_vector_search()
+    print("\n" + "=" * 50)
+    print("🎉 本地向量索引测试完成！")
+
+
+if __name__ == "__main__":
+    main()
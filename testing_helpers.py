@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+测试脚本共用的辅助函数
+临时修改全局配置、创建使用本地假模型的对话服务、模拟上游出错的假模型、构造会话数据和大菜单；各测试脚本只从这里导入，互不导入
+"""
+
+import asyncio
+import os
+import random
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+from langchain.schema import AIMessage, BaseMessage
+from app.core.config import settings
+from app.models.schemas import MenuItem
+from app.services.ai_service import AIService
+from app.services.fake_llm import FakeChatModel
+from app.services.menu_registry import MenuRegistry
+from app.services.menu_service import MenuService
+
+
+@contextmanager
+def override_settings(**values):
+    """临时修改全局配置"""
+    original = {key: getattr(settings, key) for key in values}
+    for key, value in values.items():
+        setattr(settings, key, value)
+    try:
+        yield
+    finally:
+        for key, value in original.items():
+            setattr(settings, key, value)
+
+
+def make_service(tmp_dir, latency=0.05, **overrides):
+    """创建使用本地假模型的对话服务，会话库放在 tmp_dir 中；overrides 只在创建服务时生效
+
+    默认每轮对话结束立即保存会话，便于直接检查会话存储。
+    """
+    values = {"DATABASE_URL": f"sqlite:///{os.path.join(tmp_dir, 'sessions.db')}", "SESSION_FLUSH_INTERVAL_SECONDS": 0}
+    values.update(overrides)
+    with override_settings(**values):
+        service = AIService(menu_registry=MenuRegistry())
+    service.chat_model = FakeChatModel(latency=latency)
+    return service
+
+
+class FailingChatModel(FakeChatModel):
+    """本地假聊天模型：按固定延迟后抛出异常，用于模拟上游错误"""
+
+    async def ainvoke(self, messages: List[BaseMessage]) -> AIMessage:
+        await asyncio.sleep(self.latency)
+        self.call_count += 1
+        raise RuntimeError("上游错误")
+
+
+def make_session(session_id, hours_ago=0):
+    """只有一条用户消息的普通字典会话"""
+    now = datetime.now() - timedelta(hours=hours_ago)
+    return {
+        "session_id": session_id,
+        "user_id": None,
+        "created_at": now,
+        "last_activity": now,
+        "conversation_history": [{"role": "user", "content": f"{session_id} 想吃辣的"}],
+        "user_preferences": {"taste_preferences": ["spicy"]},
+        "interaction_count": 0,
+        "intent_history": [],
+        "emotion_history": [],
+        "entity_history": []
+    }
+
+
+def chat_turn(session, turn):
+    """模拟一轮对话：用户消息带分析结果，助手消息较长"""
+    intent = {"recommendation": 0.6, "information": 0.1, "comparison": 0.0, "health": 0.0, "allergy": 0.0}
+    emotion = {"positive": 0.5, "negative": 0.0, "neutral": 0.5}
+    entities = {"cuisine_types": ["chinese"], "taste_preferences": ["spicy"], "dietary_restrictions": [],
+                "budget_range": None, "meal_type": None, "cooking_method": None}
+    for field, value in (("intent_history", intent), ("emotion_history", emotion), ("entity_history", entities)):
+        session[field].append(value)
+    session["conversation_history"].append({"role": "user", "content": f"第{turn}轮：有什么辣的菜", "timestamp": "2024-01-01T12:00:00",
+                                            "intent_scores": intent, "emotion_scores": emotion, "entities": entities})
+    session["conversation_history"].append({"role": "assistant", "content": f"第{turn}轮回复：推荐水煮鱼和麻婆豆腐。" * 5,
+                                            "timestamp": "2024-01-01T12:00:01"})
+    session["conversation_length"] = session.get("conversation_length", 0) + 2
+
+
+def synthetic_menu(size, seed=0):
+    """用示例菜单的字段随机组合出大菜单"""
+    rng = random.Random(seed)
+    base = MenuService().get_all_menu_items()
+    chars = "".join(item.name + item.description for item in base)
+    items = []
+    for i in range(size):
+        template = base[i % len(base)]
+        items.append(MenuItem.model_construct(
+            id=str(i),
+            name=f"{template.name}{i}",
+            description=template.description[rng.randrange(len(template.description) // 2):] + rng.choice(chars),
+            price=round(rng.uniform(10, 200), 1),
+            category=template.category,
+            ingredients=rng.sample(template.ingredients, min(3, len(template.ingredients))),
+            allergens=template.allergens,
+            image_url=None,
+            is_seasonal=template.is_seasonal,
+            rating=round(rng.uniform(3.5, 5.0), 1)
+        ))
+    return items